@@ -0,0 +1,27 @@
+from pathlib import Path
+from typing import Dict
+
+from mt_aligner_prep_tool.standins import generate_text
+
+
+def write_corpus(output_dir: Path, size: int, seed: int = 0) -> Dict[str, Path]:
+    """Write a pair of synthetic files BO<id>.txt and EN<id>.txt of about `size` bytes each."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    files = {}
+    for lang in ("bo", "en"):
+        file_path = output_dir / f"{lang.upper()}{size}.txt"
+        if not file_path.exists():
+            file_path.write_text(generate_text(lang, size, seed), encoding="utf-8")
+        files[lang] = file_path
+    return files
+
+
+def find_fixture_corpus(fixture_dir: Path) -> Dict[str, Path]:
+    """A real BO*.txt / EN*.txt pair, e.g. downloaded TM files."""
+    files = {}
+    for lang in ("bo", "en"):
+        matches = sorted(Path(fixture_dir).glob(f"{lang.upper()}*.txt"))
+        if not matches:
+            raise FileNotFoundError(f"No {lang.upper()}*.txt file in {fixture_dir}")
+        files[lang] = matches[0]
+    return files
@@ -0,0 +1,530 @@
+import argparse
+import json
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from benchmarks.corpora import find_fixture_corpus, write_corpus
+from mt_aligner_prep_tool.utility import parse_size
+
+"""Sizes of the synthetic corpora of each profile"""
+PROFILES = {
+    "quick": ["16KB", "1MB"],
+    "full": ["16KB", "1MB", "16MB", "256MB"],
+}
+DEFAULT_THRESHOLD = 0.2
+
+"""Modules whose import time is measured, the CLIs which don't tokenize must stay under the budget"""
+IMPORT_MODULES = ["merge_branch", "tm_checker", "pipeline"]
+FAST_IMPORT_MODULES = ["merge_branch", "tm_checker"]
+IMPORT_TIME_BUDGET = 0.5
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+"""A prepared benchmark run, returns (bytes processed, items processed)"""
+BenchmarkRun = Callable[[], Tuple[int, int]]
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    seconds: float
+    bytes: int
+    items: int
+    item_name: str
+    peak_memory_mb: Optional[float]
+
+    @property
+    def mb_per_s(self) -> float:
+        return self.bytes / (1024 * 1024) / self.seconds
+
+    @property
+    def items_per_s(self) -> float:
+        return self.items / self.seconds
+
+    @property
+    def throughput(self) -> float:
+        """MB/s when the benchmark processes bytes, items/s otherwise"""
+        return self.mb_per_s if self.bytes else self.items_per_s
+
+    def to_dict(self) -> Dict:
+        return {
+            "seconds": round(self.seconds, 6),
+            "bytes": self.bytes,
+            "mb_per_s": round(self.mb_per_s, 3),
+            self.item_name: self.items,
+            f"{self.item_name}_per_s": round(self.items_per_s, 3),
+            "throughput": round(self.throughput, 3),
+            "peak_memory_mb": self.peak_memory_mb,
+        }
+
+
+def measure(name: str, run: BenchmarkRun, item_name: str, repeat: int, trace_memory: bool) -> BenchmarkResult:
+    """
+    Best wall time of `repeat` runs, and the peak python memory of one more run traced with
+    tracemalloc (allocations of child processes are not seen).
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        processed_bytes, items = run()
+        best = min(best, time.perf_counter() - start_time)
+
+    peak_memory_mb = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            run()
+            peak_memory_mb = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 3)
+        finally:
+            tracemalloc.stop()
+    return BenchmarkResult(name, best, processed_bytes, items, item_name, peak_memory_mb)
+
+
+def count_lines(text: str) -> int:
+    return text.count("\n") + 1 if text else 0
+
+
+"""
+Corpus benchmarks, called with a {"bo": path, "en": path} corpus and a work folder and
+returning (item name, prepared run).
+"""
+
+
+def bench_en_sent_tokenizer(corpus: Dict[str, Path], work_dir: Path):
+    from mt_aligner_prep_tool.tokenizers import en_sent_tokenizer
+
+    text = corpus["en"].read_text(encoding="utf-8")
+
+    def run():
+        return len(text.encode("utf-8")), count_lines(en_sent_tokenizer(text))
+
+    return "sentences", run
+
+
+def bench_en_sent_tokenize_file(corpus: Dict[str, Path], work_dir: Path):
+    from mt_aligner_prep_tool.tokenizers import en_sent_tokenize_file
+
+    output_file = work_dir / "tokenized_en.txt"
+
+    def run():
+        return corpus["en"].stat().st_size, en_sent_tokenize_file(corpus["en"], output_file)
+
+    return "sentences", run
+
+
+def bench_bo_sent_tokenizer(corpus: Dict[str, Path], work_dir: Path):
+    from mt_aligner_prep_tool.tokenizers import bo_sent_tokenizer
+
+    text = corpus["bo"].read_text(encoding="utf-8")
+
+    def run():
+        return len(text.encode("utf-8")), count_lines(bo_sent_tokenizer(text))
+
+    return "sentences", run
+
+
+def bench_bo_sent_tokenize_file(corpus: Dict[str, Path], work_dir: Path):
+    from mt_aligner_prep_tool.tokenizers import bo_sent_tokenize_file
+
+    output_file = work_dir / "tokenized_bo.txt"
+
+    def run():
+        return corpus["bo"].stat().st_size, bo_sent_tokenize_file(corpus["bo"], output_file)
+
+    return "sentences", run
+
+
+def bench_split_text_into_mb_chunks(corpus: Dict[str, Path], work_dir: Path):
+    from mt_aligner_prep_tool.tokenizers import split_text_into_mb_chunks
+
+    text = corpus["bo"].read_text(encoding="utf-8")
+
+    def run():
+        return len(text.encode("utf-8")), sum(1 for _ in split_text_into_mb_chunks(text))
+
+    return "chunks", run
+
+
+def bench_tokenize_files(corpus: Dict[str, Path], work_dir: Path):
+    from mt_aligner_prep_tool.pipeline import tokenize_files
+
+    def run():
+        bo_file, en_file = tokenize_files(
+            "0000", corpus["bo"], corpus["en"], output_dir=work_dir
+        )
+        sentences = count_lines(bo_file.read_text()) + count_lines(en_file.read_text())
+        return corpus["bo"].stat().st_size + corpus["en"].stat().st_size, sentences
+
+    return "sentences", run
+
+
+def en_preprocess_chain(text: str) -> str:
+    """The english preprocessing before the Normalizer: one pass per rule, the reference"""
+    for emoji in ["1️⃣", "2️⃣", "3️⃣"]:
+        text = text.replace(emoji, "")
+    for pattern in [r"\r\n", r"\n", r"\s{2,}", r"\t"]:
+        text = re.sub(pattern, " ", text)
+    return text
+
+
+def bench_normalize_en_chain(corpus: Dict[str, Path], work_dir: Path):
+    text = corpus["en"].read_text(encoding="utf-8")
+
+    def run():
+        return len(text.encode("utf-8")), len(en_preprocess_chain(text))
+
+    return "chars", run
+
+
+def bench_normalize_en(corpus: Dict[str, Path], work_dir: Path):
+    from mt_aligner_prep_tool.tokenizers import EN_NORMALIZER
+
+    text = corpus["en"].read_text(encoding="utf-8")
+
+    def run():
+        return len(text.encode("utf-8")), len(EN_NORMALIZER.normalize(text))
+
+    return "chars", run
+
+
+def bench_normalize_en_stream(corpus: Dict[str, Path], work_dir: Path):
+    from mt_aligner_prep_tool.tokenizers import EN_NORMALIZER, EN_STREAM_WINDOW_SIZE, read_text_windows
+
+    def run():
+        windows = read_text_windows(corpus["en"], EN_STREAM_WINDOW_SIZE)
+        chars = sum(len(text) for text in EN_NORMALIZER.normalize_stream(windows))
+        return corpus["en"].stat().st_size, chars
+
+    return "chars", run
+
+
+CORPUS_BENCHMARKS = {
+    "normalize_en_chain": bench_normalize_en_chain,
+    "normalize_en": bench_normalize_en,
+    "normalize_en_stream": bench_normalize_en_stream,
+    "en_sent_tokenizer": bench_en_sent_tokenizer,
+    "en_sent_tokenize_file": bench_en_sent_tokenize_file,
+    "bo_sent_tokenizer": bench_bo_sent_tokenizer,
+    "bo_sent_tokenize_file": bench_bo_sent_tokenize_file,
+    "split_text_into_mb_chunks": bench_split_text_into_mb_chunks,
+    "tokenize_files": bench_tokenize_files,
+}
+
+
+"""Checkpoint and service benchmarks, returning (item name, prepared run)"""
+
+
+def bench_checkpoint_save(work_dir: Path, num_ids: int):
+    from mt_aligner_prep_tool.checkpoint import CheckpointStore
+
+    def run():
+        store = CheckpointStore(Path(tempfile.mkdtemp(dir=work_dir)) / "save.sqlite")
+        for i in range(num_ids):
+            store.save(f"{i:06}", "Tokenization")
+            store.save(f"{i:06}", "Alignment")
+        return 0, 2 * num_ids
+
+    return "checkpoints", run
+
+
+def bench_checkpoint_load(work_dir: Path, num_ids: int):
+    from mt_aligner_prep_tool.checkpoint import CheckpointStore
+
+    store = CheckpointStore(work_dir / "load.sqlite")
+    ids = [f"{i:06}" for i in range(num_ids)]
+    for id_ in ids:
+        store.save(id_, "Tokenization")
+
+    def run():
+        return 0, len(store.load(ids))
+
+    return "ids", run
+
+
+def bench_upload(
+    work_dir: Path,
+    corpus: Dict[str, Path],
+    num_files: int,
+    workers: int,
+    latency: float,
+    compression: Optional[str] = None,
+):
+    """Throughput in uncompressed MB, compressing is worth it when it beats the uncompressed upload"""
+    from mt_aligner_prep_tool.standins import FilesystemS3Client
+    from mt_aligner_prep_tool.upload import S3TransferManager
+
+    files = [corpus["bo"], corpus["en"]]
+
+    def run():
+        """a fresh bucket every run, otherwise the unchanged files are skipped"""
+        manager = S3TransferManager(
+            client=FilesystemS3Client(tempfile.mkdtemp(dir=work_dir), latency=latency)
+        )
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            uploads = [
+                executor.submit(
+                    manager.upload_file,
+                    files[i % 2],
+                    "bucket",
+                    f"{i}/{files[i % 2].name}",
+                    compression,
+                )
+                for i in range(num_files)
+            ]
+            processed_bytes = sum(
+                files[i % 2].stat().st_size for i, upload in enumerate(uploads) if upload.result()
+            )
+        return processed_bytes, num_files
+
+    return "files", run
+
+
+def bench_align(exit_stack: ExitStack, num_requests: int, concurrency: int, latency: float):
+    import asyncio
+
+    from mt_aligner_prep_tool.aligner import AlignerClient
+    from mt_aligner_prep_tool.standins import AlignerStubServer
+
+    """the stub server runs until the end of the benchmarks"""
+    server = exit_stack.enter_context(AlignerStubServer(latency=latency))
+
+    def run():
+        client = AlignerClient(
+            server.url, "token", max_in_flight=concurrency, adaptive=False
+        )
+
+        async def align_all():
+            return await asyncio.gather(
+                *[client.align(str(i), "bo_url", "en_url", None) for i in range(num_requests)]
+            )
+
+        responses = asyncio.run(align_all())
+        client.close()
+        return 0, len(responses)
+
+    return "requests", run
+
+
+def bench_import(module: str):
+    """Startup of a fresh interpreter importing the module, as when its CLI is run."""
+
+    def run():
+        subprocess.run([sys.executable, "-c", f"import mt_aligner_prep_tool.{module}"], check=True)
+        return 0, 1
+
+    return "imports", run
+
+
+def run_benchmarks(
+    sizes: List[str],
+    work_dir: Path,
+    select: Optional[List[str]] = None,
+    fixture_dir: Optional[Path] = None,
+    repeat: int = 3,
+    trace_memory: bool = True,
+    num_checkpoint_ids: int = 10000,
+    upload_workers: Optional[List[int]] = None,
+    aligner_concurrency: Optional[List[int]] = None,
+    num_service_items: int = 200,
+    service_latency: float = 0.02,
+    upload_compressions: Optional[List[str]] = None,
+) -> Dict[str, Dict]:
+    """
+    Run the benchmarks whose name starts with one of `select` (all when None).
+
+    :return: Results keyed by "<benchmark>/<corpus or setting>".
+    """
+    corpora = {size: write_corpus(work_dir / "corpora", parse_size(size)) for size in sizes}
+    if fixture_dir is not None:
+        corpora["fixture"] = find_fixture_corpus(fixture_dir)
+
+    def is_selected(name: str) -> bool:
+        return select is None or any(name.startswith(prefix) for prefix in select)
+
+    exit_stack = ExitStack()
+    benchmarks = []
+    for bench_name, bench in CORPUS_BENCHMARKS.items():
+        for corpus_name, corpus in corpora.items():
+            name = f"{bench_name}/{corpus_name}"
+            benchmarks.append((name, lambda bench=bench, corpus=corpus: bench(corpus, work_dir)))
+    for bench_name, bench in (("checkpoint_save", bench_checkpoint_save), ("checkpoint_load", bench_checkpoint_load)):
+        name = f"{bench_name}/{num_checkpoint_ids}_ids"
+        benchmarks.append((name, lambda bench=bench: bench(work_dir, num_checkpoint_ids)))
+    smallest_corpus = corpora[sizes[0]] if sizes else next(iter(corpora.values()))
+    for workers in upload_workers or [1, 10]:
+        name = f"upload/workers={workers}"
+        benchmarks.append(
+            (
+                name,
+                lambda workers=workers: bench_upload(
+                    work_dir, smallest_corpus, num_service_items, workers, service_latency
+                ),
+            )
+        )
+    for compression in upload_compressions if upload_compressions is not None else ["gzip"]:
+        workers = max(upload_workers or [10])
+        name = f"upload_{compression}/workers={workers}"
+        benchmarks.append(
+            (
+                name,
+                lambda compression=compression, workers=workers: bench_upload(
+                    work_dir,
+                    smallest_corpus,
+                    num_service_items,
+                    workers,
+                    service_latency,
+                    compression,
+                ),
+            )
+        )
+    for concurrency in aligner_concurrency or [1, 10]:
+        name = f"align/concurrency={concurrency}"
+        benchmarks.append(
+            (
+                name,
+                lambda concurrency=concurrency: bench_align(
+                    exit_stack, num_service_items, concurrency, service_latency
+                ),
+            )
+        )
+
+    for module in IMPORT_MODULES:
+        benchmarks.append((f"import/{module}", lambda module=module: bench_import(module)))
+
+    results = {}
+    with exit_stack:
+        for name, prepare in benchmarks:
+            if not is_selected(name):
+                continue
+            item_name, run = prepare()
+            result = measure(name, run, item_name, repeat, trace_memory)
+            results[name] = result.to_dict()
+            print(
+                f"{name:45} {result.mb_per_s:10.2f} MB/s {result.items_per_s:12.1f} {item_name}/s "
+                f"peak {result.peak_memory_mb} MB"
+            )
+    return results
+
+
+def compare_to_baseline(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    """
+    :return: Regressions, benchmarks whose throughput dropped more than `threshold`
+             (a fraction) below the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]["throughput"]
+        if result["throughput"] < expected * (1 - threshold):
+            regressions.append(
+                f"{name}: {result['throughput']} < {expected} (baseline) - {threshold:.0%}"
+            )
+    return regressions
+
+
+def check_import_budget(results: Dict[str, Dict], budget: float = IMPORT_TIME_BUDGET) -> List[str]:
+    """
+    :return: The modules of FAST_IMPORT_MODULES which took longer than `budget` seconds to import.
+    """
+    over_budget = []
+    for module in FAST_IMPORT_MODULES:
+        result = results.get(f"import/{module}")
+        if result is not None and result["seconds"] > budget:
+            over_budget.append(f"import/{module}: {result['seconds']:.2f}s > {budget}s budget")
+    return over_budget
+
+
+def get_machine_info() -> Dict:
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "system": platform.system(),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the tokenizers and pipeline stages")
+    parser.add_argument("--profile", choices=PROFILES, default="quick", help="Sizes of the synthetic corpora")
+    parser.add_argument("--sizes", type=str, help="Comma separated corpus sizes, e.g. 64KB,10MB (overrides --profile)")
+    parser.add_argument("--fixture_dir", type=Path, help="Folder with a real BO*.txt / EN*.txt pair to benchmark too")
+    parser.add_argument("--select", type=str, help="Comma separated benchmark name prefixes to run")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark, the best one is kept")
+    parser.add_argument("--no_memory", action="store_true", help="Skip the tracemalloc peak memory run")
+    parser.add_argument("--checkpoint_ids", type=int, default=10000)
+    parser.add_argument("--upload_workers", type=str, default="1,10", help="Upload thread counts to compare")
+    parser.add_argument("--aligner_concurrency", type=str, default="1,10", help="Aligner concurrencies to compare")
+    parser.add_argument("--service_items", type=int, default=200, help="Files uploaded / requests sent per run")
+    parser.add_argument(
+        "--upload_compressions", type=str, default="gzip", help="Upload compressions to compare"
+    )
+    parser.add_argument("--service_latency", type=float, default=0.02, help="Latency of the local stand-ins (s)")
+    parser.add_argument("--output", type=Path, help="Write the results to this json file")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save_baseline", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed throughput drop")
+    parser.add_argument(
+        "--no_baseline", action="store_true", help="Only check the import budget, without a baseline"
+    )
+    parser.add_argument("--work_dir", type=Path, help="Folder for corpora and outputs (default: temporary)")
+    args = parser.parse_args(argv)
+
+    """a missing baseline fails before the run, a gate without one would always pass"""
+    if not (args.save_baseline or args.no_baseline or args.baseline.exists()):
+        print(f"No baseline at {args.baseline}, run with --save_baseline to create one or --no_baseline")
+        return 1
+
+    sizes = args.sizes.split(",") if args.sizes else PROFILES[args.profile]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or Path(temp_dir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+        results = run_benchmarks(
+            sizes,
+            work_dir,
+            select=args.select.split(",") if args.select else None,
+            fixture_dir=args.fixture_dir,
+            repeat=args.repeat,
+            trace_memory=not args.no_memory,
+            num_checkpoint_ids=args.checkpoint_ids,
+            upload_workers=[int(n) for n in args.upload_workers.split(",")],
+            aligner_concurrency=[int(n) for n in args.aligner_concurrency.split(",")],
+            num_service_items=args.service_items,
+            service_latency=args.service_latency,
+            upload_compressions=[c for c in args.upload_compressions.split(",") if c],
+        )
+
+    report = {"machine": get_machine_info(), "results": results}
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        if args.baseline.exists():
+            """keep the baselines of the benchmarks which were not run this time"""
+            saved_results = json.loads(args.baseline.read_text())["results"]
+            report["results"] = {**saved_results, **results}
+        args.baseline.write_text(json.dumps(report, indent=2))
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    regressions = check_import_budget(results)
+    if not args.no_baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get("machine") != report["machine"]:
+            print("Warning: the baseline was recorded on a different machine")
+        regressions += compare_to_baseline(results, baseline["results"], args.threshold)
+        missing = sorted(set(results) - set(baseline["results"]))
+        if missing:
+            print(f"Not in the baseline, not compared: {', '.join(missing)}")
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from mt_aligner_prep_tool.upload import build_aligner_request
+
+"""Responses with these status codes are retried"""
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class AlignerError(Exception):
+    """Alignment request which failed or ran out of retries"""
+
+    pass
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit of the requests in flight, for an endpoint which autoscales.
+
+    Every `limit` healthy responses in a row raise the limit by one (about +1 per round
+    trip), a 429, 5xx, timeout or connection error multiplies it by `backoff_factor`.
+    Requests which were already in flight when the limit dropped don't lower it again, so
+    a burst of failures counts as a single overload. A response slower than
+    `latency_threshold` seconds, when given, counts as an overload too.
+    The limit stays between `min_limit` and `max_limit`.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int,
+        max_limit: int,
+        min_limit: int = 1,
+        backoff_factor: float = 0.5,
+        latency_threshold: Optional[float] = None,
+    ):
+        self.max_limit = max(max_limit, 1)
+        self.min_limit = max(min(min_limit, self.max_limit), 1)
+        self.limit = min(max(initial_limit, self.min_limit), self.max_limit)
+        self.backoff_factor = backoff_factor
+        self.latency_threshold = latency_threshold
+        self.in_flight = 0
+        self._successes = 0
+        self._epoch = 0
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        """created on first use, inside the event loop"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self) -> int:
+        """
+        Wait for a free slot.
+
+        :return: Epoch of the limit the request started with, to pass to release().
+        """
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            return self._epoch
+
+    async def release(self, epoch: int, overloaded: bool, latency: Optional[float] = None):
+        """
+        Free a slot and adapt the limit.
+
+        :param overloaded: the request failed with 429, 5xx, a timeout or a connection error.
+        :param latency: seconds the request took, only checked against latency_threshold.
+        """
+        if (
+            not overloaded
+            and latency is not None
+            and self.latency_threshold is not None
+            and latency > self.latency_threshold
+        ):
+            overloaded = True
+
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            if overloaded:
+                if epoch == self._epoch:
+                    self.limit = max(int(self.limit * self.backoff_factor), self.min_limit)
+                    self._epoch += 1
+                    self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self._successes = 0
+            condition.notify_all()
+
+
+class AlignerClient:
+    """
+    Sends alignment requests from the asyncio event loop of its caller, one coroutine
+    per request. requests is blocking, so the HTTP calls themselves run on a pool of
+    `max_in_flight` threads; the waits for a slot and the backoffs don't hold a thread.
+
+    All requests share one requests.Session, so connections to the aligner endpoint are
+    pooled and reused. The number of requests in flight is adapted by an AdaptiveLimiter,
+    starting at `initial_in_flight` and never above `max_in_flight` (fixed at
+    `max_in_flight` when not `adaptive`). Every request has a timeout, and requests
+    failing with a connection error, a timeout, 429 or 5xx are retried with exponential
+    backoff.
+    """
+
+    def __init__(
+        self,
+        endpoint_url: str,
+        bearer_token: str,
+        max_in_flight: int = 10,
+        connect_timeout: float = 30,
+        read_timeout: float = 3600,
+        max_retries: int = 5,
+        backoff_base: float = 2,
+        backoff_max: float = 120,
+        initial_in_flight: Optional[int] = None,
+        adaptive: bool = True,
+        latency_threshold: Optional[float] = None,
+    ):
+        self.endpoint_url = endpoint_url
+        self.max_in_flight = max_in_flight
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {bearer_token}"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        if initial_in_flight is None or not adaptive:
+            initial_in_flight = max_in_flight
+        self.limiter = AdaptiveLimiter(
+            initial_in_flight,
+            max_in_flight,
+            min_limit=1 if adaptive else max_in_flight,
+            latency_threshold=latency_threshold,
+        )
+
+    def close(self):
+        """Wait for the requests still running on the pool, then close the connections."""
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def get_backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Seconds to wait before retry number `attempt`, honouring a Retry-After header."""
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        backoff = min(self.backoff_base * 2**attempt, self.backoff_max)
+        return backoff * random.uniform(0.5, 1)
+
+    def _post(self, json_data: Dict) -> requests.Response:
+        return self.session.post(self.endpoint_url, json=json_data, timeout=self.timeout)
+
+    async def send(self, json_data: Dict, stats: Optional[Dict] = None) -> Dict:
+        """
+        Send a request to the aligner, retrying on transient failures.
+
+        :param stats: if given, its "retries" count is incremented on every retry.
+        """
+        loop = asyncio.get_running_loop()
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            epoch = await self.limiter.acquire()
+            start_time = time.monotonic()
+            try:
+                response = await loop.run_in_executor(
+                    self._executor, self._post, json_data
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                await self.limiter.release(epoch, overloaded=True)
+                error = f"Request failed while sending request to api: {e}"
+            except Exception:
+                await self.limiter.release(epoch, overloaded=False)
+                raise
+            else:
+                overloaded = response.status_code in RETRY_STATUS_CODES
+                await self.limiter.release(
+                    epoch, overloaded, time.monotonic() - start_time
+                )
+                if response.status_code == 200:
+                    return response.json()
+                error = f"Error with api request respond: {response.status_code}, {response.text}"
+                if not overloaded:
+                    raise AlignerError(error)
+                retry_after = response.headers.get("Retry-After")
+
+            if attempt < self.max_retries:
+                if stats is not None:
+                    stats["retries"] = stats.get("retries", 0) + 1
+                """sleep without holding a slot so other requests can go meanwhile"""
+                await asyncio.sleep(self.get_backoff(attempt, retry_after))
+        raise AlignerError(f"{error} (after {self.max_retries} retries)")
+
+    async def align(
+        self,
+        id_: str,
+        tokenized_tibetan_url: str,
+        tokenized_english_url: str,
+        alignment_version: Optional[str],
+        stats: Optional[Dict] = None,
+    ) -> Dict:
+        json_data = build_aligner_request(
+            id_, tokenized_tibetan_url, tokenized_english_url, alignment_version
+        )
+        response = await self.send(json_data, stats)
+        if isinstance(response, dict) and "error" in response:
+            raise AlignerError(response["error"])
+        return response
@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+"""Maximum number of ids bound to a single sqlite `IN (...)` query"""
+BULK_QUERY_SIZE = 500
+
+RE_ALIGNMENT_STAGE = "re_alignment"
+
+
+def connect(db_path: Path, timeout: float = 60.0) -> sqlite3.Connection:
+    """
+    Open a sqlite connection in WAL mode, which lets many processes read while
+    one of them writes. Writers wait up to `timeout` seconds for the write lock.
+    """
+    connection = sqlite3.connect(str(db_path), timeout=timeout, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def chunked(items: List, size: int = BULK_QUERY_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+class SqliteStore:
+    """
+    Base class of the sqlite backed stores. sqlite connections can't be shared with
+    forked processes or other threads, so a connection is opened per process and thread.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            connection = connect(self.db_path)
+            self._local.connection, self._local.pid = connection, os.getpid()
+            self.create_tables(connection)
+        return connection
+
+    def create_tables(self, connection: sqlite3.Connection):
+        raise NotImplementedError
+
+
+class CheckpointStore(SqliteStore):
+    """
+    Checkpoints of the pipeline stored in sqlite.
+
+    Every stage transition is a single row insert, so saving a checkpoint costs the
+    same no matter how many ids are already recorded, and concurrent pool workers
+    can save checkpoints without overwriting each other.
+    """
+
+    def __init__(self, db_path: Path, legacy_json_file: Optional[Path] = None):
+        super().__init__(db_path)
+        self.legacy_json_file = legacy_json_file
+        self._json_import_checked = False
+
+    def create_tables(self, connection: sqlite3.Connection):
+        connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                version TEXT NOT NULL DEFAULT '',
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (id, stage, version)
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS alignment_inputs (
+                id TEXT NOT NULL,
+                version TEXT NOT NULL DEFAULT '',
+                bo_hash TEXT NOT NULL,
+                en_hash TEXT NOT NULL,
+                aligned_version TEXT NOT NULL DEFAULT '',
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (id, version)
+            );
+            CREATE TABLE IF NOT EXISTS tokenizer_versions (
+                id TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            """
+        )
+        """the import is checked by the first connection of the process only"""
+        if self.legacy_json_file is not None and not self._json_import_checked:
+            self.import_json(connection, self.legacy_json_file)
+            self._json_import_checked = True
+
+    def save(self, id_: str, stage: str, version: Optional[str] = None):
+        """Save a checkpoint for a specific ID and stage."""
+        self.connection.execute(
+            "INSERT OR IGNORE INTO checkpoints (id, stage, version, updated_at) VALUES (?, ?, ?, ?)",
+            (id_, stage, version or "", time.time()),
+        )
+
+    def save_alignment_inputs(
+        self,
+        id_: str,
+        version: Optional[str],
+        bo_hash: str,
+        en_hash: str,
+        aligned_version: Optional[str],
+    ):
+        """
+        Record the hashes of the tokenized files an id was aligned with under `version`.
+
+        :param aligned_version: version holding the alignment, `version` itself unless the
+                                alignment of an earlier version was copied forward.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO alignment_inputs "
+            "(id, version, bo_hash, en_hash, aligned_version, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                id_,
+                version or "",
+                bo_hash,
+                en_hash,
+                aligned_version or "",
+                time.time(),
+            ),
+        )
+
+    def save_tokenizer_version(self, id_: str, version: str):
+        """Record the tokenizer version the current tokenized files of an id were made with."""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO tokenizer_versions (id, version, updated_at) VALUES (?, ?, ?)",
+            (id_, version, time.time()),
+        )
+
+    def load_tokenizer_versions(self, ids: Iterable[str]) -> Dict[str, str]:
+        """
+        Tokenizer version of the tokenized files of each id, ids tokenized before the
+        versions are recorded are missing.
+        """
+        versions: Dict[str, str] = {}
+        for ids_chunk in chunked(list(dict.fromkeys(ids))):
+            placeholders = ",".join("?" * len(ids_chunk))
+            versions.update(
+                self.connection.execute(
+                    f"SELECT id, version FROM tokenizer_versions WHERE id IN ({placeholders})",
+                    ids_chunk,
+                ).fetchall()
+            )
+        return versions
+
+    def load_last_alignment_inputs(self, ids: Iterable[str]) -> Dict[str, Dict]:
+        """
+        Hashes of the tokenized files each id was last aligned with, with the "version"
+        they were recorded under and the "aligned_version" holding the alignment.
+        Ids never aligned since the hashes are recorded are missing.
+        """
+        last_inputs: Dict[str, Dict] = {}
+        for ids_chunk in chunked(list(dict.fromkeys(ids))):
+            placeholders = ",".join("?" * len(ids_chunk))
+            rows = self.connection.execute(
+                "SELECT id, version, bo_hash, en_hash, aligned_version FROM alignment_inputs "
+                f"WHERE id IN ({placeholders}) ORDER BY updated_at",
+                ids_chunk,
+            ).fetchall()
+            for id_, version, bo_hash, en_hash, aligned_version in rows:
+                last_inputs[id_] = {
+                    "version": version or None,
+                    "bo_hash": bo_hash,
+                    "en_hash": en_hash,
+                    "aligned_version": aligned_version or None,
+                }
+        return last_inputs
+
+    def load(self, ids: Optional[Iterable[str]] = None) -> Dict:
+        """
+        Load the checkpoints of `ids` (or of every id when None) in the same shape
+        as the old checkpoint.json, so `is_id_already_*` work on the result.
+        """
+        if ids is None:
+            rows = self.connection.execute(
+                "SELECT id, stage, version FROM checkpoints ORDER BY updated_at"
+            ).fetchall()
+        else:
+            rows = []
+            for ids_chunk in chunked(list(dict.fromkeys(ids))):
+                placeholders = ",".join("?" * len(ids_chunk))
+                rows.extend(
+                    self.connection.execute(
+                        f"SELECT id, stage, version FROM checkpoints WHERE id IN ({placeholders}) ORDER BY updated_at",  # noqa
+                        ids_chunk,
+                    ).fetchall()
+                )
+
+        checkpoints: Dict[str, Dict] = {}
+        for id_, stage, version in rows:
+            id_checkpoint = checkpoints.setdefault(
+                id_,
+                {"Tokenization": False, "Alignment": False, "re_alignment_versions": []},
+            )
+            if stage == RE_ALIGNMENT_STAGE:
+                id_checkpoint["re_alignment_versions"].append(version)
+            else:
+                id_checkpoint[stage] = True
+        return checkpoints
+
+    def import_json(self, connection: sqlite3.Connection, json_file: Path):
+        """
+        One time import of a checkpoint.json written by older versions of the tool,
+        recorded by a marker row. A corrupted file is logged and moved aside to
+        checkpoint.json.corrupted-<timestamp> instead of failing the store.
+        """
+        already_imported = connection.execute(
+            "SELECT 1 FROM meta WHERE key = 'json_imported'"
+        ).fetchone()
+        if already_imported or not json_file.exists():
+            return
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            already_imported = connection.execute(
+                "SELECT 1 FROM meta WHERE key = 'json_imported'"
+            ).fetchone()
+            if already_imported or not json_file.exists():
+                connection.execute("COMMIT")
+                return
+
+            try:
+                checkpoints = json.loads(json_file.read_text() or "{}")
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                corrupted_file = json_file.with_name(f"{json_file.name}.corrupted-{int(time.time())}")
+                logging.error(f"Corrupted checkpoint file {json_file}, moved to {corrupted_file}: {e}")
+                json_file.rename(corrupted_file)
+                connection.execute("COMMIT")
+                return
+
+            now = time.time()
+            rows = []
+            for id_, id_checkpoint in checkpoints.items():
+                for stage in ("Tokenization", "Alignment"):
+                    if id_checkpoint.get(stage):
+                        rows.append((id_, stage, "", now))
+                for version in id_checkpoint.get("re_alignment_versions", []):
+                    rows.append((id_, RE_ALIGNMENT_STAGE, version or "", now))
+            connection.executemany(
+                "INSERT OR IGNORE INTO checkpoints (id, stage, version, updated_at) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            connection.execute(
+                "INSERT INTO meta (key, value) VALUES ('json_imported', ?)",
+                (str(json_file),),
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
@@ -1,6 +1,12 @@
-import json
+import os
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Iterable, Optional
+
+from mt_aligner_prep_tool.checkpoint import CheckpointStore
+from mt_aligner_prep_tool.presigned_url_cache import PresignedUrlCache
+from mt_aligner_prep_tool.tokenization_cache import TokenizationCache
+from mt_aligner_prep_tool.utility import parse_size
+from mt_aligner_prep_tool.workspace import Workspace
 
 
 def _mkdir(path):
@@ -10,54 +16,182 @@ def _mkdir(path):
     return path
 
 
-BASE_PATH = _mkdir(Path.home() / ".mt_files")
+"""Working folder of the pipeline, MT_FILES_PATH points it elsewhere (e.g. for load tests)"""
+BASE_PATH = _mkdir(Path(os.environ.get("MT_FILES_PATH", Path.home() / ".mt_files")))
 BO_FILES_PATH = _mkdir(BASE_PATH / "tibetan_files")
 EN_FILES_PATH = _mkdir(BASE_PATH / "english_files")
 TM_FILES_PATH = _mkdir(Path.home() / ".tm_files")
 
+"""Files being downloaded through the GitHub api, resumed from there after a dropped connection"""
+PARTIAL_DOWNLOADS_PATH = BASE_PATH / "partial_downloads"
+
 """Path to the folder where the tokenized files(both english and tibetan files) will be stored"""
 TOKENIZED_FILES_PATH = _mkdir(BASE_PATH / "tokenized_files")
 
+"""Cache of tokenized files keyed by source file hash, language and tokenizer version"""
+TOKENIZATION_CACHE_PATH = TOKENIZED_FILES_PATH / "cache"
+TOKENIZATION_CACHE_MAX_SIZE = int(
+    os.environ.get("MT_TOKENIZATION_CACHE_MAX_SIZE", 10 * 1024 * 1024 * 1024)
+)
+
+
+"""S3 transfer settings, files larger than the threshold are uploaded in parts of that size"""
+S3_MULTIPART_THRESHOLD = int(
+    os.environ.get("MT_S3_MULTIPART_THRESHOLD", 16 * 1024 * 1024)
+)
+S3_MAX_CONCURRENCY = int(os.environ.get("MT_S3_MAX_CONCURRENCY", 10))
+
+"""Compression ("gzip" or "zstd") of the uploaded tokenized files, uncompressed if unset"""
+S3_UPLOAD_COMPRESSION = os.environ.get("MT_S3_UPLOAD_COMPRESSION") or None
+
+"""Presigned urls of the tokenized files are valid for PRESIGNED_URL_EXPIRATION seconds, a cached
+one is reused while it stays valid for PRESIGNED_URL_MIN_LIFETIME more seconds"""
+PRESIGNED_URL_EXPIRATION = int(os.environ.get("MT_PRESIGNED_URL_EXPIRATION", 36000))
+PRESIGNED_URL_MIN_LIFETIME = int(os.environ.get("MT_PRESIGNED_URL_MIN_LIFETIME", 4 * 3600))
+PRESIGNED_URL_CACHE_FILE = BASE_PATH / "presigned_urls.sqlite"
+
+"""External services, overridable to run against staging or local stand-ins"""
+S3_BUCKET = os.environ.get("MT_S3_BUCKET", "monlam.ai.tms")
+S3_ENDPOINT_URL = os.environ.get("MT_S3_ENDPOINT_URL")
+ALIGNER_ENDPOINT_URL = os.environ.get(
+    "MT_ALIGNER_ENDPOINT_URL",
+    "https://x7ax6peed5uy2pr9.us-east-1.aws.endpoints.huggingface.cloud/",
+)
+GIT_BASE_URL = os.environ.get("MT_GIT_BASE_URL", "git@github.com:")
+
+
+"""Queue of ids shared by the pipeline workers (--queue): a sqlite file on a local disk for the
+workers of one host, or the url of a queue server (workqueue serve) for workers on many hosts"""
+WORK_QUEUE = os.environ.get("MT_WORK_QUEUE", str(BASE_PATH / "work_queue.sqlite"))
+WORK_QUEUE_LEASE_SECONDS = float(os.environ.get("MT_WORK_QUEUE_LEASE_SECONDS", 300))
+"""Shared secret of the queue server, sent by its clients"""
+WORK_QUEUE_TOKEN = os.environ.get("MT_WORK_QUEUE_TOKEN")
+
+
+"""Size cap (e.g. 50GB) of the clones, tokenized files and tokenization cache, the least recently
+used clones are evicted above it. Uploaded tokenized files are only evicted with MT_WORKSPACE_EVICT_TOKENIZED=1"""
+WORKSPACE_MAX_SIZE = (
+    parse_size(os.environ["MT_WORKSPACE_MAX_SIZE"])
+    if os.environ.get("MT_WORKSPACE_MAX_SIZE")
+    else None
+)
+WORKSPACE_EVICT_TOKENIZED = os.environ.get("MT_WORKSPACE_EVICT_TOKENIZED", "") not in ("", "0")
+WORKSPACE_DB_FILE = BASE_PATH / "workspace.sqlite"
+
 
+"""Traces and prometheus textfile of the pipeline runs"""
+METRICS_PATH = BASE_PATH / "metrics"
+
+
+"""Checkpoint file written by older versions, imported once into CHECKPOINT_DB_FILE"""
 CHECKPOINT_FILE = BASE_PATH / "checkpoint.json"
+CHECKPOINT_DB_FILE = BASE_PATH / "checkpoint.sqlite"
+
+_checkpoint_store: Optional[CheckpointStore] = None
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    global _checkpoint_store
+    if _checkpoint_store is None:
+        _checkpoint_store = CheckpointStore(
+            CHECKPOINT_DB_FILE, legacy_json_file=CHECKPOINT_FILE
+        )
+    return _checkpoint_store
 
 
-def load_checkpoint():
-    """Load the last checkpoint or create the file if it doesn't exist."""
-    if not CHECKPOINT_FILE.exists():
-        CHECKPOINT_FILE.touch()  # Create the file if it doesn't exist
-        return []
+_tokenization_cache: Optional[TokenizationCache] = None
 
-    with CHECKPOINT_FILE.open("r") as file:
-        try:
-            return json.load(file)
-        except json.JSONDecodeError:
-            return {}
 
+def get_tokenization_cache() -> TokenizationCache:
+    global _tokenization_cache
+    if _tokenization_cache is None:
+        _tokenization_cache = TokenizationCache(
+            TOKENIZATION_CACHE_PATH, TOKENIZATION_CACHE_MAX_SIZE
+        )
+    return _tokenization_cache
+
+
+_presigned_url_cache: Optional[PresignedUrlCache] = None
+
+
+def get_presigned_url_cache() -> PresignedUrlCache:
+    global _presigned_url_cache
+    if _presigned_url_cache is None:
+        _presigned_url_cache = PresignedUrlCache(
+            PRESIGNED_URL_CACHE_FILE, PRESIGNED_URL_MIN_LIFETIME
+        )
+    return _presigned_url_cache
 
-def save_checkpoint(id_, stage: str, version: str = None):
+
+_workspace: Optional[Workspace] = None
+
+
+def get_workspace() -> Workspace:
+    global _workspace
+    if _workspace is None:
+        _workspace = Workspace(
+            WORKSPACE_DB_FILE,
+            [BO_FILES_PATH, EN_FILES_PATH, TM_FILES_PATH],
+            TOKENIZED_FILES_PATH,
+            max_size=WORKSPACE_MAX_SIZE,
+            evict_tokenized=WORKSPACE_EVICT_TOKENIZED,
+            tokenization_cache=get_tokenization_cache(),
+        )
+    return _workspace
+
+
+def load_checkpoint(ids: Optional[Iterable[str]] = None) -> Dict:
+    """
+    Load the checkpoints of the given ids, or of every id if ids is None.
+
+    :param ids: The IDs to look up, looked up in bulk.
+    """
+    return get_checkpoint_store().load(ids)
+
+
+def save_checkpoint(id_, stage: str, version: Optional[str] = None):
     """
     Save a checkpoint for a specific ID and stage.
 
     :param id_: The ID to save the checkpoint for.
     :param stage: The stage (e.g., 'Tokenization', 'Alignment') of the process.
+    :param version: The alignment version, only used by the 're_alignment' stage.
     """
-    checkpoints = load_checkpoint()
-    if id_ not in checkpoints:
-        checkpoints[id_] = {
-            "Tokenization": False,
-            "Alignment": False,
-            "re_alignment_versions": [],
-        }
-
-    """Save the checkpoint for the ID and stage."""
-    if stage == "re_alignment":
-        checkpoints[id_]["re_alignment_versions"].append(version)
-    else:
-        checkpoints[id_][stage] = True
+    get_checkpoint_store().save(id_, stage, version)
 
-    with CHECKPOINT_FILE.open("w") as file:
-        json.dump(checkpoints, file, indent=4)
+
+def save_alignment_inputs(
+    id_: str,
+    version: Optional[str],
+    bo_hash: str,
+    en_hash: str,
+    aligned_version: Optional[str],
+):
+    """
+    Save the hashes of the tokenized files an ID was aligned with.
+
+    :param version: The alignment version, None for the first alignment.
+    :param aligned_version: The version holding the alignment, `version` unless an earlier
+                            alignment was copied forward.
+    """
+    get_checkpoint_store().save_alignment_inputs(
+        id_, version, bo_hash, en_hash, aligned_version
+    )
+
+
+def load_last_alignment_inputs(ids: Iterable[str]) -> Dict[str, Dict]:
+    """Hashes of the tokenized files the IDs were last aligned with, looked up in bulk."""
+    return get_checkpoint_store().load_last_alignment_inputs(ids)
+
+
+def save_tokenizer_version(id_: str, version: str):
+    """Save the tokenizer version the tokenized files of an ID were made with."""
+    get_checkpoint_store().save_tokenizer_version(id_, version)
+
+
+def load_tokenizer_versions(ids: Iterable[str]) -> Dict[str, str]:
+    """Tokenizer versions of the tokenized files of the IDs, looked up in bulk."""
+    return get_checkpoint_store().load_tokenizer_versions(ids)
 
 
 def is_id_already_aligned(id_: str, id_checkpoints: Dict):
@@ -92,3 +226,4 @@ def load_token():
         raise FileNotFoundError(
             f"Credentials file not found at{str(credentials_file_path)}"
         )
+
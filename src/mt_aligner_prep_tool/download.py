@@ -1,15 +1,29 @@
+import hashlib
 import os
 import shutil
 import subprocess
+import threading
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 import requests
-from github import Github
+
+from mt_aligner_prep_tool.config import GIT_BASE_URL, PARTIAL_DOWNLOADS_PATH
+from mt_aligner_prep_tool.utility import get_folder_size
 
 ORG = "MonlamAI"
 FALLBACK_ORG = "aspiration-ai"
 
+"""Bytes written to disk at a time by the streaming downloads, a dropped connection loses at most one"""
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+"""Attempts of a download, each one resumes where the previous one stopped"""
+DOWNLOAD_ATTEMPTS = 5
+
+"""Seconds to connect and between two received chunks"""
+DOWNLOAD_TIMEOUT = (10, 60)
+
 
 class Error(Exception):
     """Base class for other exceptions"""
@@ -20,15 +34,16 @@ def clone_github_repo(
     repository: str,
     destination_folder: Path,
     organization: str = ORG,
+    shallow: bool = True,
 ):
     try:
-        clone_repo(repository, destination_folder, organization)
+        clone_repo(repository, destination_folder, organization, shallow)
     except Error as e:
         print(f"Failed to clone with {organization}: {e}")
         if organization == ORG:
             try:
                 print(f"Retrying with {FALLBACK_ORG}")
-                clone_repo(repository, destination_folder, FALLBACK_ORG)
+                clone_repo(repository, destination_folder, FALLBACK_ORG, shallow)
             except Error as fallback_e:
                 print(f"Failed to clone with {FALLBACK_ORG}: {fallback_e}")
                 raise Error(f"Both attempts to clone repository {repository} failed.")
@@ -36,12 +51,22 @@ def clone_github_repo(
             raise Error(f"An error occurred while cloning repository {repository} with {organization}: {e}")
 
 
-def clone_repo(repository: str, destination_folder: Path, organization: str):
-    if destination_folder.exists():
-        shutil.rmtree(destination_folder)
-    destination_folder.mkdir(parents=True, exist_ok=True)
+def clone_repo(
+    repository: str, destination_folder: Path, organization: str, shallow: bool = True
+):
+    """
+    shallow: if True, fetch only the latest commit and the .txt files of the repository,
+             and update an existing clone in place instead of cloning it again.
+    """
+    repo_url = f"{GIT_BASE_URL}{organization}/{repository}.git"
     try:
-        repo_url = f"git@github.com:{organization}/{repository}.git"
+        if shallow:
+            transferred_bytes = fetch_txt_files(repo_url, destination_folder)
+            print(f"Fetched {repository}: {transferred_bytes} bytes transferred")
+            return
+        if destination_folder.exists():
+            shutil.rmtree(destination_folder)
+        destination_folder.mkdir(parents=True, exist_ok=True)
         # Make a new folder in destination_folder and clone the repo there
         command = [
             "git",
@@ -52,11 +77,130 @@ def clone_repo(repository: str, destination_folder: Path, organization: str):
         subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     except subprocess.CalledProcessError as e:  # noqa
         """could be due to file name too long"""
+        if destination_folder.exists():
+            shutil.rmtree(destination_folder)
+        destination_folder.mkdir(parents=True, exist_ok=True)
         clone_github_repo_with_api(repository, destination_folder, organization)
     except Exception as e:
         raise Error(f"An error occurred while cloning repository {repo_url}: {e}")
 
 
+def run_git(args: List[str], cwd: Optional[Path] = None) -> str:
+    result = subprocess.run(
+        ["git", *args],
+        check=True,
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    return result.stdout.strip()
+
+
+def get_origin_url(repo_folder: Path) -> Optional[str]:
+    if not (repo_folder / ".git").is_dir():
+        return None
+    try:
+        return run_git(["config", "--get", "remote.origin.url"], cwd=repo_folder)
+    except subprocess.CalledProcessError:
+        return None
+
+
+def fetch_txt_files(repo_url: str, destination_folder: Path) -> int:
+    """
+    Shallow clone (depth 1, without blobs) the repository and check out only its .txt files.
+    If destination_folder is already a clone of repo_url, it is updated in place.
+
+    :return: Number of bytes transferred, measured as the growth of the .git folder.
+    """
+    git_folder = destination_folder / ".git"
+    if get_origin_url(destination_folder) == repo_url:
+        size_before = get_folder_size(git_folder)
+        run_git(
+            ["fetch", "--depth", "1", "--filter=blob:none", "origin", "HEAD"],
+            cwd=destination_folder,
+        )
+        run_git(["reset", "--hard", "FETCH_HEAD"], cwd=destination_folder)
+        return get_folder_size(git_folder) - size_before
+
+    if destination_folder.exists():
+        shutil.rmtree(destination_folder)
+    destination_folder.parent.mkdir(parents=True, exist_ok=True)
+    run_git(
+        [
+            "clone",
+            "--depth",
+            "1",
+            "--filter=blob:none",
+            "--no-checkout",
+            repo_url,
+            str(destination_folder),
+        ]
+    )
+    """sparse checkout of the txt files, blobs of other files are never downloaded"""
+    run_git(["config", "core.sparseCheckout", "true"], cwd=destination_folder)
+    (git_folder / "info").mkdir(exist_ok=True)
+    (git_folder / "info" / "sparse-checkout").write_text("*.txt\n")
+    run_git(["checkout"], cwd=destination_folder)
+    return get_folder_size(git_folder)
+
+
+_github_clients: Dict[str, object] = {}
+_http_sessions: Dict[Tuple[int, int], requests.Session] = {}
+_txt_file_entries: Dict[Tuple[str, str], Dict] = {}
+_lock = threading.Lock()
+
+
+def get_github_client(github_token: str):
+    """Github client shared by all the api downloads of the process."""
+    from github import Github
+
+    with _lock:
+        if github_token not in _github_clients:
+            _github_clients[github_token] = Github(github_token)
+        return _github_clients[github_token]
+
+
+def get_http_session() -> requests.Session:
+    """
+    HTTP session of the current process and thread, its connections are reused by
+    every download. Sessions are not shared between threads or with forked processes.
+    """
+    key = (os.getpid(), threading.get_ident())
+    with _lock:
+        if key not in _http_sessions:
+            _http_sessions[key] = requests.Session()
+        return _http_sessions[key]
+
+
+def get_txt_file_entry(repository: str, organization: str, github_token: str) -> Dict:
+    """
+    Name, git blob sha, size and download url of the .txt file at the root of a
+    repository (the last one listed if there are several). Cached for the process,
+    a retried download doesn't list the repository again.
+    """
+    key = (organization, repository)
+    with _lock:
+        if key in _txt_file_entries:
+            return _txt_file_entries[key]
+
+    repo = get_github_client(github_token).get_repo(f"{organization}/{repository}")
+    entry = None
+    for content_file in repo.get_contents(""):
+        if content_file.name.endswith(".txt"):
+            entry = {
+                "name": content_file.name,
+                "sha": content_file.sha,
+                "size": content_file.size,
+                "download_url": content_file.download_url,
+            }
+    if entry is None:
+        raise Error(f"No .txt file found in {organization}/{repository}")
+    with _lock:
+        _txt_file_entries[key] = entry
+    return entry
+
+
 def clone_github_repo_with_api(
     repository: str, destination_folder: Path, organization: str
 ):
@@ -64,42 +208,111 @@ def clone_github_repo_with_api(
     if github_token is None:
         raise Error("GitHub token not found in environment variables.")
 
-    g = Github(github_token)
     try:
-        repo = g.get_repo(f"{organization}/{repository}")
-        contents = repo.get_contents("")
-
-        target_file_suffix = ".txt"
-        txt_file_name = ""
-        for content_file in contents:
-            if content_file.name.endswith(target_file_suffix):
-                txt_file_name = content_file.name
-
-        # Get the file contents
-        file_contents = repo.get_contents(txt_file_name)
+        entry = get_txt_file_entry(repository, organization, github_token)
         download_file_with_url(
-            file_contents.download_url, f"{repository}.txt", destination_folder
+            entry["download_url"],
+            f"{repository}.txt",
+            destination_folder,
+            expected_size=entry["size"],
+            expected_sha=entry["sha"],
         )
     except Exception as error:
+        """the file may have changed since it was listed"""
+        with _lock:
+            _txt_file_entries.pop((organization, repository), None)
         raise Error(f"An error occurred: {error}")
 
 
+def get_git_blob_sha(file_path: Path) -> str:
+    """sha1 of a file as a git blob, the sha GitHub lists for it."""
+    sha = hashlib.sha1(f"blob {file_path.stat().st_size}\0".encode())
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def download_to_part_file(download_url: str, part_file: Path, session: requests.Session) -> bool:
+    """
+    Append the rest of the file to part_file, asking for the bytes after its current
+    size with a Range request.
+
+    :return: False if the server has nothing after them (416), True otherwise.
+    """
+    offset = part_file.stat().st_size if part_file.exists() else 0
+    """a compressed response body can't be resumed at a byte offset"""
+    headers = {"Accept-Encoding": "identity"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+    with session.get(download_url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        if response.status_code == 416:
+            return False
+        if response.status_code not in (200, 206):
+            raise Error(f"Failed to download file. Status code: {response.status_code}")
+        """200: the server ignored the range and sends the whole file again"""
+        mode = "ab" if response.status_code == 206 else "wb"
+        with open(part_file, mode) as file:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                file.write(chunk)
+    return True
+
+
 def download_file_with_url(
-    download_url: str, new_downloaded_file_name: str, destination_folder: Path
+    download_url: str,
+    new_downloaded_file_name: str,
+    destination_folder: Path,
+    expected_size: Optional[int] = None,
+    expected_sha: Optional[str] = None,
+    session: Optional[requests.Session] = None,
+    attempts: int = DOWNLOAD_ATTEMPTS,
 ):
+    """
+    Stream a file to disk, resuming after dropped connections.
+
+    The file is written to a .part file in PARTIAL_DOWNLOADS_PATH first, named after
+    the expected git blob sha so that it is only resumed for the same content, even by
+    a later run. It is moved into destination_folder once its size and sha are checked.
+
+    :param expected_size: size of the file in bytes, checked if given
+    :param expected_sha: git blob sha1 of the file, checked if given
+    """
     if download_url is None:
         return
-    # Send a GET request to download the file
-    response = requests.get(download_url)
-
+    session = session or get_http_session()
     local_file_path = Path(destination_folder) / new_downloaded_file_name
-    if response.status_code == 200:
-        # Open the local file and save the downloaded content
-        with open(local_file_path, "wb") as local_file:
-            local_file.write(response.content)
-        print(f"File downloaded and saved to {local_file_path}")
-    else:
-        raise Error(f"Failed to download file. Status code: {response.status_code}")
+    PARTIAL_DOWNLOADS_PATH.mkdir(parents=True, exist_ok=True)
+    part_file = PARTIAL_DOWNLOADS_PATH / f"{new_downloaded_file_name}.{expected_sha or 'unknown'}.part"
+
+    for attempt in range(1, attempts + 1):
+        if expected_size is not None and part_file.exists() and part_file.stat().st_size >= expected_size:
+            break
+        try:
+            if not download_to_part_file(download_url, part_file, session):
+                break
+            if expected_size is None or part_file.stat().st_size >= expected_size:
+                break
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.Timeout,
+        ) as e:
+            """the part file keeps what was received, the next attempt resumes after it"""
+            if attempt == attempts:
+                raise Error(f"Download of {download_url} failed after {attempts} attempts: {e}")
+            print(f"Download of {new_downloaded_file_name} interrupted, resuming: {e}")
+            time.sleep(min(2 ** attempt, 30))
+
+    size = part_file.stat().st_size if part_file.exists() else 0
+    if expected_size is not None and size != expected_size:
+        part_file.unlink(missing_ok=True)
+        raise Error(f"Downloaded {size} bytes of {new_downloaded_file_name}, expected {expected_size}")
+    if expected_sha is not None and get_git_blob_sha(part_file) != expected_sha:
+        part_file.unlink()
+        raise Error(f"Downloaded {new_downloaded_file_name} doesn't match its sha {expected_sha}")
+    Path(destination_folder).mkdir(parents=True, exist_ok=True)
+    os.replace(part_file, local_file_path)
+    print(f"File downloaded and saved to {local_file_path}")
 
 
 def find_first_txt_file(folder_path: Path) -> Optional[Path]:
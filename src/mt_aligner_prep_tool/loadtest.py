@@ -0,0 +1,260 @@
+"""
+Load test of the whole pipeline without GitHub, S3 or the aligner endpoint.
+
+The TM repositories are local git repositories of synthetic texts, uploads go to a
+filesystem S3 stand-in and alignment requests to a local aligner stub with configurable
+latency, error rate and 429 behavior. The pipeline runs once per aligner concurrency,
+each run in a fresh process with its own working folder, so the runs can be compared
+to pick the pool sizes before sending a real batch.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from mt_aligner_prep_tool.standins import AlignerStubServer, generate_text
+from mt_aligner_prep_tool.utility import parse_size
+
+ORG = "MonlamAI"
+
+
+def git(*args: str, cwd: Optional[Path] = None, input: Optional[str] = None) -> str:
+    env = dict(
+        os.environ,
+        GIT_AUTHOR_NAME="loadtest",
+        GIT_AUTHOR_EMAIL="loadtest@localhost",
+        GIT_COMMITTER_NAME="loadtest",
+        GIT_COMMITTER_EMAIL="loadtest@localhost",
+    )
+    result = subprocess.run(
+        ["git", *args],
+        check=True,
+        cwd=cwd,
+        input=input,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    return result.stdout.strip()
+
+
+def create_git_remote(remote: Path, file_name: str, text: str):
+    """Bare repository with a single commit holding `text` as `file_name`."""
+    git("init", "-q", "--bare", str(remote))
+    git_dir = f"--git-dir={remote}"
+    blob = git(git_dir, "hash-object", "-w", "--stdin", input=text)
+    tree = git(git_dir, "mktree", input=f"100644 blob {blob}\t{file_name}\n")
+    commit = git(git_dir, "commit-tree", tree, "-m", "Synthetic TM for load tests")
+    git(git_dir, "update-ref", "refs/heads/main", commit)
+    git(git_dir, "symbolic-ref", "HEAD", "refs/heads/main")
+
+
+def create_git_remotes(remotes_dir: Path, ids: List[str], file_size: int):
+    """BO<id> and EN<id> repositories of synthetic texts, different for every id."""
+    for id_ in ids:
+        for lang in ("bo", "en"):
+            repository = f"{lang.upper()}{id_}"
+            remote = remotes_dir / ORG / f"{repository}.git"
+            if not remote.exists():
+                text = generate_text(lang, file_size, seed=int(id_))
+                create_git_remote(remote, f"{repository}.txt", text)
+
+
+def run_pipeline_level(config: Dict) -> Dict:
+    """
+    Run the pipeline once, in a process started with MT_FILES_PATH and MT_GIT_BASE_URL
+    pointing to the load test folders.
+    """
+    from mt_aligner_prep_tool.pipeline import pipeline
+    from mt_aligner_prep_tool.standins import FilesystemS3Client
+    from mt_aligner_prep_tool.upload import S3TransferManager, set_transfer_manager
+
+    set_transfer_manager(
+        S3TransferManager(
+            client=FilesystemS3Client(config["s3_dir"], latency=config["s3_latency"])
+        )
+    )
+    start_time = time.perf_counter()
+    metrics = pipeline(
+        Path(config["ids_file"]),
+        num_tokenize_processes=config["tokenize_processes"],
+        aligner_concurrency=config["aligner_concurrency"],
+        num_download_threads=config["download_threads"],
+        num_upload_threads=config["upload_threads"],
+        metrics_dir=Path(config["metrics_dir"]),
+        aligner_endpoint_url=config["aligner_endpoint_url"],
+        bearer_token="loadtest",
+        aligner_start_concurrency=config["aligner_start_concurrency"],
+        adaptive_aligner_concurrency=config["adaptive"],
+    )
+    seconds = time.perf_counter() - start_time
+
+    records = metrics.records if metrics is not None else []
+    aligned = sum(r["stage"] == "align" and r["outcome"] == "ok" for r in records)
+    limits = [r["aligner_limit"] for r in records if "aligner_limit" in r]
+    return {
+        "aligner_concurrency": config["aligner_concurrency"],
+        "seconds": round(seconds, 3),
+        "ids": config["num_ids"],
+        "aligned": aligned,
+        "failed": config["num_ids"] - aligned,
+        "ids_per_s": round(aligned / seconds, 3),
+        "retries": sum(r["retries"] for r in records),
+        "final_limit": limits[-1] if limits else None,
+    }
+
+
+def run_load_test(
+    work_dir: Path,
+    num_ids: int = 20,
+    file_size: int = 64 * 1024,
+    concurrency_levels: Optional[List[int]] = None,
+    latency: float = 0.5,
+    error_rate: float = 0.0,
+    throttle_rate: float = 0.0,
+    max_concurrent: Optional[int] = None,
+    retry_after: float = 1,
+    s3_latency: float = 0.02,
+    tokenize_processes: Optional[int] = None,
+    download_threads: int = 8,
+    upload_threads: int = 10,
+    adaptive: bool = False,
+    start_concurrency: int = 10,
+) -> List[Dict]:
+    """
+    :param adaptive: if True, every concurrency is the ceiling of the adaptive limit, which
+                     starts at start_concurrency, otherwise it is kept fixed.
+    :return: One result per aligner concurrency, with its throughput (ids_per_s), the
+             ids aligned and failed, the retries, the last aligner limit and the responses
+             of the aligner stub.
+    """
+    work_dir.mkdir(parents=True, exist_ok=True)
+    ids = [f"{i:04}" for i in range(1, num_ids + 1)]
+    remotes_dir = work_dir / "remotes"
+    print(f"Creating {2 * num_ids} local TM repositories in {remotes_dir}")
+    create_git_remotes(remotes_dir, ids, file_size)
+    ids_file = work_dir / "ids.txt"
+    ids_file.write_text("\n".join(ids) + "\n")
+
+    results = []
+    for concurrency in concurrency_levels or [1, 5, 10, 20]:
+        level_dir = Path(tempfile.mkdtemp(prefix=f"concurrency_{concurrency}_", dir=work_dir))
+        with AlignerStubServer(
+            latency=latency,
+            error_rate=error_rate,
+            throttle_rate=throttle_rate,
+            max_concurrent=max_concurrent,
+            retry_after=retry_after,
+        ) as stub:
+            config = {
+                "ids_file": str(ids_file),
+                "num_ids": num_ids,
+                "s3_dir": str(level_dir / "s3"),
+                "s3_latency": s3_latency,
+                "metrics_dir": str(level_dir / "metrics"),
+                "aligner_endpoint_url": stub.url,
+                "aligner_concurrency": concurrency,
+                "aligner_start_concurrency": start_concurrency,
+                "adaptive": adaptive,
+                "tokenize_processes": tokenize_processes,
+                "download_threads": download_threads,
+                "upload_threads": upload_threads,
+            }
+            config_file = level_dir / "config.json"
+            config_file.write_text(json.dumps(config))
+            """the child imports this same package, wherever it is installed"""
+            python_path = [str(Path(__file__).resolve().parents[1]), os.environ.get("PYTHONPATH", "")]
+            env = dict(
+                os.environ,
+                MT_FILES_PATH=str(level_dir / "mt_files"),
+                MT_GIT_BASE_URL=f"{remotes_dir.resolve().as_uri()}/",
+                PYTHONPATH=os.pathsep.join(filter(None, python_path)),
+            )
+            with open(level_dir / "pipeline.log", "w") as log_file:
+                subprocess.run(
+                    [sys.executable, "-m", "mt_aligner_prep_tool.loadtest", "--run_level", str(config_file)],
+                    check=True,
+                    cwd=level_dir,
+                    env=env,
+                    stdout=log_file,
+                    stderr=subprocess.STDOUT,
+                )
+            result = json.loads((level_dir / "result.json").read_text())
+            result["aligner_responses"] = {str(k): v for k, v in sorted(stub.status_counts.items())}
+        print(
+            f"concurrency {concurrency:>4}: {result['ids_per_s']:8.2f} ids/s, "
+            f"{result['aligned']}/{num_ids} aligned in {result['seconds']}s, "
+            f"{result['retries']} retries, final limit {result['final_limit']}, aligner responses {result['aligner_responses']}"
+        )
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the pipeline against local stand-ins of GitHub, S3 and the aligner"
+    )
+    parser.add_argument("--ids", type=int, default=20, help="Number of synthetic TMs")
+    parser.add_argument("--file_size", type=str, default="64KB", help="Size of every BO and EN text")
+    parser.add_argument(
+        "--concurrency",
+        type=str,
+        default="1,5,10,20",
+        help="Comma separated aligner concurrencies, the pipeline runs once for each",
+    )
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds the aligner stub takes per request")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of aligner requests failing with 503")
+    parser.add_argument("--throttle_rate", type=float, default=0.0, help="Fraction of aligner requests answered with 429")
+    parser.add_argument(
+        "--max_concurrent", type=int, default=None, help="Aligner requests in flight beyond this get 429"
+    )
+    parser.add_argument("--retry_after", type=float, default=1, help="Retry-After of the 429 responses")
+    parser.add_argument("--s3_latency", type=float, default=0.02, help="Seconds every S3 stand-in call takes")
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Adapt the aligner requests in flight, every concurrency is then a ceiling",
+    )
+    parser.add_argument(
+        "--start_concurrency", type=int, default=10, help="Initial aligner limit with --adaptive"
+    )
+    parser.add_argument("--tokenize_processes", type=int, default=None)
+    parser.add_argument("--download_threads", type=int, default=8)
+    parser.add_argument("--upload_threads", type=int, default=10)
+    parser.add_argument("--work_dir", type=Path, help="Folder for the repositories and runs (default: temporary)")
+    parser.add_argument("--output", type=Path, help="Write the results to this json file")
+    parser.add_argument("--run_level", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_level:
+        """child process running a single concurrency level"""
+        result = run_pipeline_level(json.loads(args.run_level.read_text()))
+        (args.run_level.parent / "result.json").write_text(json.dumps(result))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results = run_load_test(
+            args.work_dir or Path(temp_dir),
+            num_ids=args.ids,
+            file_size=parse_size(args.file_size),
+            concurrency_levels=[int(c) for c in args.concurrency.split(",")],
+            latency=args.latency,
+            error_rate=args.error_rate,
+            throttle_rate=args.throttle_rate,
+            max_concurrent=args.max_concurrent,
+            retry_after=args.retry_after,
+            s3_latency=args.s3_latency,
+            tokenize_processes=args.tokenize_processes,
+            download_threads=args.download_threads,
+            upload_threads=args.upload_threads,
+            adaptive=args.adaptive,
+            start_concurrency=args.start_concurrency,
+        )
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
@@ -1,23 +1,40 @@
 import argparse
+import json
+import logging
 import os
-import shutil 
+import shutil
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import List, NamedTuple, Optional
 
 from tqdm import tqdm
 
-from mt_aligner_prep_tool.config import TM_FILES_PATH, BASE_PATH
-from mt_aligner_prep_tool.pipeline import get_file_content_by_lines
+from mt_aligner_prep_tool.config import GIT_BASE_URL, TM_FILES_PATH, BASE_PATH, get_workspace
+from mt_aligner_prep_tool.download import run_git
+from mt_aligner_prep_tool.utility import get_file_content_by_lines
+from mt_aligner_prep_tool.workspace import CLONE
+
+"""History fetched at first to find the merge base, deepened by the same amount until found"""
+FETCH_DEPTH = 50
+MAX_DEEPEN_ATTEMPTS = 5
+
+
+class MergeResult(NamedTuple):
+    repo: str
+    outcome: str
+    duration: float
+    error: Optional[str] = None
 
 
 def save_merged_branch_checkpoint(repo_name: str, branch_name: str):
-    checkpoint_file = BASE_PATH/ f"{branch_name}.txt"
-    if not checkpoint_file.exists():
-        checkpoint_file.touch()
-        return 
+    """Only called from the parent thread, so lines of different repos never interleave."""
+    checkpoint_file = BASE_PATH / f"{branch_name}.txt"
     with open(checkpoint_file, "a") as file:
         file.write(f"{repo_name}\n")
 
+
 def load_merged_branch_checkpoint(branch_name: str):
     checkpoint_file = BASE_PATH/ f"{branch_name}.txt"
     if not checkpoint_file.exists():
@@ -29,63 +46,149 @@ def load_merged_branch_checkpoint(branch_name: str):
     return checkpoint
 
 
-def merge_branch_to_main(repo_name: str, branch_name: str, org_name: str):
+def save_merge_report(results: List[MergeResult], branch_name: str) -> Path:
+    """Append the timing and outcome of every repo to a json lines report."""
+    report_file = BASE_PATH / f"{branch_name}_merge_report.jsonl"
+    with open(report_file, "a") as file:
+        for result in results:
+            file.write(json.dumps(result._asdict()) + "\n")
+    return report_file
+
+
+def fetch_merge_refs(clone_dir: Path, branch_name: str, depth: int = FETCH_DEPTH):
+    """
+    Shallow fetch of only main and the branch, deepened until their merge base is part
+    of the fetched history. Truly unrelated branches end up fully fetched.
+    """
+    refspecs = [
+        "+refs/heads/main:refs/remotes/origin/main",
+        f"+refs/heads/{branch_name}:refs/remotes/origin/{branch_name}",
+    ]
+    run_git(["fetch", "--depth", str(depth), "origin", *refspecs], cwd=clone_dir)
+    for _ in range(MAX_DEEPEN_ATTEMPTS):
+        try:
+            run_git(["merge-base", "origin/main", f"origin/{branch_name}"], cwd=clone_dir)
+            return
+        except subprocess.CalledProcessError:
+            pass
+        if run_git(["rev-parse", "--is-shallow-repository"], cwd=clone_dir) == "false":
+            return
+        run_git(["fetch", "--deepen", str(depth), "origin", *refspecs], cwd=clone_dir)
+    run_git(["fetch", "--unshallow", "origin", *refspecs], cwd=clone_dir)
+
+
+def merge_branch_to_main(
+    repo_name: str,
+    branch_name: str,
+    org_name: str,
+    base_url: str = GIT_BASE_URL,
+    work_dir: Path = TM_FILES_PATH,
+) -> str:
+    """
+    :return: "merged", "merged_with_conflicts" or "up_to_date".
+    """
 
     """ Construct the clone URL and directory """
-    clone_url = f"git@github.com:{org_name}/{repo_name}.git"
-    clone_dir = os.path.join(TM_FILES_PATH, repo_name)
+    clone_url = f"{base_url}{org_name}/{repo_name}.git"
+    clone_dir = Path(work_dir) / repo_name
 
     """ Ensure the directory is clean """
     if os.path.exists(clone_dir):
         shutil.rmtree(clone_dir)
+    clone_dir.mkdir(parents=True)
 
-    """ Clone the repository """
-    subprocess.run(["git", "clone", clone_url, clone_dir], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    """ Fetch main and the branch only, then checkout main """
+    run_git(["init", "-q"], cwd=clone_dir)
+    run_git(["remote", "add", "origin", clone_url], cwd=clone_dir)
+    fetch_merge_refs(clone_dir, branch_name)
+    run_git(["checkout", "-q", "-B", "main", "origin/main"], cwd=clone_dir)
 
-    """ Checkout the main branch and start the merge without committing """
-    subprocess.run(["git", "checkout", "main"], check=True, cwd=clone_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    """ Start the merge without committing """
     try:
-        subprocess.run(["git", "merge", f"origin/{branch_name}", "--no-commit", "--no-ff", "--allow-unrelated-histories"], check=True, cwd=clone_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        run_git(["merge", f"origin/{branch_name}", "--no-commit", "--no-ff", "--allow-unrelated-histories"], cwd=clone_dir)
         commit_message = f"Merged branch '{branch_name}' into main."
+        outcome = "merged"
     except subprocess.CalledProcessError:
         """ Handle conflicts by preferring changes from the branch being merged """
-        subprocess.run("git diff --name-only --diff-filter=U", shell=True, text=True, cwd=clone_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        conflicted_files = subprocess.check_output(
-            "git diff --name-only --diff-filter=U", shell=True, text=True, cwd=clone_dir
-        ).splitlines()
-        for file in conflicted_files:
-            subprocess.run(["git", "checkout", "--theirs", file], check=True, cwd=clone_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            subprocess.run(["git", "add", file], check=True, cwd=clone_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        """ Commit the resolved merge """
+        conflicted_files = run_git(["diff", "--name-only", "--diff-filter=U"], cwd=clone_dir).splitlines()
+        if not conflicted_files:
+            raise
+        run_git(["checkout", "--theirs", "--", *conflicted_files], cwd=clone_dir)
+        run_git(["add", "--", *conflicted_files], cwd=clone_dir)
         commit_message = f"Merged branch '{branch_name}' into main with incoming changes preferred."
-    subprocess.run(["git", "commit", "-m", commit_message], check=True, cwd=clone_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        outcome = "merged_with_conflicts"
+
+    """ Nothing to merge when the branch is already part of main """
+    try:
+        run_git(["rev-parse", "-q", "--verify", "MERGE_HEAD"], cwd=clone_dir)
+    except subprocess.CalledProcessError:
+        return "up_to_date"
+    run_git(["commit", "-m", commit_message], cwd=clone_dir)
 
     """ Push the changes back to the remote repository """
-    subprocess.run(["git", "push", "origin", "main"], check=True, cwd=clone_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    
+    run_git(["push", "origin", "main"], cwd=clone_dir)
+    return outcome
+
+
+def merge_repo(repo_name: str, branch_name: str, org_name: str, **kwargs) -> MergeResult:
+    """The clone is pinned in the workspace during the merge, and evictable after it."""
+    start_time = time.time()
+    workspace = get_workspace()
+    clone_dir = Path(kwargs.get("work_dir", TM_FILES_PATH)) / repo_name
+    try:
+        with workspace.pinned([clone_dir]):
+            outcome = merge_branch_to_main(repo_name, branch_name, org_name, **kwargs)
+            if clone_dir.parent == TM_FILES_PATH:
+                workspace.record(repo_name[2:], CLONE, [clone_dir])
+        workspace.evict()
+        return MergeResult(repo_name, outcome, time.time() - start_time)
+    except Exception as e:
+        return MergeResult(repo_name, "failed", time.time() - start_time, str(e))
+
+
 def merge_multiple_branches_to_main(
-    repo_file_path: Path, branch_name: str, org_name="MonlamAI"
-):
+    repo_file_path: Path,
+    branch_name: str,
+    org_name="MonlamAI",
+    num_workers: int = 8,
+    **kwargs,
+) -> List[MergeResult]:
     
     """
     Clones a repository from GitHub, merges a specified branch into the main branch,
     automatically resolves conflicts by preferring incoming changes, and allows merging
-    of unrelated histories.
+    of unrelated histories. Repositories are merged `num_workers` at a time.
 
     Parameters:
     repo_file_path(Path): file path of txt file containing TM ids names by separated by new lines..
     branch_name (str): Name of the feature branch to merge.
     org_name (str): Name of the organization or user the repository belongs to.
+    num_workers (int): Number of repositories merged at the same time.
     """
     """get ids from the txt files (by new lines)"""
     repo_ids = get_file_content_by_lines(repo_file_path)
 
-    checkpoints = load_merged_branch_checkpoint(branch_name)
-    for repo in tqdm(repo_ids, desc="Merging branches to main"):
-        if repo in checkpoints:
-            continue
-        merge_branch_to_main(f"TM{repo}", branch_name, org_name)
-        save_merged_branch_checkpoint(repo, branch_name)
+    checkpoints = set(load_merged_branch_checkpoint(branch_name))
+    repo_ids = [repo for repo in repo_ids if repo not in checkpoints]
+
+    results = []
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {
+            executor.submit(merge_repo, f"TM{repo}", branch_name, org_name, **kwargs): repo
+            for repo in repo_ids
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Merging branches to main"):
+            result = future.result()
+            results.append(result)
+            if result.outcome == "failed":
+                logging.error(f"Merging {branch_name} into {result.repo} failed: {result.error}")
+                continue
+            save_merged_branch_checkpoint(futures[future], branch_name)
+
+    report_file = save_merge_report(results, branch_name)
+    failed = sum(result.outcome == "failed" for result in results)
+    print(f"Merged {len(results) - failed} repos, {failed} failed. Report: {report_file}")
+    return results
 
 
 if __name__ == "__main__":
@@ -100,10 +203,22 @@ if __name__ == "__main__":
         type=str,
         help="The branch name to merged with main",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Number of repositories merged at the same time",
+    )
     args = parser.parse_args()
 
+    """configured here only, importing the module doesn't touch the logging of its caller"""
+    logging.basicConfig(
+        filename="errors.log",
+        level=logging.ERROR,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+
     if args.file_path:
-        merge_multiple_branches_to_main(args.file_path, args.branch_name)
+        merge_multiple_branches_to_main(args.file_path, args.branch_name, num_workers=args.workers)
     else:
         print("Please provide a file path that contains TM ids and branch name")
-
@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+"""Upper bounds (seconds) of the stage duration histogram buckets"""
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600)
+
+"""Counted fields of a stage record, exported as `mt_aligner_stage_<field>_total`"""
+COUNTER_FIELDS = ("bytes_in", "bytes_out", "sentences", "retries")
+
+METRIC_PREFIX = "mt_aligner"
+
+
+class Histogram:
+    """Cumulative histogram in the prometheus sense, `counts[i]` is the number of values <= buckets[i]."""
+
+    def __init__(self, buckets: Sequence[float] = DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+class MetricsCollector:
+    """
+    Records of how long every id spent in every stage of the pipeline, with the bytes
+    read and written, the sentences produced and the retries needed.
+
+    Stages run in threads of the parent process, work done in pool workers reports its
+    numbers back with its result, so all the records end up here. At the end of a run
+    they are written as a json lines trace and a prometheus textfile.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self.records: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, record: Dict):
+        with self._lock:
+            self.records.append(record)
+
+    @contextmanager
+    def stage(self, id_: str, stage: str) -> Iterator[Dict]:
+        """
+        Time a stage of an id. The yielded record can be updated with the counted fields,
+        it is added with outcome "error" if the stage raises.
+        """
+        record = {"id": id_, "stage": stage, "start": time.time(), "pid": os.getpid()}
+        record.update({field: 0 for field in COUNTER_FIELDS})
+        start_time = time.perf_counter()
+        try:
+            yield record
+            record.setdefault("outcome", "ok")
+        except Exception as e:
+            record["outcome"] = "error"
+            record["error"] = str(e)
+            raise
+        finally:
+            record["duration"] = time.perf_counter() - start_time
+            self.add(record)
+
+    def get_stage_names(self) -> List[str]:
+        return list(dict.fromkeys(record["stage"] for record in self.records))
+
+    def get_histograms(self) -> Dict[str, Histogram]:
+        histograms: Dict[str, Histogram] = {}
+        for record in self.records:
+            histogram = histograms.setdefault(record["stage"], Histogram(self.buckets))
+            histogram.observe(record["duration"])
+        return histograms
+
+    def write_trace(self, trace_file: Path):
+        """One json line per record, in the order the stages finished."""
+        trace_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(trace_file, "w") as file:
+            for record in self.records:
+                file.write(json.dumps(record) + "\n")
+
+    def to_prometheus(self) -> str:
+        lines = []
+        name = f"{METRIC_PREFIX}_stage_duration_seconds"
+        lines += [f"# HELP {name} Time an id spent in a stage.", f"# TYPE {name} histogram"]
+        for stage, histogram in self.get_histograms().items():
+            for bucket, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bucket}"}} {count}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+
+        for field in COUNTER_FIELDS:
+            name = f"{METRIC_PREFIX}_stage_{field}_total"
+            lines += [f"# HELP {name} Total {field} of a stage.", f"# TYPE {name} counter"]
+            for stage in self.get_stage_names():
+                total = sum(record[field] for record in self.records if record["stage"] == stage)
+                lines.append(f'{name}{{stage="{stage}"}} {total}')
+
+        name = f"{METRIC_PREFIX}_stage_items_total"
+        lines += [f"# HELP {name} Ids which went through a stage.", f"# TYPE {name} counter"]
+        outcomes: Dict[tuple, int] = {}
+        for record in self.records:
+            key = (record["stage"], record["outcome"])
+            outcomes[key] = outcomes.get(key, 0) + 1
+        for (stage, outcome), count in outcomes.items():
+            lines.append(f'{name}{{stage="{stage}",outcome="{outcome}"}} {count}')
+
+        name = f"{METRIC_PREFIX}_last_run_timestamp_seconds"
+        lines += [f"# TYPE {name} gauge", f"{name} {time.time()}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, textfile: Path):
+        """Written to a temporary file first, the node exporter must never read a partial file."""
+        textfile.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = textfile.with_name(textfile.name + ".tmp")
+        tmp_file.write_text(self.to_prometheus())
+        os.replace(tmp_file, textfile)
+
+    def summary(self) -> str:
+        """Table of the durations (p50, p95, max, total) and totals of every stage."""
+        lines = [
+            f"{'stage':<12}{'ids':>6}{'errors':>8}{'p50 s':>10}{'p95 s':>10}{'max s':>10}"
+            f"{'total s':>11}{'MB in':>10}{'MB out':>10}{'retries':>9}"
+        ]
+        for stage in self.get_stage_names():
+            records = [record for record in self.records if record["stage"] == stage]
+            durations = [record["duration"] for record in records]
+            errors = sum(record["outcome"] == "error" for record in records)
+            mb_in = sum(record["bytes_in"] for record in records) / (1024 * 1024)
+            mb_out = sum(record["bytes_out"] for record in records) / (1024 * 1024)
+            retries = sum(record["retries"] for record in records)
+            lines.append(
+                f"{stage:<12}{len(records):>6}{errors:>8}{percentile(durations, 0.5):>10.2f}"
+                f"{percentile(durations, 0.95):>10.2f}{max(durations):>10.2f}{sum(durations):>11.1f}"
+                f"{mb_in:>10.1f}{mb_out:>10.1f}{retries:>9}"
+            )
+        return "\n".join(lines)
+
+    def export(self, metrics_dir: Path, run_name: Optional[str] = None) -> Path:
+        """
+        Write the trace and the prometheus textfile of the run into metrics_dir.
+
+        :return: Path of the trace file.
+        """
+        run_name = run_name or time.strftime("%Y%m%d-%H%M%S")
+        trace_file = metrics_dir / f"trace_{run_name}.jsonl"
+        self.write_trace(trace_file)
+        self.write_prometheus(metrics_dir / f"{METRIC_PREFIX}.prom")
+        return trace_file
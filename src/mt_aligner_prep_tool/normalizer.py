@@ -0,0 +1,151 @@
+import hashlib
+import re
+import unicodedata
+from typing import Dict, Iterable, Iterator, Optional, Sequence
+
+"""Keycap emojis removed from the source texts"""
+EMOJIS_TO_REMOVE = ("1️⃣", "2️⃣", "3️⃣")
+
+"""Bump when the output of a rule changes, it is part of every normalizer version"""
+NORMALIZER_REVISION = "1"
+
+"""Runs of whitespace, after the single character rules turned tabs and newlines into spaces"""
+WHITESPACE_RUN_PATTERN = re.compile(r"\s\s+")
+
+"""Runs of whitespace without line breaks, collapsed when the newlines are kept"""
+INLINE_WHITESPACE_RUN_PATTERN = re.compile(r"[^\S\r\n]{2,}")
+
+"""Characters held back by normalize_stream before it flushes them without a safe boundary"""
+MAX_PENDING_CHARS = 1024 * 1024
+
+
+class Normalizer:
+    """
+    Text normalization rules compiled once into a plan of a few passes over the text,
+    each one skipped when its rules are off, instead of one pass per rule.
+
+    remove_emojis: remove the `emojis`
+    collapse_whitespace: replace every tab, and every run of two or more whitespace
+                         characters, by a space. Line breaks are part of the runs only
+                         with fold_newlines, otherwise they are kept as they are.
+    fold_newlines: replace line breaks ("\\n" and "\\r\\n") by a space
+    unicode_form: unicode normalization form ("NFC", "NFKC", ...) applied to the text,
+                  after the other rules, None to keep the text as it is
+
+    Emojis are removed before the whitespace rules apply, whitespace separated by
+    emojis only counts as a single run. With the emoji, whitespace and newline rules
+    the output is the same as `en_preprocess(remove_emojis(text))`.
+
+    The plan: one str.replace per emoji the text contains (a read only scan for the
+    others), a str.translate turning tabs, and newlines when folded, into spaces, and
+    one re.sub collapsing the whitespace runs. A folded "\\r\\n" becomes a run of two,
+    so it is collapsed with the runs. The unicode normalization is a last pass.
+    """
+
+    def __init__(
+        self,
+        remove_emojis: bool = True,
+        collapse_whitespace: bool = False,
+        fold_newlines: bool = False,
+        unicode_form: Optional[str] = None,
+        emojis: Sequence[str] = EMOJIS_TO_REMOVE,
+    ):
+        self.remove_emojis = remove_emojis
+        self.collapse_whitespace = collapse_whitespace
+        self.fold_newlines = fold_newlines
+        self.unicode_form = unicode_form
+        self.emojis = tuple(emojis) if remove_emojis else ()
+        self.encoded_emojis = tuple(emoji.encode("utf-8") for emoji in self.emojis)
+
+        self.translation: Dict[int, str] = {}
+        if collapse_whitespace:
+            self.translation[ord("\t")] = " "
+            if fold_newlines:
+                self.translation[ord("\n")] = " "
+        self.pattern = None
+        if collapse_whitespace:
+            self.pattern = WHITESPACE_RUN_PATTERN if fold_newlines else INLINE_WHITESPACE_RUN_PATTERN
+        self._held_back_chars = set("".join(self.emojis))
+
+    @property
+    def version(self) -> str:
+        """Identifier of the rule set, to tell apart outputs of different rules in cache keys."""
+        rules = (
+            f"emojis={','.join(self.emojis)};collapse_whitespace={self.collapse_whitespace};"
+            f"fold_newlines={self.fold_newlines};unicode_form={self.unicode_form}"
+        )
+        """
+        newlines were collapsed with the whitespace runs before, marked here instead of
+        bumping NORMALIZER_REVISION so the versions of the other rule sets don't change
+        """
+        if self.collapse_whitespace and not self.fold_newlines:
+            rules += ";newlines_kept"
+        return f"norm{NORMALIZER_REVISION}-{hashlib.sha256(rules.encode()).hexdigest()[:8]}"
+
+    def normalize(self, text: str) -> str:
+        for emoji in self.emojis:
+            """a read only scan, most texts have none"""
+            if emoji in text:
+                text = text.replace(emoji, "")
+        if self.translation:
+            text = text.translate(self.translation)
+        if self.pattern is not None:
+            text = self.pattern.sub(" ", text)
+        elif self.fold_newlines:
+            text = text.replace("\r\n", " ").replace("\n", " ")
+        if self.unicode_form is not None and not unicodedata.is_normalized(
+            self.unicode_form, text
+        ):
+            text = unicodedata.normalize(self.unicode_form, text)
+        return text
+
+    def normalize_bytes(self, data: bytes) -> bytes:
+        """
+        normalize() of utf-8 encoded text, only for the emoji removal, the other rules
+        need the decoded characters.
+        """
+        if self.collapse_whitespace or self.fold_newlines or self.unicode_form:
+            raise ValueError("Only emoji removal can be applied to utf-8 bytes")
+        for emoji in self.encoded_emojis:
+            if emoji in data:
+                data = data.replace(emoji, b"")
+        return data
+
+    def find_safe_end(self, text: str) -> int:
+        """
+        Offset up to which `text` can be normalized on its own, the rest may still change
+        with the text which follows: trailing whitespace and emoji characters, and with
+        unicode normalization the last word, since only whitespace never composes with
+        its neighbours.
+        """
+        end = len(text)
+        if self.unicode_form is not None:
+            while end > 0 and not text[end - 1].isspace():
+                end -= 1
+        while end > 0 and (text[end - 1].isspace() or text[end - 1] in self._held_back_chars):
+            end -= 1
+        return end
+
+    def normalize_stream(
+        self, texts: Iterable[str], max_pending: int = MAX_PENDING_CHARS
+    ) -> Iterator[str]:
+        """
+        Normalize a text given in pieces, the output is the same as normalizing the
+        whole text at once.
+
+        :param max_pending: characters held back at most while no safe boundary is
+                            found (e.g. a huge run of whitespace, or a text without
+                            whitespace with unicode_form). They are then normalized on
+                            their own, the output may differ at that boundary only.
+        """
+        pending = ""
+        for text in texts:
+            pending += text
+            end = self.find_safe_end(pending)
+            if end == 0 and len(pending) > max_pending:
+                end = len(pending)
+            if end > 0:
+                yield self.normalize(pending[:end])
+                pending = pending[end:]
+        if pending:
+            yield self.normalize(pending)
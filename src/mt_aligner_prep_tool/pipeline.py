@@ -1,29 +1,73 @@
 import argparse
+import asyncio
 import logging
-from  multiprocessing import Pool
+import os
+import time
+from contextlib import nullcontext
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Optional
-
-from tqdm import tqdm
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
+from mt_aligner_prep_tool.aligner import AlignerClient
 from mt_aligner_prep_tool.config import (
+    ALIGNER_ENDPOINT_URL,
     BO_FILES_PATH,
     EN_FILES_PATH,
+    METRICS_PATH,
+    S3_BUCKET,
+    S3_UPLOAD_COMPRESSION,
     TOKENIZED_FILES_PATH,
+    WORK_QUEUE,
+    WORK_QUEUE_LEASE_SECONDS,
+    WORK_QUEUE_TOKEN,
+    get_presigned_url_cache,
+    get_tokenization_cache,
+    get_workspace,
     is_id_already_aligned,
     is_id_already_realigned,
     is_id_already_tokenized,
     load_checkpoint,
+    load_last_alignment_inputs,
+    load_token,
+    load_tokenizer_versions,
+    save_alignment_inputs,
     save_checkpoint,
+    save_tokenizer_version,
 )
 from mt_aligner_prep_tool.download import clone_github_repo, find_first_txt_file
-from mt_aligner_prep_tool.tokenizers import sent_tokenize
+from mt_aligner_prep_tool.metrics import MetricsCollector
+from mt_aligner_prep_tool.stages import Stage, StagedPipeline
+from mt_aligner_prep_tool.tokenization_cache import TokenizationCache
+from mt_aligner_prep_tool.tokenizers import (
+    bo_sent_tokenize_file,
+    en_sent_tokenize_file,
+    get_tokenizer_version,
+    get_tokenizers_version,
+    init_tokenizer_worker,
+    load_tokenizers,
+)
 from mt_aligner_prep_tool.upload import (
+    COMPRESSIONS,
     create_s3_file_url,
-    send_api_request_to_aligner,
+    get_compressed_key,
     upload_file_to_s3,
 )
-from mt_aligner_prep_tool.utility import execution_time
+from mt_aligner_prep_tool.utility import (
+    count_file_lines,
+    get_file_content_by_lines,
+    get_file_hash,
+)
+from mt_aligner_prep_tool.workqueue import (
+    LeaseKeeper,
+    QueueStore,
+    get_worker_name,
+    open_queue_store,
+)
+from mt_aligner_prep_tool.workspace import CLONE, TOKENIZED, Workspace
+
+"""Tibetan files larger than this (in bytes) are segmented over all the tokenization processes"""
+PARALLEL_BO_FILE_SIZE = 4 * 1024 * 1024
 
 log_fn = "errors.log"
 error_id_log_fn = "error_ids.log"
@@ -42,39 +86,258 @@ def log_error_with_id(id_: str):
         log_file.write(f"{id_}\n")
 
 
-def get_file_content_by_lines(file_path):
-    """
-    Reads a file and returns its content split into lines.
+class AlignmentTask(NamedTuple):
+    """An id going through the stages of the pipeline"""
 
-    :param file_path: Path to the file to be read.
-    :return: List of lines in the file.
-    """
-    file_path = Path(file_path)
-    if file_path.exists() and file_path.is_file():
-        with file_path.open("r") as file:
-            return [line.strip() for line in file if line.strip()]
-    else:
-        raise FileNotFoundError(f"No file found at {file_path}")
+    id_: str
+    alignment_version: Optional[str]
+    tokenize: bool
+    tokenized_bo_file_path: Path
+    tokenized_en_file_path: Path
+    tokenized_tibetan_url: Optional[str] = None
+    tokenized_english_url: Optional[str] = None
+    tokenized_bo_hash: Optional[str] = None
+    tokenized_en_hash: Optional[str] = None
+    size: int = 0
 
 
 def pipeline(
-    file_path: Path, re_align: bool = False, alignment_version: Optional[str] = "v1"
-):
+    file_path: Optional[Path],
+    re_align: bool = False,
+    alignment_version: Optional[str] = "v1",
+    num_tokenize_processes: Optional[int] = None,
+    use_tokenization_cache: bool = True,
+    aligner_concurrency: int = 32,
+    num_download_threads: int = 8,
+    num_upload_threads: int = 10,
+    metrics_dir: Path = METRICS_PATH,
+    bucket: str = S3_BUCKET,
+    aligner_endpoint_url: str = ALIGNER_ENDPOINT_URL,
+    bearer_token: Optional[str] = None,
+    aligner_start_concurrency: int = 10,
+    adaptive_aligner_concurrency: bool = True,
+    compression: Optional[str] = S3_UPLOAD_COMPRESSION,
+    skip_unchanged: bool = False,
+    copy_forward: bool = False,
+    work_queue: Optional[QueueStore] = None,
+    refresh_tokenized: bool = False,
+) -> Optional[MetricsCollector]:
     """
     file_path: a file containing ids of the repositories to be aligned
-                ,ids should be separated by new lines
+                ,ids should be separated by new lines. Only optional with
+                a work_queue
     re_align: if True, realign the ids with the specific version
     alignment_version: version you want to name for realign
+    num_tokenize_processes: number of worker processes for tokenizing,
+                            defaults to the number of cpus
+    use_tokenization_cache: if True, the ids to tokenize are looked up in the tokenization
+                            cache first and only tokenized on a miss
+    aligner_concurrency: maximum number of alignment requests in flight
+    num_download_threads: number of repositories downloaded at a time
+    num_upload_threads: number of ids uploaded to s3 at a time
+    metrics_dir: folder where the trace and prometheus textfile of the run are written
+    bucket: s3 bucket the tokenized files are uploaded to
+    aligner_endpoint_url: url the alignment requests are sent to
+    bearer_token: token of the aligner endpoint, read from the credentials file if None
+    aligner_start_concurrency: alignment requests in flight at the start, raised while the
+                               aligner answers in time and lowered on 429, 5xx and timeouts
+    adaptive_aligner_concurrency: if False, always keep aligner_concurrency requests in flight
+    compression: "gzip" or "zstd" to upload the tokenized files compressed
+    skip_unchanged: with re_align, skip the ids whose tokenized files are byte-identical
+                    to the ones they were last aligned with
+    copy_forward: with skip_unchanged, record the last alignment of a skipped id as its
+                  alignment under alignment_version
+    work_queue: if given, the ids are claimed from this queue, shared with the other
+                workers, until it is empty. The ids of file_path (optional then) are
+                added to the queue first.
+    refresh_tokenized: if True, already tokenized ids are fetched again to pick up
+                       changes of their source texts, and with the cache only
+                       re-tokenized when their source text changed. Otherwise they are
+                       only tokenized again when their tokenized files are missing or
+                       were made by another tokenizer version.
+
+    Each id goes through the download, tokenize, upload and align stages, and moves to
+    the next stage as soon as it is done with the previous one. The files of the ids in
+    the pipeline are pinned in the workspace, the least recently used files of the other
+    ids are evicted when the workspace grows over its cap (env MT_WORKSPACE_MAX_SIZE).
+    """
+    if file_path is None and work_queue is None:
+        raise ValueError("A file_path with the ids or a work_queue is required")
+    worker = get_worker_name()
+    workspace = get_workspace()
+    workspace.scan()
+    tasks_count = {"tasks": 0}
+    if work_queue is None:
+        tasks, _ = create_tasks(
+            get_file_content_by_lines(file_path),
+            re_align,
+            alignment_version,
+            refresh_tokenized,
+        )
+        if len(tasks) == 0:
+            return None
+        tasks_count["tasks"] = len(tasks)
+        tasks = schedule_tasks(tasks)
+
+        """hashes of the tokenized files the ids were last aligned with, to skip the unchanged ones"""
+        last_alignments = (
+            load_last_alignment_inputs(task.id_ for task in tasks)
+            if re_align and skip_unchanged
+            else None
+        )
+    else:
+        if file_path is not None:
+            ids = get_file_content_by_lines(file_path)
+            scheduled_ids = [
+                task.id_
+                for task in schedule_tasks(
+                    create_tasks(ids, re_align, alignment_version, refresh_tokenized)[0]
+                )
+            ]
+            added = work_queue.add(scheduled_ids + ids)
+            print(f"{added} ids added to the work queue {work_queue.location}")
+        """filled batch by batch as the ids are claimed"""
+        last_alignments = {} if re_align and skip_unchanged else None
+        tasks = claim_tasks(
+            work_queue,
+            worker,
+            num_download_threads,
+            re_align,
+            alignment_version,
+            refresh_tokenized,
+            last_alignments,
+            tasks_count,
+        )
 
+    num_tokenize_processes = num_tokenize_processes or os.cpu_count() or 1
+    cache_stats = get_tokenization_cache().stats()
+    url_cache_stats = get_presigned_url_cache().stats()
+    metrics = MetricsCollector()
+    client = AlignerClient(
+        aligner_endpoint_url,
+        bearer_token or load_token(),
+        max_in_flight=aligner_concurrency,
+        initial_in_flight=aligner_start_concurrency,
+        adaptive=adaptive_aligner_concurrency,
+    )
+    """loaded once here, forked workers inherit the loaded tokenizers"""
+    load_tokenizers()
+    with ProcessPoolExecutor(
+        max_workers=num_tokenize_processes, initializer=init_tokenizer_worker
+    ) as executor:
+        """start the workers before any stage thread exists, forking a threaded process is unsafe"""
+        executor.submit(int).result()
+
+        stages = [
+            Stage(
+                "Downloading files",
+                partial(download_task, metrics=metrics, workspace=workspace),
+                num_download_threads,
+            ),
+            Stage(
+                "Tokenizing files",
+                partial(
+                    tokenize_task,
+                    executor=executor,
+                    metrics=metrics,
+                    workspace=workspace,
+                    use_cache=use_tokenization_cache,
+                ),
+                num_tokenize_processes,
+            ),
+            Stage(
+                "Uploading files",
+                partial(
+                    upload_task,
+                    metrics=metrics,
+                    bucket=bucket,
+                    compression=compression,
+                    last_alignments=last_alignments,
+                    copy_forward=copy_forward,
+                    workspace=workspace,
+                ),
+                num_upload_threads,
+            ),
+            Stage(
+                "Aligning files",
+                partial(align_task, client=client, metrics=metrics),
+                aligner_concurrency,
+                postfix=lambda: {"limit": client.limiter.limit},
+            ),
+        ]
+
+        """the files of an id leaving the pipeline become evictable"""
+
+        def on_error(stage_name: str, task: AlignmentTask, error: Exception):
+            log_stage_error(stage_name, task, error)
+            workspace.unpin(get_task_paths(task))
+            workspace.evict()
+            if work_queue is not None:
+                work_queue.fail(task.id_, worker, f"{stage_name}: {error}")
+
+        def on_done(task: AlignmentTask):
+            workspace.unpin(get_task_paths(task))
+            workspace.evict()
+            if work_queue is not None:
+                work_queue.complete(task.id_, worker)
+
+        """with the sizes of the files on disk, progress and ETA are in bytes"""
+        item_size, total = None, None
+        if work_queue is None:
+            total = len(tasks)
+            if any(task.size for task in tasks):
+                item_size, total = (lambda task: task.size), sum(task.size for task in tasks)
+        with LeaseKeeper(work_queue, worker) if work_queue is not None else nullcontext():
+            StagedPipeline(
+                stages, on_error=on_error, on_done=on_done, item_size=item_size
+            ).run(pin_tasks(tasks, workspace), total=total)
+    client.close()
+
+    new_cache_stats = get_tokenization_cache().stats()
+    print(
+        f"Tokenization cache: {new_cache_stats['hits'] - cache_stats['hits']} hits, "
+        f"{new_cache_stats['misses'] - cache_stats['misses']} misses"
+    )
+    new_url_cache_stats = get_presigned_url_cache().stats()
+    url_hits = new_url_cache_stats["hits"] - url_cache_stats["hits"]
+    url_lookups = url_hits + new_url_cache_stats["misses"] - url_cache_stats["misses"]
+    print(
+        f"Presigned url cache: {url_hits} hits of {url_lookups} lookups"
+        + (f" ({url_hits / url_lookups:.0%})" if url_lookups else "")
+    )
+    if last_alignments is not None:
+        skipped = sum(record["outcome"] == "skipped" for record in metrics.records)
+        copied = f", their alignment copied to {alignment_version}" if copy_forward else ""
+        print(
+            f"Re-alignment: {skipped} of {tasks_count['tasks']} ids skipped as unchanged{copied}"
+        )
+    print(metrics.summary())
+    trace_file = metrics.export(metrics_dir)
+    print(f"Metrics written to {trace_file} and {metrics_dir}")
+    return metrics
+
+
+def create_tasks(
+    ids: List[str],
+    re_align: bool,
+    alignment_version: Optional[str],
+    refresh_tokenized: bool = False,
+) -> Tuple[List[AlignmentTask], Dict[str, str]]:
     """
+    Tasks of the ids which still need aligning, according to the checkpoints.
 
-    ids = get_file_content_by_lines(file_path)
+    :return: The tasks, and the error of every id whose task couldn't be created.
+    """
 
     """load progress"""
-    id_checkpoints = load_checkpoint()
-    files_tobe_aligned = []
-
-    for id_ in tqdm(ids, desc="Tokenizing files"):
+    id_checkpoints = load_checkpoint(ids)
+    """tokenized files made by another tokenizer or normalizer are stale"""
+    tokenizer_versions = load_tokenizer_versions(ids)
+    tokenizers_version = get_tokenizers_version()
+    tasks = []
+    errors = {}
+
+    for id_ in ids:
         try:
             bo_id, en_id = f"BO{id_}", f"EN{id_}"
 
@@ -88,118 +351,447 @@ def pipeline(
             if not re_align and is_id_already_aligned(id_, id_checkpoints):
                 continue
 
-            """if id is not tokenized, tokenize it"""
-            if not is_id_already_tokenized(id_, id_checkpoints):
-                bo_file_path = BO_FILES_PATH / bo_id
-                en_file_path = EN_FILES_PATH / en_id
-
-                clone_github_repo(repository=bo_id, destination_folder=bo_file_path)
-                clone_github_repo(repository=en_id, destination_folder=en_file_path)
-
-                bo_file = find_first_txt_file(bo_file_path)
-                en_file = find_first_txt_file(en_file_path)
-                if bo_file and en_file:
-                    tokenized_bo_file_path, tokenized_en_file_path = tokenize_files(
-                        id_, bo_file, en_file
-                    )
-                    """save the id to checkpoint file for tokenization"""
-                    save_checkpoint(id_, "Tokenization")
-
             tokenized_bo_file_path = TOKENIZED_FILES_PATH / f"tokenized_{bo_id}.txt"
             tokenized_en_file_path = TOKENIZED_FILES_PATH / f"tokenized_{en_id}.txt"
-
-            if not re_align:
-                alignment_version = None
-            files_tobe_aligned.append(
-                (
-                    id_,
-                    tokenized_bo_file_path,
-                    tokenized_en_file_path,
-                    alignment_version,
+            """tokenized files evicted from the workspace are tokenized again"""
+            tasks.append(
+                AlignmentTask(
+                    id_=id_,
+                    alignment_version=alignment_version if re_align else None,
+                    tokenize=refresh_tokenized
+                    or not is_id_already_tokenized(id_, id_checkpoints)
+                    or tokenizer_versions.get(id_) != tokenizers_version
+                    or not tokenized_bo_file_path.exists()
+                    or not tokenized_en_file_path.exists(),
+                    tokenized_bo_file_path=tokenized_bo_file_path,
+                    tokenized_en_file_path=tokenized_en_file_path,
                 )
             )
 
         except Exception as e:
             logging.error(f"{id_}: {e}")
             log_error_with_id(id_)
+            errors[id_] = str(e)
             continue
-    num_processes = 10
-    if len(files_tobe_aligned)== 0:
-        return
+    return tasks, errors
+
+
+def claim_tasks(
+    work_queue: QueueStore,
+    worker: str,
+    batch_size: int,
+    re_align: bool,
+    alignment_version: Optional[str],
+    refresh_tokenized: bool,
+    last_alignments: Optional[Dict[str, Dict]],
+    tasks_count: Dict[str, int],
+) -> Iterator[AlignmentTask]:
+    """
+    Tasks of the ids claimed from the work queue, `batch_size` ids at a time as the
+    pipeline takes them. Ids with nothing left to do are completed at once, ids whose
+    task couldn't be created are failed, to be retried.
+
+    While other workers hold leases, the queue is polled again, their ids come back
+    if they expire. Stops once no id is pending or leased anymore.
+    """
+    poll_interval = min(work_queue.lease_seconds / 10, 30)
+    while True:
+        ids = work_queue.claim(worker, batch_size)
+        if not ids:
+            if not work_queue.has_work():
+                return
+            time.sleep(poll_interval)
+            continue
+
+        tasks, errors = create_tasks(ids, re_align, alignment_version, refresh_tokenized)
+        task_ids = {task.id_ for task in tasks}
+        for id_ in ids:
+            if id_ in errors:
+                work_queue.fail(id_, worker, errors[id_])
+            elif id_ not in task_ids:
+                work_queue.complete(id_, worker)
+        if last_alignments is not None:
+            last_alignments.update(load_last_alignment_inputs(task_ids))
+        tasks_count["tasks"] += len(tasks)
+        yield from schedule_tasks(tasks)
+
+
+def get_task_size(task: AlignmentTask) -> Optional[int]:
+    """
+    Bytes of the files of an id already on disk: its tokenized files, or else its
+    downloaded source files. None when neither is on disk yet.
+    """
+    tokenized_files = [task.tokenized_bo_file_path, task.tokenized_en_file_path]
+    if all(file.exists() for file in tokenized_files):
+        return sum(file.stat().st_size for file in tokenized_files)
     try:
-        with Pool(processes=num_processes) as pool:
-            list(
-                tqdm(
-                    pool.imap(upload_tokenized_files, files_tobe_aligned),
-                    total=len(files_tobe_aligned),
-                    desc="Uploading and aligning files",
-                )
+        return sum(file.stat().st_size for file in find_id_files(task.id_))
+    except FileNotFoundError:
+        return None
+
+
+def schedule_tasks(tasks: List[AlignmentTask]) -> List[AlignmentTask]:
+    """
+    Order the tasks largest first, so that the largest ids don't start last and leave a
+    long tail at the end of the run, and set their size. Ids with nothing on disk yet
+    go last, in their input order, with the average size of the others.
+    """
+    sizes = [get_task_size(task) for task in tasks]
+    known_sizes = [size for size in sizes if size is not None]
+    default_size = sum(known_sizes) // len(known_sizes) if known_sizes else 0
+    order = sorted(range(len(tasks)), key=lambda i: (sizes[i] is None, -(sizes[i] or 0)))
+    return [
+        tasks[i]._replace(size=sizes[i] if sizes[i] is not None else default_size)
+        for i in order
+    ]
+
+
+def pin_tasks(tasks: Iterable[AlignmentTask], workspace: Workspace) -> Iterator[AlignmentTask]:
+    """
+    Pin the files of the ids in the workspace as the pipeline takes them, they aren't
+    evicted until the ids leave the pipeline.
+    """
+    for task in tasks:
+        paths = get_task_paths(task)
+        workspace.pin(paths)
+        workspace.touch(paths)
+        yield task
+
+
+def get_task_paths(task: AlignmentTask) -> List[Path]:
+    """Clone folders and tokenized files of an id, pinned while it is in the pipeline"""
+    return [
+        BO_FILES_PATH / f"BO{task.id_}",
+        EN_FILES_PATH / f"EN{task.id_}",
+        task.tokenized_bo_file_path,
+        task.tokenized_en_file_path,
+    ]
+
+
+def log_stage_error(stage_name: str, task: AlignmentTask, error: Exception):
+    logging.error(f"{stage_name} failed for {task.id_}: {error}")
+    log_error_with_id(task.id_)
+
+
+def download_task(
+    task: AlignmentTask,
+    metrics: MetricsCollector,
+    workspace: Optional[Workspace] = None,
+) -> AlignmentTask:
+    """
+    Download stage: clone the BO and EN repositories of an id which needs tokenizing.
+    The clones are recorded in the workspace, which evicts other files if it is full.
+    """
+    if not task.tokenize:
+        return task
+
+    with metrics.stage(task.id_, "download") as record:
+        bo_id, en_id = f"BO{task.id_}", f"EN{task.id_}"
+        clone_github_repo(repository=bo_id, destination_folder=BO_FILES_PATH / bo_id)
+        clone_github_repo(repository=en_id, destination_folder=EN_FILES_PATH / en_id)
+        record["bytes_in"] = sum(file.stat().st_size for file in find_id_files(task.id_))
+    if workspace is not None:
+        workspace.record(task.id_, CLONE, [BO_FILES_PATH / bo_id, EN_FILES_PATH / en_id])
+        workspace.evict()
+    return task
+
+
+def tokenize_task(
+    task: AlignmentTask,
+    executor: Executor,
+    metrics: MetricsCollector,
+    workspace: Optional[Workspace] = None,
+    use_cache: bool = True,
+) -> AlignmentTask:
+    """
+    Tokenize stage: tokenize the files of an id on the process pool, unless they are
+    found in the tokenization cache (with use_cache).
+    Chunks of tibetan files larger than PARALLEL_BO_FILE_SIZE are spread over the whole pool.
+    """
+    if not task.tokenize:
+        return task
+
+    with metrics.stage(task.id_, "tokenize") as record:
+        bo_file, en_file = find_id_files(task.id_)
+        en_future = executor.submit(
+            tokenize_file_with_cache, en_file, task.tokenized_en_file_path, "en", use_cache
+        )
+        if bo_file.stat().st_size > PARALLEL_BO_FILE_SIZE:
+            bo_stats = tokenize_file(
+                bo_file,
+                task.tokenized_bo_file_path,
+                "bo",
+                get_tokenization_cache() if use_cache else None,
+                executor=executor,
             )
-    except Exception as e:
-        logging.error(f"Alignment Failed {id_}: {e}")
-        log_error_with_id(id_)
+        else:
+            bo_stats = executor.submit(
+                tokenize_file_with_cache, bo_file, task.tokenized_bo_file_path, "bo", use_cache
+            ).result()
+        en_stats = en_future.result()
+        for field in ("bytes_in", "bytes_out", "sentences"):
+            record[field] = bo_stats[field] + en_stats[field]
+        record["cache_hits"] = bo_stats["cache_hit"] + en_stats["cache_hit"]
+        record["worker_pids"] = [bo_stats["pid"], en_stats["pid"]]
+
+    """save the id to checkpoint file for tokenization"""
+    save_checkpoint(task.id_, "Tokenization")
+    save_tokenizer_version(task.id_, get_tokenizers_version())
+    if workspace is not None:
+        workspace.record(
+            task.id_, TOKENIZED, [task.tokenized_bo_file_path, task.tokenized_en_file_path]
+        )
+        workspace.evict()
+    return task
+
+
+def upload_task(
+    task: AlignmentTask,
+    metrics: MetricsCollector,
+    bucket: str = S3_BUCKET,
+    compression: Optional[str] = None,
+    last_alignments: Optional[Dict[str, Dict]] = None,
+    copy_forward: bool = False,
+    workspace: Optional[Workspace] = None,
+) -> Optional[AlignmentTask]:
+    """
+    Upload stage: upload the tokenized files and create their presigned urls.
+
+    If `last_alignments` is given, an id whose tokenized files are unchanged since its
+    last alignment is dropped with outcome "skipped" instead, and its last alignment
+    is recorded under the new version if `copy_forward`. Uploaded tokenized files
+    become evictable from the workspace.
+    """
+    with metrics.stage(task.id_, "upload") as record:
+        task = task._replace(
+            tokenized_bo_hash=get_file_hash(task.tokenized_bo_file_path),
+            tokenized_en_hash=get_file_hash(task.tokenized_en_file_path),
+        )
+        if last_alignments is not None and is_alignment_unchanged(task, last_alignments):
+            record["outcome"] = "skipped"
+            """the files it was last aligned with are in s3"""
+            if workspace is not None:
+                workspace.mark_uploaded(task.id_)
+            if copy_forward:
+                copy_alignment_forward(task, last_alignments[task.id_])
+            print(f"Tokenized files of {task.id_} are unchanged since its last alignment, skipped")
+            return None
+
+        tokenized_tibetan_url, tokenized_english_url = upload_tokenized_files(
+            task, record, bucket, compression
+        )
+    if workspace is not None:
+        workspace.mark_uploaded(task.id_)
+    return task._replace(
+        tokenized_tibetan_url=tokenized_tibetan_url,
+        tokenized_english_url=tokenized_english_url,
+    )
+
+
+def is_alignment_unchanged(task: AlignmentTask, last_alignments: Dict[str, Dict]) -> bool:
+    """True if the id was last aligned with byte-identical tokenized files."""
+    last_alignment = last_alignments.get(task.id_)
+    return (
+        last_alignment is not None
+        and last_alignment["bo_hash"] == task.tokenized_bo_hash
+        and last_alignment["en_hash"] == task.tokenized_en_hash
+    )
+
+
+def copy_alignment_forward(task: AlignmentTask, last_alignment: Dict):
+    """Record the last alignment of an unchanged id as its alignment under the task version."""
+    save_alignment_inputs(
+        task.id_,
+        task.alignment_version,
+        task.tokenized_bo_hash,
+        task.tokenized_en_hash,
+        last_alignment["aligned_version"],
+    )
+    save_checkpoint(task.id_, "re_alignment", task.alignment_version)
 
 
-def tokenize_files(id_: str, bo_file: Path, en_file: Path):
+async def align_task(
+    task: AlignmentTask, client: AlignerClient, metrics: MetricsCollector
+) -> AlignmentTask:
+    """
+    Align stage: send the presigned urls to the aligner and save the checkpoints.
+    Runs as a coroutine on the event loop of the stage, the checkpoints are saved off it.
+    """
+    print(f"Sending request to aligner for {task.id_}")
+    with metrics.stage(task.id_, "align") as record:
+        await client.align(
+            task.id_,
+            task.tokenized_tibetan_url,
+            task.tokenized_english_url,
+            task.alignment_version,
+            stats=record,
+        )
+        record["aligner_limit"] = client.limiter.limit
+    print(f"Alignment successful for {task.id_}")
+    await asyncio.get_running_loop().run_in_executor(None, save_alignment_checkpoints, task)
+    return task
+
+
+def save_alignment_checkpoints(task: AlignmentTask):
+    """save the id to checkpoint file"""
+    save_checkpoint(task.id_, "Alignment")
+    if task.tokenized_bo_hash and task.tokenized_en_hash:
+        save_alignment_inputs(
+            task.id_,
+            task.alignment_version,
+            task.tokenized_bo_hash,
+            task.tokenized_en_hash,
+            task.alignment_version,
+        )
+
+    if task.alignment_version:
+        """save the id to checkpoint file for re-alignment"""
+        save_checkpoint(task.id_, "re_alignment", task.alignment_version)
+
+
+def find_id_files(id_: str) -> Tuple[Path, Path]:
+    """Return the BO and EN source files of a downloaded id."""
+    bo_file = find_first_txt_file(BO_FILES_PATH / f"BO{id_}")
+    en_file = find_first_txt_file(EN_FILES_PATH / f"EN{id_}")
+    return bo_file, en_file
+
+
+def tokenize_file_with_cache(
+    source_file: Path, tokenized_file_path: Path, lang: str, use_cache: bool = True
+) -> Dict:
+    """tokenize_file with the tokenization cache of the current process, for pool workers."""
+    return tokenize_file(
+        source_file,
+        tokenized_file_path,
+        lang,
+        get_tokenization_cache() if use_cache else None,
+    )
+
+
+def tokenize_files(
+    id_: str,
+    bo_file: Path,
+    en_file: Path,
+    cache: Optional[TokenizationCache] = None,
+    num_processes: int = 1,
+    output_dir: Path = TOKENIZED_FILES_PATH,
+):
     bo_id, en_id = f"BO{id_}", f"EN{id_}"
-    """Tokenize the files"""
-    tokenized_bo_text = sent_tokenize(bo_file.read_text(), lang="bo")
-    tokenized_en_text = sent_tokenize(en_file.read_text(), lang="en")
 
-    """Write both tokenized texts to files in TOKENIZED_FILES_PATH"""
-    tokenized_bo_file_path = TOKENIZED_FILES_PATH / f"tokenized_{bo_id}.txt"
-    tokenized_en_file_path = TOKENIZED_FILES_PATH / f"tokenized_{en_id}.txt"
+    """Write both tokenized texts to files in output_dir"""
+    tokenized_bo_file_path = output_dir / f"tokenized_{bo_id}.txt"
+    tokenized_en_file_path = output_dir / f"tokenized_{en_id}.txt"
 
-    tokenized_bo_file_path.write_text(tokenized_bo_text)
-    tokenized_en_file_path.write_text(tokenized_en_text)
+    tokenize_file(bo_file, tokenized_bo_file_path, "bo", cache, num_processes)
+    tokenize_file(en_file, tokenized_en_file_path, "en", cache)
 
     return tokenized_bo_file_path, tokenized_en_file_path
 
 
-@execution_time(custom_name="upload_tokenized_files_and_aligning")
+def tokenize_file(
+    source_file: Path,
+    tokenized_file_path: Path,
+    lang: str,
+    cache: Optional[TokenizationCache] = None,
+    num_processes: int = 1,
+    executor: Optional[Executor] = None,
+) -> Dict:
+    """
+    Tokenize a file, the tokenization is skipped on a cache hit.
+
+    num_processes: number of processes segmenting the chunks of a tibetan file.
+    executor: process pool executor segmenting the chunks of a tibetan file instead.
+
+    :return: Metrics of the file, "bytes_in", "bytes_out", "sentences", "cache_hit" and
+             the "pid" of the process which tokenized it.
+    """
+    stats = {
+        "bytes_in": source_file.stat().st_size,
+        "cache_hit": False,
+        "pid": os.getpid(),
+    }
+    if cache is not None:
+        key = cache.get_key(source_file, lang, get_tokenizer_version(lang))
+        if cache.get(key, tokenized_file_path):
+            stats["cache_hit"] = True
+            stats["sentences"] = count_file_lines(tokenized_file_path)
+            stats["bytes_out"] = tokenized_file_path.stat().st_size
+            return stats
+
+    """both files are streamed, memory use depends on the chunk size and not the file size"""
+    if lang == "en":
+        stats["sentences"] = en_sent_tokenize_file(source_file, tokenized_file_path)
+    elif lang == "bo":
+        stats["sentences"] = bo_sent_tokenize_file(
+            source_file, tokenized_file_path, num_processes, executor
+        )
+    else:
+        raise NotImplementedError
+    stats["bytes_out"] = tokenized_file_path.stat().st_size
+
+    if cache is not None:
+        cache.put(key, tokenized_file_path)
+    return stats
+
+
 def upload_tokenized_files(
-   args
-):
-    id_, tokenized_bo_file_path, tokenized_en_file_path, alignment_version = args
+    task: AlignmentTask,
+    stats: Optional[Dict] = None,
+    bucket: str = S3_BUCKET,
+    compression: Optional[str] = None,
+) -> Tuple[str, str]:
+    """
+    Upload both tokenized files of an id to s3.
+
+    :param stats: if given, "bytes_in" is set to the size of the tokenized files,
+                  "bytes_out" to the bytes actually uploaded and "bytes_out_raw" to the
+                  uncompressed size of the uploaded files.
+    :param compression: "gzip" or "zstd" to upload the files compressed, under keys
+                        with the .gz or .zst suffix.
+    :return: Presigned urls of the tokenized tibetan and english files.
+    """
+    id_ = task.id_
+    tokenized_bo_file_path = task.tokenized_bo_file_path
+    tokenized_en_file_path = task.tokenized_en_file_path
     print(f"Uploading tokenized files to s3 bucket for {id_}")
-    upload_file_to_s3(
+    bo_stats: Dict = {}
+    en_stats: Dict = {}
+    bo_uploaded = upload_file_to_s3(
         local_file_path=tokenized_bo_file_path,
-        bucket="monlam.ai.tms",
+        bucket=bucket,
         s3_file=f"tokenized_bo/{tokenized_bo_file_path.name}",
+        compression=compression,
+        stats=bo_stats,
     )
-    upload_file_to_s3(
+    en_uploaded = upload_file_to_s3(
         local_file_path=tokenized_en_file_path,
-        bucket="monlam.ai.tms",
+        bucket=bucket,
         s3_file=f"tokenized_en/{tokenized_en_file_path.name}",
+        compression=compression,
+        stats=en_stats,
     )
+    if not bo_uploaded and not en_uploaded:
+        print(f"Tokenized files of {id_} are unchanged in s3 bucket, upload skipped")
+    if stats is not None:
+        stats["bytes_in"] = bo_stats["raw_bytes"] + en_stats["raw_bytes"]
+        stats["bytes_out"] = bo_stats["sent_bytes"] + en_stats["sent_bytes"]
+        stats["bytes_out_raw"] = (
+            bo_uploaded * bo_stats["raw_bytes"] + en_uploaded * en_stats["raw_bytes"]
+        )
+        stats["compression"] = compression
 
-    """Get corresponding url for both tokenized texts"""
+    """Get corresponding url for both tokenized texts, cached for unchanged objects"""
     tokenized_tibetan_url = create_s3_file_url(
-        "monlam.ai.tms", f"tokenized_bo/{tokenized_bo_file_path.name}"
+        bucket,
+        get_compressed_key(f"tokenized_bo/{tokenized_bo_file_path.name}", compression),
+        etag=bo_stats.get("etag"),
     )
     tokenized_english_url = create_s3_file_url(
-        "monlam.ai.tms", f"tokenized_en/{tokenized_en_file_path.name}"
+        bucket,
+        get_compressed_key(f"tokenized_en/{tokenized_en_file_path.name}", compression),
+        etag=en_stats.get("etag"),
     )
-
-    if tokenized_tibetan_url and tokenized_english_url:
-        """send both urls to api"""
-        """get github url where tm result is stored"""
-
-        print(f"Sending request to aligner for {id_}")
-
-        response = send_api_request_to_aligner(
-            id_, tokenized_tibetan_url, tokenized_english_url, alignment_version
-        )
-        if isinstance(response, dict) and "error" in response:
-            raise Exception(response["error"])
-
-        print(f"Alignment successful for {id_}")
-        """save the id to checkpoint file"""
-        save_checkpoint(id_, "Alignment")
-
-        if alignment_version:
-            """save the id to checkpoint file for re-alignment"""
-            save_checkpoint(id_, "re_alignment", alignment_version)
+    return tokenized_tibetan_url, tokenized_english_url
 
 
 if __name__ == "__main__":
@@ -209,7 +801,8 @@ if __name__ == "__main__":
     parser.add_argument(
         "file_path",
         type=Path,
-        help="TM ids to be added",
+        nargs="?",
+        help="TM ids to be added (to the work queue with --queue)",
     )
     parser.add_argument(
         "--re_align", type=bool, default=False, help="Boolean flag for re-alignment"
@@ -220,9 +813,120 @@ if __name__ == "__main__":
         default="v1",
         help="The version of the alignment process",
     )
+    parser.add_argument(
+        "--tokenize_processes",
+        type=int,
+        default=None,
+        help="Number of worker processes for tokenization, defaults to the number of cpus",
+    )
+    parser.add_argument(
+        "--no_tokenization_cache",
+        action="store_true",
+        help="Tokenize the ids without looking them up in the tokenization cache",
+    )
+    parser.add_argument(
+        "--refresh_tokenized",
+        action="store_true",
+        help="Fetch already tokenized ids again to pick up changes of their source texts",
+    )
+    parser.add_argument(
+        "--aligner_concurrency",
+        type=int,
+        default=32,
+        help="Maximum number of alignment requests in flight",
+    )
+    parser.add_argument(
+        "--aligner_start_concurrency",
+        type=int,
+        default=10,
+        help="Alignment requests in flight at the start, adapted to the aligner responses",
+    )
+    parser.add_argument(
+        "--fixed_aligner_concurrency",
+        action="store_true",
+        help="Keep --aligner_concurrency requests in flight instead of adapting",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        choices=list(COMPRESSIONS),
+        default=S3_UPLOAD_COMPRESSION,
+        help="Upload the tokenized files compressed (env MT_S3_UPLOAD_COMPRESSION)",
+    )
+    parser.add_argument(
+        "--skip_unchanged",
+        action="store_true",
+        help="With --re_align, skip IDs whose tokenized files didn't change since their last alignment",
+    )
+    parser.add_argument(
+        "--copy_forward",
+        action="store_true",
+        help="With --skip_unchanged, record the last alignment of skipped IDs under the new version",
+    )
+    parser.add_argument(
+        "--download_threads",
+        type=int,
+        default=8,
+        help="Number of repositories downloaded at a time",
+    )
+    parser.add_argument(
+        "--upload_threads",
+        type=int,
+        default=10,
+        help="Number of ids uploaded to s3 at a time",
+    )
+    parser.add_argument(
+        "--metrics_dir",
+        type=Path,
+        default=METRICS_PATH,
+        help="Folder where the trace and prometheus textfile of the run are written",
+    )
+    parser.add_argument(
+        "--bucket",
+        type=str,
+        default=S3_BUCKET,
+        help="S3 bucket the tokenized files are uploaded to (env MT_S3_BUCKET)",
+    )
+    parser.add_argument(
+        "--aligner_endpoint_url",
+        type=str,
+        default=ALIGNER_ENDPOINT_URL,
+        help="Url of the aligner endpoint (env MT_ALIGNER_ENDPOINT_URL)",
+    )
+    parser.add_argument(
+        "--queue",
+        type=str,
+        nargs="?",
+        const=WORK_QUEUE,
+        help="Claim the ids from a work queue shared with other workers, a local file or the url "
+        "of a queue server (default env MT_WORK_QUEUE), see mt_aligner_prep_tool.workqueue",
+    )
     args = parser.parse_args()
 
-    if args.file_path:
-        pipeline(args.file_path, args.re_align, args.alignment_version)
+    if args.file_path or args.queue:
+        pipeline(
+            args.file_path,
+            args.re_align,
+            args.alignment_version,
+            args.tokenize_processes,
+            not args.no_tokenization_cache,
+            args.aligner_concurrency,
+            args.download_threads,
+            args.upload_threads,
+            args.metrics_dir,
+            args.bucket,
+            args.aligner_endpoint_url,
+            aligner_start_concurrency=args.aligner_start_concurrency,
+            adaptive_aligner_concurrency=not args.fixed_aligner_concurrency,
+            compression=args.compression,
+            skip_unchanged=args.skip_unchanged,
+            copy_forward=args.copy_forward,
+            refresh_tokenized=args.refresh_tokenized,
+            work_queue=(
+                open_queue_store(args.queue, WORK_QUEUE_LEASE_SECONDS, WORK_QUEUE_TOKEN)
+                if args.queue
+                else None
+            ),
+        )
     else:
         print("Please provide a file path that contains TM ids")
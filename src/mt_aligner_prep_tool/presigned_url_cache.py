@@ -0,0 +1,72 @@
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from mt_aligner_prep_tool.checkpoint import SqliteStore
+
+
+class PresignedUrlCache(SqliteStore):
+    """
+    Presigned urls kept across runs.
+
+    Entries are keyed by bucket, key and ETag of the object, so a cached url is only
+    handed back for the very content it was signed for, and only while it is valid
+    for at least `min_lifetime` more seconds. Re-uploading an object invalidates the
+    urls of its key.
+    """
+
+    def __init__(self, db_path: Path, min_lifetime: float):
+        super().__init__(db_path)
+        self.min_lifetime = min_lifetime
+
+    def create_tables(self, connection: sqlite3.Connection):
+        connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS urls (
+                bucket TEXT NOT NULL,
+                key TEXT NOT NULL,
+                etag TEXT NOT NULL,
+                url TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (bucket, key, etag)
+            );
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO stats (name, value) VALUES ('hits', 0), ('misses', 0);
+            """
+        )
+
+    def _count(self, name: str):
+        self.connection.execute(
+            "UPDATE stats SET value = value + 1 WHERE name = ?", (name,)
+        )
+
+    def get(self, bucket: str, key: str, etag: str) -> Optional[str]:
+        """Cached url of the object, None on a miss or when it expires too soon."""
+        row = self.connection.execute(
+            "SELECT url FROM urls WHERE bucket = ? AND key = ? AND etag = ? AND expires_at >= ?",
+            (bucket, key, etag, time.time() + self.min_lifetime),
+        ).fetchone()
+        self._count("hits" if row else "misses")
+        return row[0] if row else None
+
+    def put(self, bucket: str, key: str, etag: str, url: str, expires_at: float):
+        """Cache the url of an object, the expired urls are dropped at the same time."""
+        connection = self.connection
+        connection.execute("DELETE FROM urls WHERE expires_at < ?", (time.time(),))
+        connection.execute(
+            "INSERT OR REPLACE INTO urls (bucket, key, etag, url, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (bucket, key, etag, url, expires_at),
+        )
+
+    def invalidate(self, bucket: str, key: str):
+        """Forget the urls of a key, its object was replaced."""
+        self.connection.execute("DELETE FROM urls WHERE bucket = ? AND key = ?", (bucket, key))
+
+    def stats(self) -> Dict[str, int]:
+        stats = dict(self.connection.execute("SELECT name, value FROM stats").fetchall())
+        stats["entries"] = self.connection.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+        return stats
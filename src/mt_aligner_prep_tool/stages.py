@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from tqdm import tqdm
+
+"""Put on a stage queue once per worker when there is no more input"""
+_DONE = object()
+
+
+class Stage:
+    """
+    A step of a StagedPipeline.
+
+    name: name shown in the progress output and passed to the error callback
+    func: called with an item, returns the item for the next stage or None to drop it.
+          A coroutine function runs on an event loop in a single thread of the stage,
+          one coroutine per item, instead of on worker threads.
+    concurrency: number of worker threads running `func`, or of items in progress at a
+                 time for a coroutine function
+    queue_size: maximum number of items waiting for the stage, defaults to twice the concurrency
+    postfix: called on every progress update, its values are shown next to the progress bar
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Any], Any],
+        concurrency: int = 1,
+        queue_size: Optional[int] = None,
+        postfix: Optional[Callable[[], Dict]] = None,
+    ):
+        self.name = name
+        self.func = func
+        self.concurrency = max(concurrency, 1)
+        self.queue_size = queue_size or 2 * self.concurrency
+        self.postfix = postfix
+        self.is_async = asyncio.iscoroutinefunction(func)
+        """threads taking the items of the stage queue"""
+        self.workers = 1 if self.is_async else self.concurrency
+
+
+class StagedPipeline:
+    """
+    Runs items through a sequence of stages connected by bounded queues.
+
+    Each stage has its own worker threads, so an item moves on to the next stage as soon
+    as it is ready and all stages work at the same time. When a stage falls behind, its
+    queue fills up and the stages before it block (backpressure) instead of piling up
+    items in memory. Every stage shows a live progress bar with its throughput, queue
+    depth and number of items in progress.
+
+    on_error: called with the stage name, the item and the exception when a stage fails
+    on_done: called with an item which leaves the pipeline without error, after the last
+             stage or when a stage drops it
+    Exceptions raised by on_error and on_done are logged, they don't stop the workers.
+    item_size: if given, the progress bars count the bytes of the items it returns
+               instead of the items, so their rate and ETA don't depend on the mix of
+               small and large items
+    """
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        on_error: Optional[Callable[[str, Any, Exception], None]] = None,
+        on_done: Optional[Callable[[Any], None]] = None,
+        item_size: Optional[Callable[[Any], int]] = None,
+    ):
+        self.stages = stages
+        self.on_error = on_error
+        self.on_done = on_done
+        self.item_size = item_size
+        self._queues = [Queue(maxsize=stage.queue_size) for stage in stages]
+        self._lock = threading.Lock()
+        self._active = [0] * len(stages)
+        self._queued = [0] * len(stages)
+        self._running_workers = [stage.workers for stage in stages]
+        self._bars: List[tqdm] = []
+        self._feed_error: Optional[BaseException] = None
+        self.completed = 0
+
+    def _put(self, index: int, item):
+        """blocks while the stage queue is full"""
+        with self._lock:
+            self._queued[index] += 1
+        self._queues[index].put(item)
+
+    def _feed(self, items: Iterable):
+        """an exception of the items iterator stops the feeding, run() raises it at the end"""
+        try:
+            for item in items:
+                self._put(0, item)
+        except BaseException as e:
+            self._feed_error = e
+        finally:
+            for _ in range(self.stages[0].workers):
+                self._queues[0].put(_DONE)
+
+    def _callback(self, callback: Optional[Callable], *args):
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            logging.error(f"{getattr(callback, '__name__', callback)} failed: {e}")
+
+    def _update_progress(self, index: int):
+        postfix = self.stages[index].postfix
+        self._bars[index].set_postfix(
+            queued=self._queued[index],
+            active=self._active[index],
+            **(postfix() if postfix is not None else {}),
+            refresh=False,
+        )
+
+    def _start_item(self, index: int):
+        with self._lock:
+            self._queued[index] -= 1
+            self._active[index] += 1
+            self._update_progress(index)
+
+    def _finish_item(self, index: int, item, result, error: Optional[Exception]):
+        """Report the item, and pass its result on to the next stage (blocks while it is full)."""
+        if error is not None:
+            self._callback(self.on_error, self.stages[index].name, item, error)
+        with self._lock:
+            self._active[index] -= 1
+            self._bars[index].update(1 if self.item_size is None else self.item_size(item))
+            self._update_progress(index)
+
+        if result is None:
+            if error is None:
+                self._callback(self.on_done, item)
+        elif index + 1 < len(self.stages):
+            self._put(index + 1, result)
+        else:
+            with self._lock:
+                self.completed += 1
+            self._callback(self.on_done, result)
+
+    def _stop_worker(self, index: int):
+        """the next stage stops once every worker of this one is gone, even after a crash"""
+        with self._lock:
+            self._running_workers[index] -= 1
+            last_worker = self._running_workers[index] == 0
+        if last_worker and index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1].workers):
+                self._queues[index + 1].put(_DONE)
+
+    def _work(self, index: int):
+        stage = self.stages[index]
+        queue = self._queues[index]
+        try:
+            while True:
+                item = queue.get()
+                if item is _DONE:
+                    break
+
+                self._start_item(index)
+                try:
+                    result, error = stage.func(item), None
+                except Exception as e:
+                    result, error = None, e
+                self._finish_item(index, item, result, error)
+        finally:
+            self._stop_worker(index)
+
+    def _work_async(self, index: int):
+        try:
+            asyncio.run(self._run_async_stage(index))
+        finally:
+            self._stop_worker(index)
+
+    async def _run_async_stage(self, index: int):
+        """
+        One coroutine per item, at most `concurrency` at a time. The blocking queue
+        reads, callbacks and hand-offs to the next stage run off the event loop.
+        """
+        stage = self.stages[index]
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(stage.concurrency)
+        running = set()
+
+        async def process(item):
+            try:
+                self._start_item(index)
+                try:
+                    result, error = await stage.func(item), None
+                except Exception as e:
+                    result, error = None, e
+                await loop.run_in_executor(None, self._finish_item, index, item, result, error)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=1) as reader:
+            while True:
+                await slots.acquire()
+                item = await loop.run_in_executor(reader, self._queues[index].get)
+                if item is _DONE:
+                    break
+                task = loop.create_task(process(item))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            if running:
+                await asyncio.gather(*running)
+
+    def run(self, items: Iterable, total: Optional[int] = None) -> int:
+        """
+        Run the items through all the stages and wait until every item is done.
+        If the items iterator raises, the items already taken still go through the
+        stages, then its exception is raised.
+
+        :param total: number of items, or with item_size their total size in bytes
+        :return: Number of items which went through the last stage.
+        """
+        units = {} if self.item_size is None else {"unit": "B", "unit_scale": True, "unit_divisor": 1024}
+        self._bars = [
+            tqdm(total=total, desc=stage.name, position=position, **units)
+            for position, stage in enumerate(self.stages)
+        ]
+        threads = [threading.Thread(target=self._feed, args=(items,), daemon=True)]
+        for index, stage in enumerate(self.stages):
+            target = self._work_async if stage.is_async else self._work
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=target, args=(index,), daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for bar in self._bars:
+            bar.close()
+        if self._feed_error is not None:
+            raise self._feed_error
+        return self.completed
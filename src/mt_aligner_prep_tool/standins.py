@@ -0,0 +1,236 @@
+"""
+Local stand-ins for the external services of the pipeline and synthetic TM texts, used by
+the benchmarks, the load tests and the tests to run without GitHub, S3 or the aligner.
+"""
+import hashlib
+import json
+import random
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+
+class FilesystemS3Client:
+    """
+    Stand-in for the boto3 S3 client calls made by S3TransferManager, storing objects
+    as files under `root`. Every call sleeps `latency` seconds to mimic a round trip.
+    """
+
+    def __init__(self, root: Path, latency: float = 0.0):
+        self.root = Path(root)
+        self.latency = latency
+
+    def get_object_path(self, bucket: str, key: str) -> Path:
+        return self.root / bucket / key
+
+    def _get_metadata_path(self, bucket: str, key: str) -> Path:
+        object_path = self.get_object_path(bucket, key)
+        return object_path.with_name(object_path.name + ".metadata.json")
+
+    def head_object(self, Bucket: str, Key: str) -> Dict:
+        time.sleep(self.latency)
+        metadata_path = self._get_metadata_path(Bucket, Key)
+        if not metadata_path.exists():
+            raise ClientError(
+                {"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject"
+            )
+        return json.loads(metadata_path.read_text())
+
+    def upload_file(
+        self,
+        Filename: str,
+        Bucket: str,
+        Key: str,
+        ExtraArgs: Optional[Dict] = None,
+        Config=None,
+    ):
+        time.sleep(self.latency)
+        object_path = self.get_object_path(Bucket, Key)
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(Filename, object_path)
+
+        md5 = hashlib.md5()
+        with open(object_path, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                md5.update(block)
+        head = dict(ExtraArgs or {})
+        head["ETag"] = f'"{md5.hexdigest()}"'
+        head["ContentLength"] = object_path.stat().st_size
+        self._get_metadata_path(Bucket, Key).write_text(json.dumps(head))
+
+    def generate_presigned_url(
+        self, ClientMethod: str, Params: Dict, ExpiresIn: int = 3600
+    ) -> str:
+        object_path = self.get_object_path(Params["Bucket"], Params["Key"])
+        return f"{object_path.resolve().as_uri()}?expires={int(time.time()) + ExpiresIn}"
+
+
+class _AlignerStubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:  # type: ignore
+            server.requests_count += 1  # type: ignore
+            server.in_flight += 1  # type: ignore
+            throttled = (
+                server.max_concurrent is not None  # type: ignore
+                and server.in_flight > server.max_concurrent  # type: ignore
+            ) or server.random.random() < server.throttle_rate  # type: ignore
+            failed = server.random.random() < server.error_rate  # type: ignore
+        try:
+            if throttled:
+                self._send_status(429, {"Retry-After": str(server.retry_after)})  # type: ignore
+            elif failed:
+                self._send_status(503)
+            else:
+                time.sleep(server.latency)  # type: ignore
+                response = json.dumps({"text_id": body["inputs"]["text_id"]}).encode()
+                self._send_status(200, {"Content-Type": "application/json"}, response)
+        finally:
+            with server.lock:  # type: ignore
+                server.in_flight -= 1  # type: ignore
+
+    def _send_status(self, status: int, headers: Optional[Dict] = None, body: bytes = b""):
+        with self.server.lock:  # type: ignore
+            status_counts = self.server.status_counts  # type: ignore
+            status_counts[status] = status_counts.get(status, 0) + 1
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    """many clients connect at once during load tests"""
+    request_queue_size = 128
+
+
+class AlignerStubServer:
+    """
+    Local http server answering alignment requests like the aligner endpoint, after
+    `latency` seconds. Use as a context manager, requests go to `url`.
+
+    error_rate: fraction of the requests failing with 503
+    throttle_rate: fraction of the requests answered with 429
+    max_concurrent: requests beyond this number in flight are answered with 429
+    retry_after: Retry-After header (seconds) of the 429 responses
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        max_concurrent: Optional[int] = None,
+        retry_after: float = 1,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.server = _StubHTTPServer((host, port), _AlignerStubHandler)
+        self.server.latency = latency  # type: ignore
+        self.server.error_rate = error_rate  # type: ignore
+        self.server.throttle_rate = throttle_rate  # type: ignore
+        self.server.max_concurrent = max_concurrent  # type: ignore
+        self.server.retry_after = retry_after  # type: ignore
+        self.server.random = random.Random(seed)  # type: ignore
+        self.server.requests_count = 0  # type: ignore
+        self.server.in_flight = 0  # type: ignore
+        self.server.status_counts = {}  # type: ignore
+        self.server.lock = threading.Lock()  # type: ignore
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def requests_count(self) -> int:
+        return self.server.requests_count  # type: ignore
+
+    @property
+    def status_counts(self) -> Dict[int, int]:
+        """Number of responses sent with each status code"""
+        return dict(self.server.status_counts)  # type: ignore
+
+    def start(self) -> "AlignerStubServer":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "AlignerStubServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+"""Synthetic text is generated up to this size, larger corpora repeat it"""
+BLOCK_SIZE = 1024 * 1024
+
+EN_WORDS = (
+    "the of and to in a is that for it as was with be by on not he this are or his "
+    "from at which but have an they you were her she there been one all we their "
+    "mind nature emptiness teacher compassion wisdom practice meditation path body "
+    "speech awareness appearance phenomena suffering liberation buddha dharma sangha"
+).split()
+EN_SENT_ENDS = [". ", ". ", ". ", "? ", "! ", ".\n", ".\n\n"]
+EN_EXTRAS = [" (see p. 12)", ", e.g. this one", " 1️⃣", " Mr. Smith", ";", ","]
+
+BO_SYLLABLES = (
+    "ཀ ཁ ག ང ཅ ཆ ཇ ཉ ཏ ཐ ད ན པ ཕ བ མ ཙ ཚ ཛ ཝ ཞ ཟ འ ཡ ར ལ ཤ ས ཧ ཨ "
+    "ཀི ཁུ གེ ངོ ཆོས སེམས བྱང ཆུབ རྒྱལ བསྟན དཔལ ལྡན བླ མ སྐུ གསུང ཐུགས "
+    "ཤེས རབ སྙིང རྗེ དགེ བའི བཤེས གཉེན ལམ རིམ སྒོམ པ"
+).split()
+BO_SENT_ENDS = ["།", "། ", "། །", "།།", "༎ ", "། \n", "ཿ ", "༔ "]
+
+
+def _generate_block(make_sentence, size: int, seed: int) -> str:
+    rng = random.Random(seed)
+    sentences: List[str] = []
+    length = 0
+    while length < size:
+        sentence = make_sentence(rng)
+        sentences.append(sentence)
+        length += len(sentence.encode("utf-8"))
+    return "".join(sentences)
+
+
+def _make_en_sentence(rng: random.Random) -> str:
+    words = rng.choices(EN_WORDS, k=rng.randint(4, 30))
+    words[0] = words[0].capitalize()
+    sentence = " ".join(words)
+    if rng.random() < 0.2:
+        sentence += rng.choice(EN_EXTRAS)
+    return sentence + rng.choice(EN_SENT_ENDS)
+
+
+def _make_bo_sentence(rng: random.Random) -> str:
+    syllables = rng.choices(BO_SYLLABLES, k=rng.randint(3, 25))
+    return "་".join(syllables) + rng.choice(BO_SENT_ENDS)
+
+
+def generate_text(lang: str, size: int, seed: int = 0) -> str:
+    """
+    Deterministic synthetic english ('en') or tibetan ('bo') text of about `size` bytes.
+    """
+    make_sentence = _make_en_sentence if lang == "en" else _make_bo_sentence
+    block = _generate_block(make_sentence, min(size, BLOCK_SIZE), seed)
+    repeat = -(-size // len(block.encode("utf-8")))
+    return block * repeat
@@ -1,8 +1,24 @@
+import json
+import os
 import subprocess
 import argparse
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+import requests
 from tqdm import tqdm
 from multiprocessing import Pool
 
+from mt_aligner_prep_tool.config import BASE_PATH
+
+GITHUB_API_URL = "https://api.github.com"
+
+"""Folder where the repository listings of the organizations are cached"""
+REPO_LISTING_CACHE_PATH = BASE_PATH / "repo_listings"
+REPO_LISTING_CACHE_TTL = 3600
+
+
 def worker_task(args):
 
     org_name, repo_name = args
@@ -12,34 +28,153 @@ def worker_task(args):
     result = subprocess.run(["git", "ls-remote", repo_url], capture_output=True, text=True)
     if result.returncode == 0:
         return repo_name
-    
-    return None 
+
+    return None
 
 
-def check_repo_exists_ssh(org_name, repo_names):
+def check_repo_exists_ssh(org_name, repo_names, num_processes=5):
     existing_repos = []
     tasks = [(org_name, repo_name) for repo_name in repo_names]
-    
-    num_processes = 5
+    if len(tasks) == 0:
+        return existing_repos
+
     with Pool(processes=num_processes) as pool:
         results = list(
             tqdm(
                 pool.imap(worker_task, tasks),
                 total=len(tasks),
-                desc="Converting files to txt",
+                desc="Checking repositories over ssh",
             )
         )
 
     existing_repos = [repo for repo in results if repo is not None]
     return existing_repos
 
-    
+
+def fetch_org_repo_pages(
+    org_name: str,
+    api_url: str = GITHUB_API_URL,
+    cached_pages: Optional[Dict[str, Dict]] = None,
+    token: Optional[str] = None,
+) -> List[Dict]:
+    """
+    List the repositories of an organization page by page, following the `next` links.
+    Pages of `cached_pages` (keyed by url) are revalidated with their ETag, so unchanged
+    pages are not downloaded again.
+
+    :return: List of pages as {"url", "etag", "next", "repos"}.
+    """
+    cached_pages = cached_pages or {}
+    session = requests.Session()
+    session.headers["Accept"] = "application/vnd.github+json"
+    if token:
+        session.headers["Authorization"] = f"Bearer {token}"
+
+    pages = []
+    url: Optional[str] = f"{api_url}/orgs/{org_name}/repos?per_page=100&type=all"
+    while url:
+        cached_page = cached_pages.get(url)
+        headers = {"If-None-Match": cached_page["etag"]} if cached_page else {}
+        response = session.get(url, headers=headers, timeout=60)
+        if response.status_code == 304 and cached_page:
+            page = cached_page
+        elif response.status_code == 200:
+            page = {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "next": response.links.get("next", {}).get("url"),
+                "repos": [repo["name"] for repo in response.json()],
+            }
+        else:
+            raise Exception(
+                f"Failed to list repositories of {org_name}: {response.status_code}, {response.text}"
+            )
+        pages.append(page)
+        url = page["next"]
+    return pages
+
+
+def list_org_repos(
+    org_name: str,
+    api_url: str = GITHUB_API_URL,
+    cache_path: Path = REPO_LISTING_CACHE_PATH,
+    ttl: float = REPO_LISTING_CACHE_TTL,
+) -> Set[str]:
+    """
+    Names (lower cased) of all the repositories of an organization.
+    The listing is cached on disk, reused as is for `ttl` seconds and revalidated
+    with ETags after that.
+    """
+    cache_file = Path(cache_path) / f"{org_name}.json"
+    cache = json.loads(cache_file.read_text()) if cache_file.exists() else None
+    if cache is None or time.time() - cache["fetched_at"] > ttl:
+        cached_pages = {page["url"]: page for page in cache["pages"]} if cache else None
+        pages = fetch_org_repo_pages(
+            org_name, api_url, cached_pages, token=os.environ.get("GITHUB_TOKEN")
+        )
+        cache = {"fetched_at": time.time(), "pages": pages}
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(cache))
+        os.replace(tmp_file, cache_file)
+    return {repo.lower() for page in cache["pages"] for repo in page["repos"]}
+
+
+def check_repos_exist(
+    org_name: str,
+    repo_names: List[str],
+    api_url: str = GITHUB_API_URL,
+    ssh_fallback: bool = True,
+    cache_path: Path = REPO_LISTING_CACHE_PATH,
+    num_ssh_processes: int = 5,
+) -> List[str]:
+    """
+    Check which repositories exist against a single listing of the organization.
+    Repositories missing from the listing are checked one by one over ssh if
+    `ssh_fallback`, which also covers a failed listing or one which is out of date.
+    """
+    try:
+        org_repos = list_org_repos(org_name, api_url, cache_path)
+    except Exception as e:
+        print(f"Listing repositories failed, checking all of them over ssh: {e}")
+        org_repos = set()
+
+    existing_repos = [repo for repo in repo_names if repo.lower() in org_repos]
+    if ssh_fallback:
+        missing_repos = [repo for repo in repo_names if repo.lower() not in org_repos]
+        existing_repos += check_repo_exists_ssh(
+            org_name, missing_repos, num_ssh_processes
+        )
+    return existing_repos
+
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Check for existing GitHub repositories via SSH.')
+    parser = argparse.ArgumentParser(description='Check for existing GitHub repositories.')
     parser.add_argument('file', type=str, help='File containing a list of repository names.')
+    parser.add_argument(
+        '--no_ssh_fallback',
+        action='store_true',
+        help='Trust the organization listing and skip the ssh check of missing repositories.',
+    )
+    parser.add_argument(
+        '--ssh_only',
+        action='store_true',
+        help='Check every repository over ssh without listing the organization.',
+    )
+    parser.add_argument(
+        '--api_url',
+        type=str,
+        default=GITHUB_API_URL,
+        help='Base url of the GitHub API used to list the organization.',
+    )
+    parser.add_argument(
+        '--ssh_processes',
+        type=int,
+        default=5,
+        help='Number of repositories checked over ssh at a time.',
+    )
     args = parser.parse_args()
-    
+
     """ Read repo names from the file """
     with open(args.file, 'r') as file:
         repo_names = [line.strip() for line in file if line.strip()]
@@ -47,16 +182,26 @@ if __name__ == "__main__":
     """ add TM before ids """
     TM_repo_names = [f"TM{id}" for id in repo_names]
     org_name = "MonlamAI"
-    existing_repos = check_repo_exists_ssh(org_name, TM_repo_names)
+    if args.ssh_only:
+        existing_repos = check_repo_exists_ssh(org_name, TM_repo_names, args.ssh_processes)
+    else:
+        existing_repos = check_repos_exist(
+            org_name,
+            TM_repo_names,
+            api_url=args.api_url,
+            ssh_fallback=not args.no_ssh_fallback,
+            num_ssh_processes=args.ssh_processes,
+        )
 
     """ remove TM from the existing repo names """
-    existing_repos = [repo[2:] for repo in existing_repos]
+    existing_repos = set(repo[2:] for repo in existing_repos)
 
     """ Write the existing repository names to a file """
     with open('existing_TMs.txt', 'w') as file:
-        for repo in existing_repos:
-            file.write(repo + '\n')
-    
+        for repo in repo_names:
+            if repo in existing_repos:
+                file.write(repo + '\n')
+
     """ Write the non-existing repository names to a file """
     with open('non_existing_TMs.txt', 'w') as file:
         for repo in repo_names:
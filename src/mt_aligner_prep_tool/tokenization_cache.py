@@ -0,0 +1,112 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict
+
+from mt_aligner_prep_tool.checkpoint import SqliteStore
+from mt_aligner_prep_tool.utility import get_file_hash
+
+
+class TokenizationCache(SqliteStore):
+    """
+    Content addressed cache of tokenized files.
+
+    Entries are keyed by the hash of the source file, the language and the tokenizer
+    version, so a cached output is only reused when neither the source text nor the
+    tokenizer changed. The least recently used entries are evicted when the size of
+    the cache goes over `max_size_bytes`.
+    """
+
+    def __init__(self, cache_dir: Path, max_size_bytes: int):
+        super().__init__(Path(cache_dir) / "index.sqlite")
+        self.cache_dir = Path(cache_dir)
+        self.max_size_bytes = max_size_bytes
+
+    def create_tables(self, connection: sqlite3.Connection):
+        connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO stats (name, value) VALUES ('hits', 0), ('misses', 0);
+            """
+        )
+
+    def get_key(self, source_file: Path, lang: str, tokenizer_version: str) -> str:
+        key_text = f"{get_file_hash(source_file)}:{lang}:{tokenizer_version}"
+        return hashlib.sha256(key_text.encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.txt"
+
+    def _count(self, name: str):
+        self.connection.execute(
+            "UPDATE stats SET value = value + 1 WHERE name = ?", (name,)
+        )
+
+    def get(self, key: str, output_file: Path) -> bool:
+        """Copy the cached output of `key` to output_file, return False on a miss."""
+        found = self.connection.execute(
+            "SELECT 1 FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if found:
+            try:
+                shutil.copyfile(self._entry_path(key), output_file)
+            except FileNotFoundError:
+                """evicted by another process in the meantime"""
+                found = None
+        if not found:
+            self._count("misses")
+            return False
+
+        self.connection.execute(
+            "UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+        self._count("hits")
+        return True
+
+    def put(self, key: str, tokenized_file: Path):
+        """Add a tokenized file to the cache and evict entries over the size cap."""
+        connection = self.connection
+        entry_path = self._entry_path(key)
+        tmp_path = entry_path.with_suffix(f".{os.getpid()}.tmp")
+        shutil.copyfile(tokenized_file, tmp_path)
+        os.replace(tmp_path, entry_path)
+        connection.execute(
+            "INSERT OR REPLACE INTO entries (key, size, last_used) VALUES (?, ?, ?)",
+            (key, entry_path.stat().st_size, time.time()),
+        )
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_size_bytes."""
+        total_size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+        for key, size in self.connection.execute(
+            "SELECT key, size FROM entries ORDER BY last_used"
+        ).fetchall():
+            if total_size <= self.max_size_bytes:
+                break
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._entry_path(key).unlink(missing_ok=True)
+            total_size -= size
+
+    def stats(self) -> Dict[str, int]:
+        stats = dict(self.connection.execute("SELECT name, value FROM stats").fetchall())
+        entries, size = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        stats.update({"entries": entries, "size": size})
+        return stats
@@ -1,18 +1,124 @@
+import os
 import re
-from typing import List
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from importlib import metadata
+from multiprocessing import current_process
+from pathlib import Path
+from typing import Callable, Deque, Iterable, Iterator, List, Optional
 
-from spacy.lang.en import English
-from bo_sent_tokenizer import segment
+from mt_aligner_prep_tool.normalizer import Normalizer
+from mt_aligner_prep_tool.utility import SuppressStdout, atomic_write
 
-from mt_aligner_prep_tool.utility import SuppressStdout
+"""
+spacy and bo_sent_tokenizer take more than a second to import, they are only loaded
+when a text is tokenized so the CLIs which never tokenize start instantly.
+"""
+_en_nlp = None
+_segment: Optional[Callable[[str], str]] = None
+
+
+def get_en_nlp():
+    """English pipeline with the sentencizer, loaded on first use."""
+    global _en_nlp
+    if _en_nlp is None:
+        from spacy.lang.en import English
+
+        en_nlp = English()
+        en_nlp.add_pipe("sentencizer")
+        en_nlp.max_length = 5000000
+        _en_nlp = en_nlp
+    return _en_nlp
+
+
+def get_segment() -> Callable[[str], str]:
+    """bo_sent_tokenizer.segment, imported on first use."""
+    global _segment
+    if _segment is None:
+        from bo_sent_tokenizer import segment
+
+        _segment = segment
+    return _segment
+
+
+def __getattr__(name: str):
+    """`en_nlp` stays importable from this module, it is loaded when first accessed"""
+    if name == "en_nlp":
+        return get_en_nlp()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-en_nlp = English()
-en_nlp.add_pipe("sentencizer")
-en_nlp.max_length = 5000000
 
 # Types
 SENT_PER_LINE_STR = str  # sentence per line string
 
+"""Number of characters read at a time by the streaming english tokenizer"""
+EN_STREAM_WINDOW_SIZE = 100000
+
+"""Same as CLOSING_PUNCTS of bo_sent_tokenizer, a tibetan sentence ends after a run of them"""
+BO_CLOSING_PUNCTS = ["།", "༎", "༏", "༐", "༔", "༴", "༻", "༽", "༾", "࿚"]
+BO_SENT_END = re.compile(
+    b"(?:" + b"|".join(re.escape(punct.encode()) for punct in BO_CLOSING_PUNCTS) + b")+"
+)
+
+"""Bytes after a closing punctuation looked at to tell if the sentence goes on"""
+BO_LOOKAHEAD_SIZE = 64
+
+"""Bytes before the end of a chunk searched first for a sentence boundary"""
+BO_SEARCH_WINDOW_SIZE = 4096
+
+"""Size of the chunks of a tibetan text segmented one at a time"""
+BO_CHUNK_SIZE_MB = 1
+
+"""Preprocessing of the tibetan texts: emoji removal only"""
+BO_NORMALIZER = Normalizer()
+
+"""Preprocessing of the english texts: emoji removal, whitespace collapse and newline folding"""
+EN_NORMALIZER = Normalizer(collapse_whitespace=True, fold_newlines=True)
+
+"""en_preprocess, the whitespace rules without the emoji removal"""
+_EN_WHITESPACE_NORMALIZER = Normalizer(
+    remove_emojis=False, collapse_whitespace=True, fold_newlines=True
+)
+
+NORMALIZERS = {"bo": BO_NORMALIZER, "en": EN_NORMALIZER}
+
+"""Bump when the preprocessing or tokenization output changes, it invalidates the tokenization cache"""
+TOKENIZER_REVISION = "1"
+
+
+def get_tokenizer_version(lang: str) -> str:
+    """Version of everything which affects the tokenized output of a language."""
+    if lang == "en":
+        engine_version = f"spacy-{metadata.version('spacy')}"
+    elif lang == "bo":
+        try:
+            engine_version = f"bo_sent_tokenizer-{metadata.version('bo_sent_tokenizer')}"
+        except metadata.PackageNotFoundError:
+            engine_version = "bo_sent_tokenizer-unknown"
+    else:
+        raise NotImplementedError
+    return f"{lang}-{TOKENIZER_REVISION}-{NORMALIZERS[lang].version}-{engine_version}"
+
+
+def get_tokenizers_version() -> str:
+    """Version of the tokenized BO and EN files of an id, recorded with its tokenization."""
+    return ";".join(get_tokenizer_version(lang) for lang in ("bo", "en"))
+
+
+def init_tokenizer_worker():
+    """
+    Pool initializer: load the english sentencizer and the tibetan segmenter
+    once per worker process so that every task in the worker reuses them.
+    Workers forked after load_tokenizers() inherit them already loaded.
+    """
+    load_tokenizers()
+
+
+def load_tokenizers():
+    """Load both tokenizers and run them once."""
+    get_en_nlp()("Warm up.")
+    get_segment()("།")
+
 
 def join_sentences(sentences):
     """Join sentences into a text with one sentence per line."""
@@ -20,95 +126,280 @@ def join_sentences(sentences):
 
 
 def en_preprocess(text: str) -> str:
-    re_sub = [(r"\r\n", " "), (r"\n", " "), (r"\s{2,}", " "), (r"\t", " ")]
-    for pattern, repl in re_sub:
-        text = re.sub(pattern, repl, text)
-    return text
+    return _EN_WHITESPACE_NORMALIZER.normalize(text)
 
 
 def en_sent_tokenizer(text: SENT_PER_LINE_STR) -> SENT_PER_LINE_STR:
-    """Tokenize a text into sentences."""
-    text = en_preprocess(text)
-    doc = en_nlp(text)
+    """Tokenize a text into sentences, emojis are removed as well."""
+    text = EN_NORMALIZER.normalize(text)
+    doc = get_en_nlp()(text)
     sentences = [sent.text for sent in doc.sents]
     return join_sentences(sentences)
 
 
+def read_text_windows(file_path: Path, window_size: int) -> Iterator[str]:
+    """Read a text file `window_size` characters at a time."""
+    with open(file_path) as file:
+        for window in iter(lambda: file.read(window_size), ""):
+            yield window
+
+
+def en_preprocess_stream(windows: Iterable[str]) -> Iterator[str]:
+    """remove_emojis and en_preprocess over a stream of text windows, in a single pass."""
+    return EN_NORMALIZER.normalize_stream(windows)
+
+
+def en_sent_tokenizer_stream(
+    texts: Iterable[str], window_size: int = EN_STREAM_WINDOW_SIZE
+) -> Iterator[str]:
+    """
+    Yield the sentences of preprocessed text windows, the same sentences as
+    en_sent_tokenizer gives on the whole text.
+
+    The last sentences of a window are carried over to the next one, starting at the
+    last sentence which begins after a space and before the last (possibly incomplete)
+    word. The tokenizer splits on spaces and the sentencizer restarts at every
+    sentence, so the carried text is tokenized and split exactly like in the whole text.
+    """
+    en_nlp = get_en_nlp()
+    carry = ""
+    next_attempt_size = window_size
+    for text in texts:
+        carry += text
+        if len(carry) < next_attempt_size:
+            continue
+
+        sents = list(en_nlp(carry).sents)
+        last_space = carry.rfind(" ")
+        for i in range(len(sents) - 1, 0, -1):
+            start_char = sents[i].start_char
+            if start_char < last_space and carry[start_char - 1] == " ":
+                for complete_sent in sents[:i]:
+                    yield complete_sent.text
+                carry = carry[start_char:]
+                break
+        """no sentence boundary found yet, wait for at least one more window"""
+        next_attempt_size = len(carry) + window_size
+
+    for sent in en_nlp(carry).sents:
+        yield sent.text
+
+
+def en_sent_tokenize_file(
+    input_file: Path, output_file: Path, window_size: int = EN_STREAM_WINDOW_SIZE
+) -> int:
+    """
+    Streaming version of sent_tokenize(text, lang="en") from file to file. The input is read
+    in windows of `window_size` characters and sentences are written as they are found,
+    so memory use doesn't grow with the size of the file. The output file only appears
+    once it is complete.
+
+    :return: Number of sentences written.
+    """
+    windows = read_text_windows(input_file, window_size)
+    sentences = en_sent_tokenizer_stream(en_preprocess_stream(windows), window_size)
+    sentences_count = 0
+    with atomic_write(output_file) as file:
+        for sentence in sentences:
+            if sentences_count:
+                file.write("\n")
+            file.write(sentence)
+            sentences_count += 1
+    return sentences_count
+
+
 def en_word_tokenizer(text: str) -> List[str]:
     """Tokenize a text into words."""
-    doc = en_nlp(text)
+    doc = get_en_nlp()(text)
     words = [token.text for token in doc]
     return words
 
 
 
 def bo_sent_tokenizer(text: str) -> SENT_PER_LINE_STR:
-    text = remove_emojis(text)
-    sents_text = segment(text)
+    text = BO_NORMALIZER.normalize(text)
+    sents_text = get_segment()(text)
     return sents_text
 
 
 def remove_emojis(text):
-    emojis_to_remove = ["1️⃣", "2️⃣", "3️⃣"]
-    for emoji in emojis_to_remove:
-        text = text.replace(emoji, "")
-    return text
-
-def split_text_into_mb_chunks(text, chunk_size_mb=1):
-    chunk_size_bytes = chunk_size_mb * 1024 * 1024  # Convert MB to bytes
-    current_chunk = []
-    current_size = 0
-
-    lines = text.splitlines(keepends=True)  # Split text into lines, preserving line breaks
-
-    for line in lines:
-        line_size = len(line.encode('utf-8'))
-
-        while current_size + line_size > chunk_size_bytes:
-            if current_chunk:
-                yield ''.join(current_chunk)
-                current_chunk = []
-                current_size = 0
-
-            # If the line itself is larger than the chunk size, split it further
-            if line_size > chunk_size_bytes:
-                part = line[:chunk_size_bytes - current_size]
-                line = line[chunk_size_bytes - current_size:]
-                line_size = len(line.encode('utf-8', 'ignore'))
-                current_chunk.append(part)
-                yield ''.join(current_chunk)
-                current_chunk = []
-                current_size = 0
-            else:
+    """Works on utf-8 bytes as well as on text."""
+    if isinstance(text, bytes):
+        return BO_NORMALIZER.normalize_bytes(text)
+    return BO_NORMALIZER.normalize(text)
+
+
+def is_bo_sent_continued(data: bytes, offset: int) -> bool:
+    """True if the text at `offset` (after optional whitespace) is another closing punctuation."""
+    lookahead = data[offset : offset + BO_LOOKAHEAD_SIZE].decode("utf-8", "ignore").lstrip()
+    return lookahead[:1] in BO_CLOSING_PUNCTS
+
+
+def find_bo_chunk_end(data: bytes, start: int, limit: int) -> int:
+    """
+    Byte offset of the last tibetan sentence boundary (the end of a run of closing
+    punctuations) in data[start:limit]. Falls back to the last line break and then to
+    the last utf-8 character boundary when the window has no sentence boundary.
+    """
+    """search backwards from the limit in growing windows, a boundary is usually close"""
+    search_start = limit
+    window_size = BO_SEARCH_WINDOW_SIZE
+    while search_start > start:
+        search_start = max(limit - window_size, start)
+        for match in reversed(list(BO_SENT_END.finditer(data, search_start, limit))):
+            if not is_bo_sent_continued(data, match.end()):
+                return match.end()
+        window_size *= 4
+
+    line_end = data.rfind(b"\n", start, limit)
+    if line_end != -1:
+        return line_end + 1
+
+    end = limit
+    while end > start and (data[end] & 0xC0) == 0x80:  # utf-8 continuation byte
+        end -= 1
+    if end == start:
+        """window smaller than a character, cut after the character instead"""
+        end = limit
+        while end < len(data) and (data[end] & 0xC0) == 0x80:
+            end += 1
+    return end
+
+
+def split_text_into_mb_chunks(text, chunk_size_mb=BO_CHUNK_SIZE_MB):
+    """
+    Split a tibetan text into chunks of at most `chunk_size_mb` megabytes (in utf-8),
+    cut at sentence boundaries so that segmenting the chunks one by one gives the same
+    sentences as segmenting the whole text.
+    """
+    chunk_size_bytes = int(chunk_size_mb * 1024 * 1024)  # Convert MB to bytes
+    data = text.encode("utf-8")
+    start = 0
+    while start < len(data):
+        limit = start + chunk_size_bytes
+        end = len(data) if limit >= len(data) else find_bo_chunk_end(data, start, limit)
+        yield data[start:end].decode("utf-8")
+        start = end
+
+
+def read_bo_chunks(file_path: Path, chunk_size_mb: float = BO_CHUNK_SIZE_MB) -> Iterator[str]:
+    """
+    Streaming version of split_text_into_mb_chunks(remove_emojis(text)) for a tibetan
+    file. The file is read in blocks of the chunk size and a chunk is only decoded once
+    it is cut at a sentence boundary, so at most about two chunks are held in memory.
+    """
+    chunk_size_bytes = int(chunk_size_mb * 1024 * 1024)
+    data = b""
+    end_of_file = False
+    with open(file_path, "rb") as file:
+        while data or not end_of_file:
+            """a chunk end is only known with the lookahead after it read too"""
+            while not end_of_file and len(data) < chunk_size_bytes + BO_LOOKAHEAD_SIZE:
+                block = file.read(chunk_size_bytes)
+                end_of_file = not block
+                """again on the whole buffer, an emoji may straddle two blocks"""
+                data = remove_emojis(data + block)
+            if not data:
                 break
+            if len(data) <= chunk_size_bytes:
+                end = len(data)
+            else:
+                end = find_bo_chunk_end(data, 0, chunk_size_bytes)
+            yield data[:end].decode("utf-8")
+            data = data[end:]
+
+
+def tokenize_bo_chunk(chunk: str) -> SENT_PER_LINE_STR:
+    """Segment a chunk which emojis were already removed from."""
+    with SuppressStdout():
+        return get_segment()(chunk).strip()
+
 
-        # Add the line to the current chunk
-        current_chunk.append(line)
-        current_size += line_size
+def bo_tokenize_chunks(
+    chunks: Iterable[str],
+    num_processes: int = 1,
+    executor: Optional[Executor] = None,
+    max_pending_chunks: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    Segment tibetan chunks, in parallel on `executor` if given, or else on a pool of
+    `num_processes` workers if more than one. The tokenized chunks are yielded in the
+    order of the input chunks, empty ones are dropped.
 
-    # Add the last chunk if any
-    if current_chunk:
-        yield ''.join(current_chunk)
+    At most `max_pending_chunks` chunks (default: twice the number of processes) are
+    read ahead of the one being yielded, so a streamed file is never fully in memory.
+
+    Pool workers can't start pools of their own, so inside a worker the chunks
+    are always segmented one after another.
+    """
+    if executor is not None:
+        max_pending_chunks = max_pending_chunks or 2 * (os.cpu_count() or 1)
+        yield from _map_bounded(executor, chunks, max_pending_chunks)
+    elif num_processes > 1 and not current_process().daemon:
+        with ProcessPoolExecutor(
+            max_workers=num_processes, initializer=init_tokenizer_worker
+        ) as pool:
+            yield from _map_bounded(pool, chunks, max_pending_chunks or 2 * num_processes)
+    else:
+        for chunk in chunks:
+            tokenized_chunk = tokenize_bo_chunk(chunk)
+            if tokenized_chunk:
+                yield tokenized_chunk
+
+
+def _map_bounded(executor: Executor, chunks: Iterable[str], max_pending: int) -> Iterator[str]:
+    """executor.map reads all of its input at once, this submits chunks as results are taken"""
+    pending: Deque = deque()
+    for chunk in chunks:
+        pending.append(executor.submit(tokenize_bo_chunk, chunk))
+        if len(pending) >= max_pending:
+            tokenized_chunk = pending.popleft().result()
+            if tokenized_chunk:
+                yield tokenized_chunk
+    while pending:
+        tokenized_chunk = pending.popleft().result()
+        if tokenized_chunk:
+            yield tokenized_chunk
 
 
+def bo_sent_tokenize_file(
+    input_file: Path,
+    output_file: Path,
+    num_processes: int = 1,
+    executor: Optional[Executor] = None,
+    chunk_size_mb: float = BO_CHUNK_SIZE_MB,
+) -> int:
+    """
+    Streaming version of sent_tokenize(text, lang="bo") from file to file. Chunks are
+    read, segmented and written one by one, the output file only appears once it is
+    complete.
 
-def sent_tokenize(text, lang) -> SENT_PER_LINE_STR:
-    """Tokenize a text into sentences."""
-    text = remove_emojis(text)
+    :return: Number of sentences written.
+    """
+    chunks = read_bo_chunks(input_file, chunk_size_mb)
+    sentences_count = 0
+    with atomic_write(output_file) as file:
+        for tokenized_chunk in bo_tokenize_chunks(chunks, num_processes, executor):
+            file.write(tokenized_chunk + "\n")
+            sentences_count += tokenized_chunk.count("\n") + 1
+        if not sentences_count:
+            file.write("\n")
+    return sentences_count
 
+
+def sent_tokenize(
+    text, lang, num_processes: int = 1, executor: Optional[Executor] = None
+) -> SENT_PER_LINE_STR:
+    """
+    Tokenize a text into sentences.
+
+    num_processes: number of processes segmenting the chunks of a tibetan text.
+    executor: process pool executor segmenting the chunks of a tibetan text instead.
+    """
     if lang == "en":
         return en_sent_tokenizer(text)
     elif lang == "bo":
-        with SuppressStdout():
-            def tokenize_and_filter(text):
-                splited_text = split_text_into_mb_chunks(text)
-                for chunk in splited_text:
-                    tokenized_chunk = bo_sent_tokenizer(chunk).strip()
-                    if tokenized_chunk:
-                        yield tokenized_chunk
-            
-            return "\n".join(tokenize_and_filter(text)) + "\n"
+        chunks = split_text_into_mb_chunks(BO_NORMALIZER.normalize(text))
+        return "\n".join(bo_tokenize_chunks(chunks, num_processes, executor)) + "\n"
     else:
         raise NotImplementedError
-
-
@@ -1,42 +1,292 @@
+import gzip
+import os
 import random
+import shutil
+import tempfile
+import threading
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
 import boto3
 import requests
-from botocore.exceptions import NoCredentialsError
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError, NoCredentialsError
 
-from mt_aligner_prep_tool.config import load_token
+from mt_aligner_prep_tool.config import (
+    ALIGNER_ENDPOINT_URL,
+    PRESIGNED_URL_EXPIRATION,
+    S3_ENDPOINT_URL,
+    S3_MAX_CONCURRENCY,
+    S3_MULTIPART_THRESHOLD,
+    get_presigned_url_cache,
+    load_token,
+)
+from mt_aligner_prep_tool.utility import get_file_hash
 
+"""Object metadata key holding the sha256 of the uploaded file, before compression"""
+CHECKSUM_METADATA_KEY = "sha256"
 
-def upload_file_to_s3(local_file_path: Path, bucket: str, s3_file: str):
+"""Content-Encoding and key suffix of every supported upload compression"""
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+"""Block size of the streaming compression"""
+COMPRESSION_BLOCK_SIZE = 1024 * 1024
+
+"""zlib's default level, gzip's 9 is several times slower for a few percent smaller files"""
+GZIP_COMPRESSION_LEVEL = 6
+
+
+def get_compressed_key(s3_file: str, compression: Optional[str]) -> str:
+    """Key of the object holding `s3_file` compressed with `compression`."""
+    if compression is None:
+        return s3_file
+    if compression not in COMPRESSIONS:
+        raise ValueError(
+            f"Unknown compression {compression}, use one of {', '.join(COMPRESSIONS)}"
+        )
+    return s3_file + COMPRESSIONS[compression]
+
+
+def compress_file(source_file: Path, output_file: Path, compression: str):
+    """
+    Compress a file block by block. gzip output has no timestamp, so the same file
+    always gives the same object.
+    """
+    with open(source_file, "rb") as source:
+        if compression == "gzip":
+            with open(output_file, "wb") as output, gzip.GzipFile(
+                fileobj=output, mode="wb", compresslevel=GZIP_COMPRESSION_LEVEL, mtime=0
+            ) as compressed:
+                shutil.copyfileobj(source, compressed, COMPRESSION_BLOCK_SIZE)
+        elif compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise Exception(
+                    "zstd compression needs the zstandard package, "
+                    "install mt_aligner_prep_tool[zstd]"
+                )
+            with open(output_file, "wb") as output:
+                zstandard.ZstdCompressor().copy_stream(
+                    source, output, size=source_file.stat().st_size
+                )
+        else:
+            raise ValueError(f"Unknown compression {compression}")
+
+
+class S3TransferManager:
+    """
+    S3 clients and transfer settings shared by all the uploads of a process.
+
+    Clients are created once per region from a single boto3 session, and uploads are
+    skipped when the remote object already has the checksum of the local file. The
+    clients are thread-safe, the session isn't: clients are created under a lock.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        multipart_threshold: int = S3_MULTIPART_THRESHOLD,
+        max_concurrency: int = S3_MAX_CONCURRENCY,
+        endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+    ):
+        self.session = boto3.session.Session()
+        self.endpoint_url = endpoint_url
+        self.clients: Dict[Optional[str], object] = {}
+        self._clients_lock = threading.Lock()
+        if client is not None:
+            self.clients[None] = self.clients["us-east-1"] = client
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_threshold,
+            max_concurrency=max_concurrency,
+        )
+
+    def get_client(self, region_name: Optional[str] = None):
+        with self._clients_lock:
+            if region_name not in self.clients:
+                self.clients[region_name] = self.session.client(
+                    "s3", region_name=region_name, endpoint_url=self.endpoint_url
+                )
+            return self.clients[region_name]
+
+    def get_remote_checksum(self, bucket: str, s3_file: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Return the sha256 metadata and the ETag of an object, (None, None) if it doesn't exist.
+        """
+        try:
+            response = self.get_client().head_object(Bucket=bucket, Key=s3_file)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None, None
+            raise
+        return (
+            response.get("Metadata", {}).get(CHECKSUM_METADATA_KEY),
+            response.get("ETag", "").strip('"'),
+        )
+
+    def is_unchanged(
+        self,
+        local_file_path: Path,
+        checksum: str,
+        remote_checksum: Optional[str],
+        etag: Optional[str],
+    ) -> bool:
+        if remote_checksum is not None:
+            return remote_checksum == checksum
+        """objects uploaded without the metadata, the ETag of a single part upload is the md5"""
+        if etag and "-" not in etag:
+            return etag == get_file_hash(local_file_path, "md5")
+        return False
+
+    def upload_file(
+        self,
+        local_file_path: Path,
+        bucket: str,
+        s3_file: str,
+        compression: Optional[str] = None,
+        stats: Optional[Dict] = None,
+    ) -> bool:
+        """
+        Upload a file unless the remote object has the same content.
+
+        :param compression: "gzip" or "zstd" to upload the file compressed, with its
+                            Content-Encoding set. s3_file is the key of the compressed
+                            object, see get_compressed_key.
+        :param stats: if given, "raw_bytes" and "sent_bytes" are set to the size of the
+                      file and the number of bytes actually uploaded, and "etag" to the
+                      ETag of the remote object.
+        :return: True if the file was uploaded, False if the upload was skipped.
+        """
+        raw_size = local_file_path.stat().st_size
+        if stats is not None:
+            stats["raw_bytes"] = raw_size
+            stats["sent_bytes"] = 0
+        """the checksum is of the uncompressed file, so an unchanged file is never compressed"""
+        checksum = get_file_hash(local_file_path)
+        remote_checksum, etag = self.get_remote_checksum(bucket, s3_file)
+        if self.is_unchanged(local_file_path, checksum, remote_checksum, etag):
+            if stats is not None:
+                stats["etag"] = etag
+            return False
+
+        extra_args: Dict = {"Metadata": {CHECKSUM_METADATA_KEY: checksum}}
+        if compression is None:
+            self.get_client().upload_file(
+                str(local_file_path),
+                bucket,
+                s3_file,
+                ExtraArgs=extra_args,
+                Config=self.transfer_config,
+            )
+            sent_bytes = raw_size
+        else:
+            extra_args["ContentEncoding"] = compression
+            extra_args["ContentType"] = "text/plain; charset=utf-8"
+            fd, compressed_file = tempfile.mkstemp(
+                suffix=COMPRESSIONS.get(compression, ""), dir=local_file_path.parent
+            )
+            os.close(fd)
+            try:
+                compress_file(local_file_path, Path(compressed_file), compression)
+                self.get_client().upload_file(
+                    compressed_file,
+                    bucket,
+                    s3_file,
+                    ExtraArgs=extra_args,
+                    Config=self.transfer_config,
+                )
+                sent_bytes = Path(compressed_file).stat().st_size
+            finally:
+                os.remove(compressed_file)
+        if stats is not None:
+            stats["sent_bytes"] = sent_bytes
+            """managed uploads don't return the ETag of the new object"""
+            stats["etag"] = self.get_remote_checksum(bucket, s3_file)[1]
+        return True
+
+    def create_file_url(self, bucket_name: str, s3_file: str, expiration: int) -> str:
+        return self.get_client("us-east-1").generate_presigned_url(
+            "get_object",
+            Params={"Bucket": bucket_name, "Key": s3_file},
+            ExpiresIn=expiration,
+        )
+
+
+_transfer_manager: Optional[S3TransferManager] = None
+_transfer_manager_pid: Optional[int] = None
+_transfer_manager_lock = threading.Lock()
+
+
+def get_transfer_manager() -> S3TransferManager:
+    """S3 transfer manager of the current process, boto3 clients can't be shared with forked processes."""
+    global _transfer_manager, _transfer_manager_pid
+    with _transfer_manager_lock:
+        if _transfer_manager is None or _transfer_manager_pid != os.getpid():
+            _transfer_manager = S3TransferManager()
+            _transfer_manager_pid = os.getpid()
+        return _transfer_manager
+
+
+def set_transfer_manager(manager: S3TransferManager):
+    """Use `manager` for the uploads of the current process, e.g. one with a local stand-in client."""
+    global _transfer_manager, _transfer_manager_pid
+    _transfer_manager = manager
+    _transfer_manager_pid = os.getpid()
+
+
+def upload_file_to_s3(
+    local_file_path: Path,
+    bucket: str,
+    s3_file: str,
+    compression: Optional[str] = None,
+    stats: Optional[Dict] = None,
+) -> bool:
     """local_file_path: Path to the file to upload"""
     """bucket: Bucket to upload to"""
     """s3_file: file name to be upload to s3, folder path in s3 bucket is included in the file name"""
+    """compression: "gzip" or "zstd" to upload the file compressed, s3_file gets its suffix"""
+    """stats: if given, the raw size, the bytes uploaded and the ETag of the s3 file are set in it"""
+    """returns False if the upload was skipped because the s3 file has the same content"""
+    s3_file = get_compressed_key(s3_file, compression)
     try:
-        s3_client = boto3.client("s3")
-        s3_client.upload_file(local_file_path, bucket, s3_file)
+        uploaded = get_transfer_manager().upload_file(
+            local_file_path, bucket, s3_file, compression, stats
+        )
     except Exception as e:
         raise Exception(f"An error occurred while uploading file to s3: {e}")
+    if uploaded:
+        get_presigned_url_cache().invalidate(bucket, s3_file)
+    return uploaded
 
 
-def create_s3_file_url(bucket_name: str, s3_file: str, expiration=36000):
+def create_s3_file_url(
+    bucket_name: str,
+    s3_file: str,
+    expiration: int = PRESIGNED_URL_EXPIRATION,
+    etag: Optional[str] = None,
+):
     """
     Generate a presigned URL to share an S3 object
+    :param etag: ETag of the object, if given a url cached for the same object is
+                 handed back while it stays valid long enough, see PresignedUrlCache.
     :return: Presigned URL as string. If error, returns None.
     """
-    s3_client = boto3.client("s3", region_name="us-east-1")
+    url_cache = get_presigned_url_cache()
+    if etag:
+        url = url_cache.get(bucket_name, s3_file, etag)
+        if url is not None:
+            return url
     try:
-        response = s3_client.generate_presigned_url(
-            "get_object",
-            Params={"Bucket": bucket_name, "Key": s3_file},
-            ExpiresIn=expiration,
-        )
-        return response
+        url = get_transfer_manager().create_file_url(bucket_name, s3_file, expiration)
     except NoCredentialsError:
         raise Exception("Credentials not available while creating s3 file url")
     except Exception as e:
         raise Exception(f"An error occurred while creating s3 file url: {e}")
+    if etag:
+        url_cache.put(bucket_name, s3_file, etag, url, time.time() + expiration)
+    return url
 
 
 def generate_random_test_version():
@@ -48,12 +298,12 @@ def generate_random_test_version():
     return test_version
 
 
-def send_api_request_to_aligner(
+def build_aligner_request(
     id_: str,
     tokenized_tibetan_url: str,
     tokenized_english_url: str,
     alignment_version: Optional[str],
-):
+) -> Dict:
     if alignment_version:
         json_data = {
             "inputs": {
@@ -74,11 +324,21 @@ def send_api_request_to_aligner(
                 "parameters": {},
             }
         }
+    return json_data
+
 
-    endpoint_url = "https://x7ax6peed5uy2pr9.us-east-1.aws.endpoints.huggingface.cloud/"
+def send_api_request_to_aligner(
+    id_: str,
+    tokenized_tibetan_url: str,
+    tokenized_english_url: str,
+    alignment_version: Optional[str],
+):
+    json_data = build_aligner_request(
+        id_, tokenized_tibetan_url, tokenized_english_url, alignment_version
+    )
     bearer_token = load_token()
 
-    result = send_json_request(endpoint_url, bearer_token, json_data)
+    result = send_json_request(ALIGNER_ENDPOINT_URL, bearer_token, json_data)
     return result
 
 
@@ -1,26 +1,13 @@
-import time
+import hashlib
+import os
 import sys
 import io
 
-from functools import wraps
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Iterator
 
 
-
-def execution_time(custom_name=None):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            start_time = time.time()
-            result = func(*args, **kwargs)
-            end_time = time.time()
-            name = custom_name if custom_name else func.__name__
-            print(f"Total time taken for {name}: {end_time - start_time} seconds.")
-            return result
-
-        return wrapper
-
-    return decorator
-
 class SuppressStdout:
     def __enter__(self):
         self._original_stdout = sys.stdout
@@ -28,4 +15,87 @@ class SuppressStdout:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        sys.stdout = self._original_stdout
\ No newline at end of file
+        sys.stdout = self._original_stdout
+
+
+def get_folder_size(folder: Path) -> int:
+    """Total size in bytes of the files inside a folder."""
+    folder = Path(folder)
+    if not folder.exists():
+        return 0
+    return sum(file.stat().st_size for file in folder.rglob("*") if file.is_file())
+
+
+def get_file_hash(file_path: Path, algorithm: str = "sha256", block_size: int = 1024 * 1024) -> str:
+    """Hex digest of a file, read in blocks so large files are never fully loaded."""
+    file_hash = hashlib.new(algorithm)
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def count_file_lines(file_path: Path, block_size: int = 1024 * 1024) -> int:
+    """Number of lines of a file, a last line without newline included."""
+    lines = 0
+    last_block = b""
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            lines += block.count(b"\n")
+            last_block = block
+    if last_block and not last_block.endswith(b"\n"):
+        lines += 1
+    return lines
+
+
+@contextmanager
+def atomic_write(file_path: Path, mode: str = "w") -> Iterator[IO]:
+    """
+    Open a temporary file next to `file_path` which replaces it once the block is done,
+    so readers never see a partially written file. The temporary file is removed if the
+    block raises.
+    """
+    file_path = Path(file_path)
+    tmp_path = file_path.with_name(f".{file_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, mode) as file:
+            yield file
+        os.replace(tmp_path, file_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def get_file_content_by_lines(file_path):
+    """
+    Reads a file and returns its content split into lines.
+
+    :param file_path: Path to the file to be read.
+    :return: List of lines in the file.
+    """
+    file_path = Path(file_path)
+    if file_path.exists() and file_path.is_file():
+        with file_path.open("r") as file:
+            return [line.strip() for line in file if line.strip()]
+    else:
+        raise FileNotFoundError(f"No file found at {file_path}")
+
+
+SIZE_UNITS = {"KB": 1024, "MB": 1024 * 1024, "GB": 1024 * 1024 * 1024}
+
+
+def parse_size(size: str) -> int:
+    """'64KB' -> 65536"""
+    size = size.strip().upper()
+    for unit, multiplier in SIZE_UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[: -len(unit)]) * multiplier)
+    return int(size)
+
+
+def format_size(size: int) -> str:
+    """65536 -> '64.0KB', the inverse of parse_size"""
+    for unit, multiplier in reversed(list(SIZE_UNITS.items())):
+        if size >= multiplier:
+            return f"{size / multiplier:.1f}{unit}"
+    return f"{size}B"
@@ -0,0 +1,611 @@
+"""
+Queue of TM ids shared by pipeline workers, on one machine or many.
+
+A worker claims ids with a lease of a few minutes and renews the leases of the ids it
+holds with heartbeats while it works on them. An id whose lease expires (its worker
+crashed or lost the connection to the store) goes back to the queue and is claimed by
+another worker.
+
+The workers only use the QueueStore interface, there are two stores:
+- SqliteQueueStore: a sqlite file in WAL mode, for the workers of one host. WAL needs
+  memory shared by its processes, keep the file on a local disk, never on a network
+  filesystem (NFS, SMB) where it can be corrupted or let two workers hold the same lease.
+- HttpQueueStore: a queue served over http by QueueServer (`workqueue serve`), from a
+  SqliteQueueStore on the serving host, for workers on any number of hosts.
+"""
+import argparse
+import hmac
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from mt_aligner_prep_tool.checkpoint import SqliteStore
+from mt_aligner_prep_tool.utility import get_file_content_by_lines
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+"""Seconds a claimed id stays leased without a heartbeat"""
+DEFAULT_LEASE_SECONDS = 300
+
+"""Claims of an id before it is failed, an id which crashes its workers is not retried forever"""
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def get_worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class QueueStoreError(Exception):
+    """Request to a queue store which failed"""
+
+    pass
+
+
+class QueueStore:
+    """
+    Leased queue of ids, what the pipeline workers, LeaseKeeper and the cli use.
+
+    lease_seconds: seconds a claimed id stays leased without a heartbeat
+    location: path or url of the queue, to show to the user
+    """
+
+    lease_seconds: float = DEFAULT_LEASE_SECONDS
+    location: str = ""
+
+    def add(self, ids: Iterable[str]) -> int:
+        """
+        Queue ids in the given order, ids already in the queue are left as they are.
+
+        :return: Number of ids added.
+        """
+        raise NotImplementedError
+
+    def claim(self, worker: str, count: int = 1) -> List[str]:
+        """
+        Lease up to `count` pending ids, or ids whose lease expired, to `worker`.
+        Expired ids already claimed max_attempts times are failed instead.
+        """
+        raise NotImplementedError
+
+    def heartbeat(self, worker: str) -> int:
+        """
+        Renew the leases of all the ids held by `worker`.
+
+        :return: Number of leases renewed, ids whose lease already expired and were
+                 claimed by another worker are not renewed.
+        """
+        raise NotImplementedError
+
+    def complete(self, id_: str, worker: str):
+        """Mark an id as done, even when its lease expired in the meantime: the work is done."""
+        raise NotImplementedError
+
+    def fail(self, id_: str, worker: str, error: str = "", retry: bool = True):
+        """
+        Give back an id which failed: it is queued again while it was claimed less than
+        max_attempts times and `retry` is True, and failed otherwise.
+        """
+        raise NotImplementedError
+
+    def release(self, id_: str, worker: str):
+        """Give back an id which wasn't worked on, the claim doesn't count as an attempt."""
+        raise NotImplementedError
+
+    def requeue_failed(self) -> int:
+        """Queue the failed ids again with their attempts reset, returns their number."""
+        raise NotImplementedError
+
+    def has_work(self) -> bool:
+        """True while some ids are pending or leased, leased ids may come back when their lease expires."""
+        raise NotImplementedError
+
+    def status(self) -> Dict:
+        """
+        Number of ids per status, and per worker the ids it completed, failed and holds,
+        with its throughput in ids per hour since it first claimed an id.
+        """
+        raise NotImplementedError
+
+
+class SqliteQueueStore(SqliteStore, QueueStore):
+    """
+    Queue stored in sqlite, for the workers of one host, or served to other hosts by
+    QueueServer.
+
+    Every change of an id is a single transaction, so any number of workers can claim,
+    complete and fail ids at the same time without two of them holding the same id.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ):
+        super().__init__(db_path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.location = str(self.db_path)
+
+    def create_tables(self, connection: sqlite3.Connection):
+        connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS queue_items (
+                id TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS queue_items_status ON queue_items (status, position);
+            CREATE TABLE IF NOT EXISTS queue_workers (
+                worker TEXT PRIMARY KEY,
+                started_at REAL NOT NULL,
+                last_seen REAL NOT NULL
+            );
+            """
+        )
+
+    def _transaction(self) -> sqlite3.Connection:
+        """BEGIN IMMEDIATE takes the write lock at once, a claim never reads stale rows"""
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        return connection
+
+    def add(self, ids: Iterable[str]) -> int:
+        connection = self._transaction()
+        try:
+            position = connection.execute(
+                "SELECT COALESCE(MAX(position), 0) FROM queue_items"
+            ).fetchone()[0]
+            now = time.time()
+            added = 0
+            for id_ in dict.fromkeys(ids):
+                position += 1
+                added += connection.execute(
+                    "INSERT OR IGNORE INTO queue_items (id, position, status, updated_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (id_, position, PENDING, now),
+                ).rowcount
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return added
+
+    def claim(self, worker: str, count: int = 1) -> List[str]:
+        now = time.time()
+        connection = self._transaction()
+        try:
+            claimed: List[str] = []
+            while len(claimed) < count:
+                rows = connection.execute(
+                    "SELECT id, status, attempts FROM queue_items "
+                    "WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                    "ORDER BY position LIMIT ?",
+                    (PENDING, LEASED, now, count - len(claimed)),
+                ).fetchall()
+                if not rows:
+                    break
+                for id_, status, attempts in rows:
+                    if status == LEASED and attempts >= self.max_attempts:
+                        connection.execute(
+                            "UPDATE queue_items SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                            (FAILED, f"lease expired {attempts} times", now, id_),
+                        )
+                        continue
+                    connection.execute(
+                        "UPDATE queue_items SET status = ?, worker = ?, lease_expires = ?, "
+                        "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (LEASED, worker, now + self.lease_seconds, now, id_),
+                    )
+                    claimed.append(id_)
+            self._touch_worker(connection, worker, now)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return claimed
+
+    def _touch_worker(self, connection: sqlite3.Connection, worker: str, now: float):
+        connection.execute(
+            "INSERT INTO queue_workers (worker, started_at, last_seen) VALUES (?, ?, ?) "
+            "ON CONFLICT (worker) DO UPDATE SET last_seen = excluded.last_seen",
+            (worker, now, now),
+        )
+
+    def heartbeat(self, worker: str) -> int:
+        now = time.time()
+        connection = self._transaction()
+        try:
+            renewed = connection.execute(
+                "UPDATE queue_items SET lease_expires = ? WHERE status = ? AND worker = ?",
+                (now + self.lease_seconds, LEASED, worker),
+            ).rowcount
+            self._touch_worker(connection, worker, now)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return renewed
+
+    def complete(self, id_: str, worker: str):
+        self.connection.execute(
+            "UPDATE queue_items SET status = ?, worker = ?, lease_expires = NULL, error = NULL, "
+            "updated_at = ? WHERE id = ? AND status != ?",
+            (DONE, worker, time.time(), id_, DONE),
+        )
+
+    def fail(self, id_: str, worker: str, error: str = "", retry: bool = True):
+        self.connection.execute(
+            "UPDATE queue_items SET status = CASE WHEN ? AND attempts < ? THEN ? ELSE ? END, "
+            "worker = ?, lease_expires = NULL, error = ?, updated_at = ? "
+            "WHERE id = ? AND status = ? AND worker = ?",
+            (retry, self.max_attempts, PENDING, FAILED, worker, error, time.time(), id_, LEASED, worker),
+        )
+
+    def release(self, id_: str, worker: str):
+        self.connection.execute(
+            "UPDATE queue_items SET status = ?, worker = NULL, lease_expires = NULL, "
+            "attempts = attempts - 1, updated_at = ? WHERE id = ? AND status = ? AND worker = ?",
+            (PENDING, time.time(), id_, LEASED, worker),
+        )
+
+    def requeue_failed(self) -> int:
+        return self.connection.execute(
+            "UPDATE queue_items SET status = ?, attempts = 0, updated_at = ? WHERE status = ?",
+            (PENDING, time.time(), FAILED),
+        ).rowcount
+
+    def has_work(self) -> bool:
+        return (
+            self.connection.execute(
+                "SELECT 1 FROM queue_items WHERE status IN (?, ?) LIMIT 1", (PENDING, LEASED)
+            ).fetchone()
+            is not None
+        )
+
+    def status(self) -> Dict:
+        connection = self.connection
+        now = time.time()
+        counts = {status: 0 for status in (PENDING, LEASED, DONE, FAILED)}
+        counts.update(
+            connection.execute("SELECT status, COUNT(*) FROM queue_items GROUP BY status").fetchall()
+        )
+        expired = connection.execute(
+            "SELECT COUNT(*) FROM queue_items WHERE status = ? AND lease_expires < ?",
+            (LEASED, now),
+        ).fetchone()[0]
+
+        workers = {}
+        for worker, started_at, last_seen in connection.execute(
+            "SELECT worker, started_at, last_seen FROM queue_workers ORDER BY started_at"
+        ).fetchall():
+            workers[worker] = {
+                DONE: 0,
+                FAILED: 0,
+                LEASED: 0,
+                "started_at": started_at,
+                "last_seen": last_seen,
+                "alive": now - last_seen < self.lease_seconds,
+            }
+        for worker, status, count, last_update in connection.execute(
+            "SELECT worker, status, COUNT(*), MAX(updated_at) FROM queue_items "
+            "WHERE worker IS NOT NULL AND status IN (?, ?, ?) GROUP BY worker, status",
+            (DONE, FAILED, LEASED),
+        ).fetchall():
+            if worker in workers:
+                workers[worker][status] = count
+                if status == DONE:
+                    workers[worker]["last_done"] = last_update
+        for worker_status in workers.values():
+            end = worker_status.get("last_done", worker_status["started_at"])
+            hours = (end - worker_status["started_at"]) / 3600
+            worker_status["ids_per_hour"] = worker_status[DONE] / hours if hours > 0 else 0.0
+        return {"ids": counts, "expired_leases": expired, "workers": workers}
+
+
+"""Operations of a QueueStore served by QueueServer, POST /<operation> with the arguments as json"""
+QUEUE_OPERATIONS = (
+    "add",
+    "claim",
+    "heartbeat",
+    "complete",
+    "fail",
+    "release",
+    "requeue_failed",
+    "has_work",
+    "status",
+)
+
+
+class HttpQueueStore(QueueStore):
+    """
+    Client of a queue served by QueueServer, which workers on any number of hosts share.
+    The leases are kept by the store behind the server, their duration is the server's.
+
+    url: url of the QueueServer
+    token: shared secret of the server (env MT_WORK_QUEUE_TOKEN), if it has one
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token: Optional[str] = None,
+        connect_timeout: float = 10,
+        read_timeout: float = 60,
+        max_retries: int = 3,
+    ):
+        self.url = url.rstrip("/")
+        self.location = self.url
+        self.token = token
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self._local = threading.local()
+        self.lease_seconds = self._request("info")["lease_seconds"]
+
+    @property
+    def session(self) -> requests.Session:
+        """one session per thread, the LeaseKeeper heartbeats run next to the claims"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            if self.token:
+                session.headers["Authorization"] = f"Bearer {self.token}"
+            """only connection errors are retried, the request never reached the server"""
+            retry = Retry(
+                total=self.max_retries,
+                connect=self.max_retries,
+                read=0,
+                status=0,
+                backoff_factor=1,
+                allowed_methods=None,
+            )
+            session.mount("http://", HTTPAdapter(max_retries=retry))
+            session.mount("https://", HTTPAdapter(max_retries=retry))
+            self._local.session = session
+        return session
+
+    def _request(self, operation: str, **arguments) -> Any:
+        try:
+            response = self.session.post(
+                f"{self.url}/{operation}", json=arguments, timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            raise QueueStoreError(f"{operation} failed: {e}") from e
+        if response.status_code != 200:
+            raise QueueStoreError(
+                f"{operation} failed: {response.status_code}, {response.text}"
+            )
+        return response.json()["result"]
+
+    def add(self, ids: Iterable[str]) -> int:
+        return self._request("add", ids=list(ids))
+
+    def claim(self, worker: str, count: int = 1) -> List[str]:
+        return self._request("claim", worker=worker, count=count)
+
+    def heartbeat(self, worker: str) -> int:
+        return self._request("heartbeat", worker=worker)
+
+    def complete(self, id_: str, worker: str):
+        self._request("complete", id_=id_, worker=worker)
+
+    def fail(self, id_: str, worker: str, error: str = "", retry: bool = True):
+        self._request("fail", id_=id_, worker=worker, error=error, retry=retry)
+
+    def release(self, id_: str, worker: str):
+        self._request("release", id_=id_, worker=worker)
+
+    def requeue_failed(self) -> int:
+        return self._request("requeue_failed")
+
+    def has_work(self) -> bool:
+        return self._request("has_work")
+
+    def status(self) -> Dict:
+        return self._request("status")
+
+
+class _QueueRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        token = server.token  # type: ignore
+        if token and not hmac.compare_digest(
+            self.headers.get("Authorization", ""), f"Bearer {token}"
+        ):
+            self._send_json(401, {"error": "invalid token"})
+            return
+        operation = self.path.strip("/")
+        try:
+            arguments = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or "{}")
+            if operation == "info":
+                result = {"lease_seconds": server.store.lease_seconds}  # type: ignore
+            elif operation in QUEUE_OPERATIONS:
+                result = getattr(server.store, operation)(**arguments)  # type: ignore
+            else:
+                self._send_json(404, {"error": f"unknown operation {operation}"})
+                return
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200, {"result": result})
+
+    def _send_json(self, status: int, body: Dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _QueueHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    """every worker of every host polls the queue"""
+    request_queue_size = 128
+
+
+class QueueServer:
+    """
+    Serves a queue store over http to HttpQueueStore clients on other hosts. Every
+    request is one call of the store, so its leases and transactions apply as they are.
+    The requests are answered from one thread each, a SqliteQueueStore opens a
+    connection per thread.
+
+    token: shared secret the clients send as a bearer token, None to accept any client
+           (only on a trusted network)
+    """
+
+    def __init__(
+        self,
+        store: QueueStore,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        token: Optional[str] = None,
+    ):
+        self.server = _QueueHTTPServer((host, port), _QueueRequestHandler)
+        self.server.store = store  # type: ignore
+        self.server.token = token  # type: ignore
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self) -> "QueueServer":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "QueueServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def open_queue_store(
+    location: str,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    token: Optional[str] = None,
+) -> QueueStore:
+    """
+    The queue store at `location`: an http(s) url of a QueueServer, shared by many
+    hosts, or the path of a local sqlite file. `lease_seconds` only applies to a local
+    file, a served queue uses the leases of its server.
+    """
+    if str(location).startswith(("http://", "https://")):
+        return HttpQueueStore(str(location), token)
+    return SqliteQueueStore(Path(location), lease_seconds=lease_seconds)
+
+
+class LeaseKeeper:
+    """
+    Renews the leases of a worker from a background thread while the context is open,
+    every third of the lease so that a missed heartbeat doesn't lose the ids.
+    """
+
+    def __init__(self, queue: QueueStore, worker: str, interval: Optional[float] = None):
+        self.queue = queue
+        self.worker = worker
+        self.interval = interval or queue.lease_seconds / 3
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.queue.heartbeat(self.worker)
+            except (sqlite3.Error, QueueStoreError) as e:
+                """the next heartbeat may get through, the lease lasts three intervals"""
+                print(f"Heartbeat of {self.worker} failed: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+
+
+def format_status(status: Dict) -> str:
+    ids = status["ids"]
+    lines = [
+        f"{sum(ids.values())} ids: {ids[PENDING]} pending, {ids[LEASED]} leased "
+        f"({status['expired_leases']} expired), {ids[DONE]} done, {ids[FAILED]} failed",
+        f"{'worker':<32} {'done':>6} {'failed':>6} {'leased':>6} {'ids/h':>8}  state",
+    ]
+    for worker, worker_status in status["workers"].items():
+        lines.append(
+            f"{worker:<32} {worker_status[DONE]:>6} {worker_status[FAILED]:>6} "
+            f"{worker_status[LEASED]:>6} {worker_status['ids_per_hour']:>8.1f}  "
+            f"{'alive' if worker_status['alive'] else 'gone'}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from mt_aligner_prep_tool.config import WORK_QUEUE, WORK_QUEUE_LEASE_SECONDS, WORK_QUEUE_TOKEN
+
+    parser = argparse.ArgumentParser(description="Manage the queue of TM ids shared by pipeline workers")
+    parser.add_argument(
+        "--queue", type=str, default=WORK_QUEUE, help="Queue file or url of a queue server (env MT_WORK_QUEUE)"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    add_parser = commands.add_parser("add", help="Queue the ids of a file, one per line")
+    add_parser.add_argument("file_path", type=Path)
+    commands.add_parser("status", help="Show the ids per status and the throughput of every worker")
+    commands.add_parser("requeue_failed", help="Queue the failed ids again")
+    serve_parser = commands.add_parser("serve", help="Serve the queue file to the workers of other hosts")
+    serve_parser.add_argument("--host", type=str, default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    work_queue = open_queue_store(args.queue, WORK_QUEUE_LEASE_SECONDS, WORK_QUEUE_TOKEN)
+    if args.command == "serve":
+        if not isinstance(work_queue, SqliteQueueStore):
+            parser.error("serve needs a queue file")
+        server = QueueServer(work_queue, args.host, args.port, WORK_QUEUE_TOKEN)
+        print(f"Serving {args.queue} on {server.url}")
+        server.serve_forever()
+    elif args.command == "add":
+        added = work_queue.add(get_file_content_by_lines(args.file_path))
+        print(f"{added} ids added to {work_queue.location}")
+    elif args.command == "requeue_failed":
+        print(f"{work_queue.requeue_failed()} failed ids queued again")
+    else:
+        print(format_status(work_queue.status()))
@@ -0,0 +1,307 @@
+"""
+Bounded working folder: the clones and tokenized files of every id are tracked with
+their size and last use, and the least recently used ones are removed when they and
+the tokenization cache grow over a size cap.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from mt_aligner_prep_tool.checkpoint import SqliteStore, chunked
+from mt_aligner_prep_tool.tokenization_cache import TokenizationCache
+from mt_aligner_prep_tool.utility import format_size, get_folder_size, parse_size
+
+CLONE = "clone"
+TOKENIZED = "tokenized"
+
+"""Prefixes of the clone folders (BO0001, EN0001, TM0001) and tokenized files (tokenized_BO0001.txt)"""
+CLONE_PREFIXES = ("BO", "EN", "TM")
+TOKENIZED_PREFIXES = ("tokenized_BO", "tokenized_EN")
+
+
+def get_path_size(path: Path) -> int:
+    if path.is_dir():
+        return get_folder_size(path)
+    return path.stat().st_size if path.exists() else 0
+
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Workspace(SqliteStore):
+    """
+    Size and last use of the clones and tokenized files of every id, stored in sqlite.
+
+    Files are pinned by the processes working on them, pins of processes which are
+    gone are ignored. Pinned files are never evicted. Pins are kept per path, so the TM
+    clone of an id being merged and its BO/EN clones in the pipeline don't share pins.
+    Tokenized files are only evicted when `evict_tokenized` is set and they are
+    uploaded, a re-alignment then gets them back from the tokenization cache or
+    tokenizes the id again.
+
+    max_size: size cap in bytes of the tracked files and of the tokenization cache, None
+              for no cap. The cache evicts its own entries, only the tracked files are
+              evicted here to make room for it.
+    clone_dirs: folders holding the clone folders of the ids
+    tokenized_dir: folder holding the tokenized files of the ids
+    tokenization_cache: cache whose size counts against max_size
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        clone_dirs: Iterable[Path],
+        tokenized_dir: Path,
+        max_size: Optional[int] = None,
+        evict_tokenized: bool = False,
+        tokenization_cache: Optional[TokenizationCache] = None,
+    ):
+        super().__init__(db_path)
+        self.clone_dirs = [Path(folder) for folder in clone_dirs]
+        self.tokenized_dir = Path(tokenized_dir)
+        self.max_size = max_size
+        self.evict_tokenized = evict_tokenized
+        self.tokenization_cache = tokenization_cache
+
+    def create_tables(self, connection: sqlite3.Connection):
+        connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                path TEXT PRIMARY KEY,
+                id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                uploaded INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+            CREATE TABLE IF NOT EXISTS path_pins (
+                path TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                PRIMARY KEY (path, pid)
+            );
+            """
+        )
+
+    def record(self, id_: str, kind: str, paths: Iterable[Path]):
+        """Record the current size of the files of an id and use them now."""
+        now = time.time()
+        self.connection.executemany(
+            "INSERT INTO entries (path, id, kind, size, last_used) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (path) DO UPDATE SET size = excluded.size, "
+            "last_used = excluded.last_used, uploaded = 0",
+            [(str(path), id_, kind, get_path_size(Path(path)), now) for path in paths],
+        )
+
+    def touch(self, paths: Iterable[Path]):
+        """Use the files now, without measuring them again."""
+        now = time.time()
+        self.connection.executemany(
+            "UPDATE entries SET last_used = ? WHERE path = ?",
+            [(now, str(path)) for path in paths],
+        )
+
+    def mark_uploaded(self, id_: str):
+        """The tokenized files of an id are in s3, they can be evicted."""
+        self.connection.execute(
+            "UPDATE entries SET uploaded = 1 WHERE id = ? AND kind = ?", (id_, TOKENIZED)
+        )
+
+    def pin(self, paths: Iterable[Path]):
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO path_pins (path, pid) VALUES (?, ?)",
+            [(str(path), os.getpid()) for path in paths],
+        )
+
+    def unpin(self, paths: Iterable[Path]):
+        self.connection.executemany(
+            "DELETE FROM path_pins WHERE path = ? AND pid = ?",
+            [(str(path), os.getpid()) for path in paths],
+        )
+
+    @contextmanager
+    def pinned(self, paths: Iterable[Path]) -> Iterator[None]:
+        paths = list(paths)
+        self.pin(paths)
+        try:
+            yield
+        finally:
+            self.unpin(paths)
+
+    def get_pinned_paths(self) -> Set[str]:
+        """Paths pinned by running processes, the pins of processes which are gone are dropped."""
+        pinned_paths = set()
+        for path, pid in self.connection.execute("SELECT path, pid FROM path_pins").fetchall():
+            if is_process_alive(pid):
+                pinned_paths.add(path)
+            else:
+                self.connection.execute("DELETE FROM path_pins WHERE pid = ?", (pid,))
+        return pinned_paths
+
+    def _find_paths(self) -> Dict[Path, tuple]:
+        """Clone folders and tokenized files on disk, with their id and kind"""
+        paths = {}
+        for clone_dir in self.clone_dirs:
+            if clone_dir.is_dir():
+                for path in clone_dir.iterdir():
+                    if path.is_dir() and path.name.startswith(CLONE_PREFIXES):
+                        paths[path] = (path.name[2:], CLONE)
+        if self.tokenized_dir.is_dir():
+            for path in self.tokenized_dir.glob("tokenized_*.txt"):
+                if path.name.startswith(TOKENIZED_PREFIXES):
+                    paths[path] = (path.stem[len("tokenized_BO") :], TOKENIZED)
+        return paths
+
+    def scan(self) -> int:
+        """
+        Track the files on disk which aren't tracked yet, e.g. left by older versions,
+        with their modification time as last use, and forget the ones which are gone.
+
+        :return: Number of entries added.
+        """
+        paths = self._find_paths()
+        tracked = {
+            Path(path) for (path,) in self.connection.execute("SELECT path FROM entries").fetchall()
+        }
+        gone = [str(path) for path in tracked - set(paths)]
+        for paths_chunk in chunked(gone):
+            placeholders = ",".join("?" * len(paths_chunk))
+            self.connection.execute(f"DELETE FROM entries WHERE path IN ({placeholders})", paths_chunk)
+        new_rows = [
+            (str(path), id_, kind, get_path_size(path), path.stat().st_mtime)
+            for path, (id_, kind) in paths.items()
+            if path not in tracked
+        ]
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO entries (path, id, kind, size, last_used) VALUES (?, ?, ?, ?, ?)",
+            new_rows,
+        )
+        return len(new_rows)
+
+    def get_cache_size(self) -> int:
+        if self.tokenization_cache is None:
+            return 0
+        return self.tokenization_cache.stats()["size"]
+
+    def total_size(self) -> int:
+        """Size of the tracked files and of the tokenization cache"""
+        tracked_size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+        return tracked_size + self.get_cache_size()
+
+    def evict(self, max_size: Optional[int] = None) -> List[Dict]:
+        """
+        Remove least recently used clones, and uploaded tokenized files with
+        evict_tokenized, until the tracked files and the tokenization cache fit in
+        max_size (default: the cap of the workspace). Pinned files are kept even if the
+        cap can't be met.
+
+        :return: The evicted entries, as {"path", "id", "kind", "size"}.
+        """
+        max_size = self.max_size if max_size is None else max_size
+        if max_size is None:
+            return []
+        total_size = self.total_size()
+        if total_size <= max_size:
+            return []
+
+        pinned_paths = self.get_pinned_paths()
+        evicted = []
+        for path, id_, kind, size, uploaded in self.connection.execute(
+            "SELECT path, id, kind, size, uploaded FROM entries ORDER BY last_used"
+        ).fetchall():
+            if total_size <= max_size:
+                break
+            if path in pinned_paths:
+                continue
+            if kind == TOKENIZED and not (self.evict_tokenized and uploaded):
+                continue
+            if Path(path).is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                Path(path).unlink(missing_ok=True)
+            self.connection.execute("DELETE FROM entries WHERE path = ?", (path,))
+            total_size -= size
+            evicted.append({"path": path, "id": id_, "kind": kind, "size": size})
+        return evicted
+
+    def report(self) -> List[Dict]:
+        """Tracked entries, largest first, with whether they are pinned."""
+        pinned_paths = self.get_pinned_paths()
+        return [
+            {
+                "path": path,
+                "id": id_,
+                "kind": kind,
+                "size": size,
+                "last_used": last_used,
+                "uploaded": bool(uploaded),
+                "pinned": path in pinned_paths,
+            }
+            for path, id_, kind, size, last_used, uploaded in self.connection.execute(
+                "SELECT path, id, kind, size, last_used, uploaded FROM entries ORDER BY size DESC"
+            ).fetchall()
+        ]
+
+
+def format_report(
+    entries: List[Dict],
+    max_size: Optional[int],
+    top: Optional[int] = None,
+    cache_size: int = 0,
+) -> str:
+    """du-style listing of the entries, with the totals per kind and the tokenization cache"""
+    lines = []
+    for entry in entries[:top]:
+        flags = ("pinned " if entry["pinned"] else "") + ("uploaded" if entry["uploaded"] else "")
+        last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["last_used"]))
+        lines.append(f"{format_size(entry['size']):>9}  {last_used}  {entry['path']}  {flags}".rstrip())
+    for kind in (CLONE, TOKENIZED):
+        kind_entries = [entry for entry in entries if entry["kind"] == kind]
+        size = sum(entry["size"] for entry in kind_entries)
+        lines.append(f"{format_size(size):>9}  total of {len(kind_entries)} {kind} entries")
+    lines.append(f"{format_size(cache_size):>9}  tokenization cache")
+    total = sum(entry["size"] for entry in entries) + cache_size
+    cap = f" of {format_size(max_size)} cap" if max_size is not None else ", no cap"
+    lines.append(f"{format_size(total):>9}  total{cap}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from mt_aligner_prep_tool.config import get_workspace
+
+    parser = argparse.ArgumentParser(description="Size of the working folder and eviction of the least recently used files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    du_parser = commands.add_parser("du", help="Show the size and last use of the clones and tokenized files")
+    du_parser.add_argument("--top", type=int, default=None, help="Show only the largest entries")
+    evict_parser = commands.add_parser("evict", help="Evict least recently used files down to the cap")
+    evict_parser.add_argument("--max_size", type=str, help="Cap, e.g. 50GB (default env MT_WORKSPACE_MAX_SIZE)")
+    evict_parser.add_argument("--evict_tokenized", action="store_true", help="Evict uploaded tokenized files too")
+    args = parser.parse_args()
+
+    workspace = get_workspace()
+    workspace.scan()
+    if args.command == "du":
+        print(
+            format_report(
+                workspace.report(), workspace.max_size, args.top, workspace.get_cache_size()
+            )
+        )
+    else:
+        workspace.evict_tokenized = workspace.evict_tokenized or args.evict_tokenized
+        evicted = workspace.evict(parse_size(args.max_size) if args.max_size else None)
+        freed = sum(entry["size"] for entry in evicted)
+        print(f"Evicted {len(evicted)} entries, {format_size(freed)} freed")
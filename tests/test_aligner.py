@@ -0,0 +1,116 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from mt_aligner_prep_tool.aligner import AdaptiveLimiter, AlignerClient, AlignerError
+from mt_aligner_prep_tool.standins import AlignerStubServer
+
+
+class AlignerStubHandler(BaseHTTPRequestHandler):
+    """Fails the first `failures` requests of a text id with `failure_status`."""
+
+    failures = 2
+    failure_status = 503
+    requests_count = {}
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        text_id = body["inputs"]["text_id"]
+        count = self.requests_count.get(text_id, 0)
+        self.requests_count[text_id] = count + 1
+        if count < self.failures:
+            self.send_response(self.failure_status)
+            self.end_headers()
+            return
+        response = json.dumps({"text_id": text_id}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def aligner_stub():
+    AlignerStubHandler.requests_count = {}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), AlignerStubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+
+
+def test_align_retries_server_errors(aligner_stub):
+    client = AlignerClient(aligner_stub, "token", max_in_flight=4, backoff_base=0.01)
+
+    async def align_all():
+        return await asyncio.gather(
+            *[client.align(str(id_), "bo_url", "en_url", None) for id_ in range(8)]
+        )
+
+    responses = asyncio.run(align_all())
+    client.close()
+    assert [response["text_id"] for response in responses] == [str(i) for i in range(8)]
+    assert all(count == 3 for count in AlignerStubHandler.requests_count.values())
+
+
+def test_align_gives_up_after_max_retries(aligner_stub):
+    client = AlignerClient(aligner_stub, "token", max_retries=1, backoff_base=0.01)
+    stats = {}
+    with pytest.raises(AlignerError):
+        asyncio.run(client.align("0001", "bo_url", "en_url", None, stats))
+    client.close()
+    assert AlignerStubHandler.requests_count["0001"] == 2
+    assert stats == {"retries": 1}
+
+
+def test_adaptive_limiter_increases_and_backs_off():
+    limiter = AdaptiveLimiter(initial_limit=4, max_limit=6)
+
+    async def run():
+        epochs = [await limiter.acquire() for _ in range(4)]
+        assert limiter.in_flight == 4
+        for epoch in epochs:
+            await limiter.release(epoch, overloaded=False)
+        assert limiter.limit == 5
+
+        """a burst of 429s from requests sent at the same limit halves it once"""
+        epochs = [await limiter.acquire() for _ in range(5)]
+        for epoch in epochs:
+            await limiter.release(epoch, overloaded=True)
+        assert limiter.limit == 2
+
+        """never above the ceiling"""
+        for _ in range(100):
+            await limiter.release(await limiter.acquire(), overloaded=False)
+        assert limiter.limit == 6
+
+        """slow responses count as overloads"""
+        limiter.latency_threshold = 1
+        await limiter.release(await limiter.acquire(), overloaded=False, latency=2)
+        assert limiter.limit == 3
+        assert limiter.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_align_lowers_limit_on_throttling():
+    with AlignerStubServer(max_concurrent=2, retry_after=0.01, latency=0.05) as stub:
+        client = AlignerClient(stub.url, "token", max_in_flight=8, backoff_base=0.01)
+
+        async def align_all():
+            return await asyncio.gather(
+                *[client.align(str(id_), "bo_url", "en_url", None) for id_ in range(16)]
+            )
+
+        responses = asyncio.run(align_all())
+        client.close()
+    assert len(responses) == 16
+    assert stub.status_counts[429] > 0
+    assert client.limiter.limit < 8
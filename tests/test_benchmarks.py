@@ -0,0 +1,39 @@
+from benchmarks.run import compare_to_baseline, main, run_benchmarks
+
+
+def test_run_benchmarks(tmp_path):
+    results = run_benchmarks(
+        ["4KB"],
+        tmp_path,
+        select=["bo_sent_tokenizer", "split_text", "checkpoint", "upload", "align"],
+        repeat=1,
+        num_checkpoint_ids=10,
+        upload_workers=[2],
+        aligner_concurrency=[2],
+        num_service_items=4,
+        service_latency=0,
+    )
+    assert set(results) == {
+        "bo_sent_tokenizer/4KB",
+        "split_text_into_mb_chunks/4KB",
+        "checkpoint_save/10_ids",
+        "checkpoint_load/10_ids",
+        "upload/workers=2",
+        "upload_gzip/workers=2",
+        "align/concurrency=2",
+    }
+    assert results["bo_sent_tokenizer/4KB"]["sentences"] > 0
+    assert results["upload/workers=2"]["files"] == 4
+    assert results["align/concurrency=2"]["requests"] == 4
+    assert all(result["peak_memory_mb"] is not None for result in results.values())
+
+
+def test_compare_to_baseline():
+    baseline = {"a": {"throughput": 10.0}, "b": {"throughput": 10.0}}
+    results = {"a": {"throughput": 8.5}, "b": {"throughput": 7.0}, "c": {"throughput": 1.0}}
+    regressions = compare_to_baseline(results, baseline, threshold=0.2)
+    assert len(regressions) == 1 and regressions[0].startswith("b:")
+
+
+def test_missing_baseline_fails(tmp_path):
+    assert main(["--baseline", str(tmp_path / "baseline.json")]) == 1
@@ -0,0 +1,103 @@
+import json
+from multiprocessing import Pool
+
+from mt_aligner_prep_tool.checkpoint import CheckpointStore
+from mt_aligner_prep_tool.config import (
+    is_id_already_aligned,
+    is_id_already_realigned,
+    is_id_already_tokenized,
+)
+
+
+def test_save_and_load_checkpoint(tmp_path):
+    store = CheckpointStore(tmp_path / "checkpoint.sqlite")
+    store.save("0001", "Tokenization")
+    store.save("0001", "Alignment")
+    store.save("0001", "re_alignment", "v2")
+    store.save("0002", "Tokenization")
+
+    checkpoints = store.load(["0001", "0002", "0003"])
+    assert is_id_already_aligned("0001", checkpoints)
+    assert is_id_already_realigned("0001", "v2", checkpoints)
+    assert is_id_already_tokenized("0002", checkpoints)
+    assert not is_id_already_aligned("0002", checkpoints)
+    assert "0003" not in checkpoints
+
+
+def test_import_json_checkpoint(tmp_path):
+    json_file = tmp_path / "checkpoint.json"
+    json_file.write_text(
+        json.dumps(
+            {
+                "0001": {
+                    "Tokenization": True,
+                    "Alignment": True,
+                    "re_alignment_versions": ["v2"],
+                }
+            }
+        )
+    )
+    store = CheckpointStore(tmp_path / "checkpoint.sqlite", legacy_json_file=json_file)
+    assert store.load() == {
+        "0001": {
+            "Tokenization": True,
+            "Alignment": True,
+            "re_alignment_versions": ["v2"],
+        }
+    }
+
+    """the json file is only imported once"""
+    json_file.write_text(json.dumps({"0002": {"Tokenization": True}}))
+    store = CheckpointStore(tmp_path / "checkpoint.sqlite", legacy_json_file=json_file)
+    assert "0002" not in store.load()
+
+
+def test_corrupted_json_checkpoint_is_moved_aside(tmp_path):
+    json_file = tmp_path / "checkpoint.json"
+    json_file.write_text('{"0001": {"Tokeniz')
+    store = CheckpointStore(tmp_path / "checkpoint.sqlite", legacy_json_file=json_file)
+    store.save("0002", "Alignment")
+    assert list(store.load()) == ["0002"]
+    assert not json_file.exists()
+    assert len(list(tmp_path.glob("checkpoint.json.corrupted-*"))) == 1
+
+
+def save_checkpoints(args):
+    db_path, worker = args
+    store = CheckpointStore(db_path)
+    for i in range(50):
+        store.save(f"{worker}-{i}", "Alignment")
+
+
+def test_concurrent_writers(tmp_path):
+    db_path = tmp_path / "checkpoint.sqlite"
+    with Pool(processes=4) as pool:
+        pool.map(save_checkpoints, [(db_path, worker) for worker in range(4)])
+    assert len(CheckpointStore(db_path).load()) == 200
+
+
+def test_last_alignment_inputs(tmp_path):
+    store = CheckpointStore(tmp_path / "checkpoint.sqlite")
+    store.save_alignment_inputs("0001", None, "bo1", "en1", None)
+    store.save_alignment_inputs("0002", None, "bo2", "en2", None)
+    """0002 unchanged for v2, its first alignment is copied forward"""
+    store.save_alignment_inputs("0001", "v2", "bo1b", "en1", "v2")
+    store.save_alignment_inputs("0002", "v2", "bo2", "en2", None)
+
+    last_inputs = store.load_last_alignment_inputs(["0001", "0002", "0003"])
+    assert last_inputs == {
+        "0001": {"version": "v2", "bo_hash": "bo1b", "en_hash": "en1", "aligned_version": "v2"},
+        "0002": {"version": "v2", "bo_hash": "bo2", "en_hash": "en2", "aligned_version": None},
+    }
+
+
+def test_tokenizer_versions(tmp_path):
+    store = CheckpointStore(tmp_path / "checkpoint.sqlite")
+    store.save_tokenizer_version("0001", "bo-1;en-1")
+    store.save_tokenizer_version("0002", "bo-1;en-1")
+    """re-tokenized with a newer tokenizer, only the last version counts"""
+    store.save_tokenizer_version("0001", "bo-2;en-1")
+    assert store.load_tokenizer_versions(["0001", "0002", "0003"]) == {
+        "0001": "bo-2;en-1",
+        "0002": "bo-1;en-1",
+    }
@@ -0,0 +1,105 @@
+import socket
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import List, Optional
+
+import pytest
+
+from mt_aligner_prep_tool import download
+from mt_aligner_prep_tool.download import fetch_txt_files, find_first_txt_file
+
+
+def git(*args, cwd):
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@test", *args],
+        check=True,
+        cwd=cwd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def test_fetch_txt_files(tmp_path):
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    git("init", cwd=remote)
+    (remote / "BO0001.txt").write_text("first version")
+    (remote / "image.bin").write_bytes(b"\0" * 1024)
+    git("add", ".", cwd=remote)
+    git("commit", "-m", "first", cwd=remote)
+
+    clone = tmp_path / "clone"
+    assert fetch_txt_files(f"file://{remote}", clone) > 0
+    assert find_first_txt_file(clone).read_text() == "first version"
+    assert not (clone / "image.bin").exists()
+
+    """an existing clone is updated in place"""
+    (remote / "BO0001.txt").write_text("second version")
+    git("commit", "-am", "second", cwd=remote)
+    (clone / "marker").touch()
+    fetch_txt_files(f"file://{remote}", clone)
+    assert find_first_txt_file(clone).read_text() == "second version"
+    assert (clone / "marker").exists()
+
+
+class FlakyFileHandler(BaseHTTPRequestHandler):
+    """Serves `content` with Range support, the first response stops halfway through"""
+
+    content = b""
+    ranges: List[Optional[str]] = []
+
+    def do_GET(self):
+        requested_range = self.headers.get("Range")
+        self.ranges.append(requested_range)
+        start = int(requested_range[len("bytes=") : -1]) if requested_range else 0
+        body = self.content[start:]
+        self.send_response(206 if requested_range else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if len(self.ranges) == 1:
+            self.wfile.write(body[: len(body) // 2])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+        else:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_download_resumes_and_checks_sha(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "PARTIAL_DOWNLOADS_PATH", tmp_path / "partial")
+    monkeypatch.setattr(download.time, "sleep", lambda seconds: None)
+    content = "ཁྱོད་འཆི་དུས་སུ་ངུ་སྲིད།\n".encode() * 10000
+    content_file = tmp_path / "content.txt"
+    content_file.write_bytes(content)
+    FlakyFileHandler.content = content
+    FlakyFileHandler.ranges = []
+    server = HTTPServer(("127.0.0.1", 0), FlakyFileHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/BO0001.txt"
+    try:
+        download.download_file_with_url(
+            url,
+            "BO0001.txt",
+            tmp_path / "BO0001",
+            expected_size=len(content),
+            expected_sha=download.get_git_blob_sha(content_file),
+        )
+        assert (tmp_path / "BO0001" / "BO0001.txt").read_bytes() == content
+        """the second request asked for the bytes after the ones already received"""
+        assert FlakyFileHandler.ranges[0] is None
+        resumed_at = int(FlakyFileHandler.ranges[1][len("bytes=") : -1])
+        assert 0 < resumed_at <= len(content) // 2
+        assert list((tmp_path / "partial").iterdir()) == []
+
+        FlakyFileHandler.ranges = [None]
+        with pytest.raises(download.Error):
+            download.download_file_with_url(
+                url, "BO0002.txt", tmp_path / "BO0002", expected_sha="0" * 40
+            )
+        assert not (tmp_path / "BO0002" / "BO0002.txt").exists()
+        assert list((tmp_path / "partial").iterdir()) == []
+    finally:
+        server.shutdown()
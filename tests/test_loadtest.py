@@ -0,0 +1,20 @@
+from mt_aligner_prep_tool.loadtest import run_load_test
+
+
+def test_load_test_runs_pipeline_against_standins(tmp_path):
+    results = run_load_test(
+        tmp_path,
+        num_ids=3,
+        file_size=2048,
+        concurrency_levels=[2],
+        latency=0,
+        throttle_rate=0.5,
+        retry_after=0,
+        s3_latency=0,
+        tokenize_processes=1,
+    )
+    [result] = results
+    assert result["aligned"] == 3 and result["failed"] == 0
+    """throttled requests are retried until they go through"""
+    assert result["retries"] == result["aligner_responses"].get("429", 0) > 0
+    assert result["aligner_responses"]["200"] == 3
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import sys
+
+from mt_aligner_prep_tool import merge_branch
+from mt_aligner_prep_tool.merge_branch import merge_multiple_branches_to_main
+
+
+def git(*args, cwd):
+    return subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@test", *args],
+        check=True,
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    ).stdout
+
+
+def make_remote(tmp_path, repo_name, conflict):
+    """Remote with a `fix` branch changing the file which main also changes if `conflict`."""
+    work = tmp_path / "work" / repo_name
+    work.mkdir(parents=True)
+    git("init", "-b", "main", cwd=work)
+    (work / "BO.txt").write_text("base")
+    git("add", ".", cwd=work)
+    git("commit", "-m", "base", cwd=work)
+    git("checkout", "-b", "fix", cwd=work)
+    (work / "BO.txt").write_text("fixed")
+    git("commit", "-am", "fix", cwd=work)
+    git("checkout", "main", cwd=work)
+    if conflict:
+        (work / "BO.txt").write_text("changed on main")
+        git("commit", "-am", "main", cwd=work)
+    remote = tmp_path / "remotes" / "MonlamAI" / f"{repo_name}.git"
+    git("clone", "--bare", str(work), str(remote), cwd=tmp_path)
+    return remote
+
+
+def test_merge_multiple_branches_to_main(tmp_path, monkeypatch):
+    monkeypatch.setattr(merge_branch, "BASE_PATH", tmp_path)
+    for name in ("GIT_AUTHOR", "GIT_COMMITTER"):
+        monkeypatch.setenv(f"{name}_NAME", "test")
+        monkeypatch.setenv(f"{name}_EMAIL", "test@test")
+    remotes = {
+        "0001": make_remote(tmp_path, "TM0001", conflict=False),
+        "0002": make_remote(tmp_path, "TM0002", conflict=True),
+    }
+    ids_file = tmp_path / "ids.txt"
+    ids_file.write_text("0001\n0002\n0003\n")
+
+    results = merge_multiple_branches_to_main(
+        ids_file,
+        "fix",
+        base_url=f"file://{tmp_path}/remotes/",
+        work_dir=tmp_path / "clones",
+    )
+
+    outcomes = {result.repo: result.outcome for result in results}
+    assert outcomes == {
+        "TM0001": "merged",
+        "TM0002": "merged_with_conflicts",
+        "TM0003": "failed",
+    }
+    for remote in remotes.values():
+        assert git("show", "main:BO.txt", cwd=remote) == "fixed"
+    """only the merged repos are checkpointed, each of them once"""
+    assert sorted((tmp_path / "fix.txt").read_text().splitlines()) == ["0001", "0002"]
+    assert len((tmp_path / "fix_merge_report.jsonl").read_text().splitlines()) == 3
+
+
+def test_import_leaves_logging_alone(tmp_path):
+    """no errors.log in the folder of a caller which only imports the module"""
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import logging, mt_aligner_prep_tool.merge_branch; assert not logging.getLogger().handlers",
+        ],
+        check=True,
+        cwd=tmp_path,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path), "HOME": str(tmp_path)},
+    )
+    assert not (tmp_path / "errors.log").exists()
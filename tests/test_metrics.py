@@ -0,0 +1,27 @@
+import json
+
+import pytest
+
+from mt_aligner_prep_tool.metrics import MetricsCollector
+
+
+def test_metrics_collector_records_and_exports(tmp_path):
+    metrics = MetricsCollector(buckets=(1, 10))
+    with metrics.stage("0001", "tokenize") as record:
+        record["bytes_in"] = 100
+        record["sentences"] = 3
+    with pytest.raises(ValueError):
+        with metrics.stage("0002", "tokenize") as record:
+            raise ValueError("broken file")
+
+    trace_file = metrics.export(tmp_path, run_name="test")
+    records = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert [(r["id"], r["outcome"]) for r in records] == [("0001", "ok"), ("0002", "error")]
+    assert records[1]["error"] == "broken file"
+
+    textfile = (tmp_path / "mt_aligner.prom").read_text()
+    assert 'mt_aligner_stage_duration_seconds_bucket{stage="tokenize",le="1"} 2' in textfile
+    assert 'mt_aligner_stage_duration_seconds_count{stage="tokenize"} 2' in textfile
+    assert 'mt_aligner_stage_bytes_in_total{stage="tokenize"} 100' in textfile
+    assert 'mt_aligner_stage_items_total{stage="tokenize",outcome="error"} 1' in textfile
+    assert "tokenize" in metrics.summary()
@@ -0,0 +1,76 @@
+import random
+import re
+
+import pytest
+
+from mt_aligner_prep_tool.normalizer import EMOJIS_TO_REMOVE, Normalizer
+
+
+def preprocess_chain(text):
+    for emoji in EMOJIS_TO_REMOVE:
+        text = text.replace(emoji, "")
+    for pattern in [r"\r\n", r"\n", r"\s{2,}", r"\t"]:
+        text = re.sub(pattern, " ", text)
+    return text
+
+
+def test_same_output_as_chain():
+    normalizer = Normalizer(collapse_whitespace=True, fold_newlines=True)
+    texts = [
+        "",
+        "a\r\nb\nc\td  e",
+        "a\rb\xa0c\x0bd",
+        " a \n",
+        "a 1️⃣ b",
+        "a\n2️⃣\tb",
+        "21️⃣️⃣",
+        "1️⃣",
+    ]
+    alphabet = ["a", " ", "\n", "\r", "\t", "\xa0", "1️⃣", "3️⃣", "1", "️", "⃣"]
+    rng = random.Random(0)
+    texts += ["".join(rng.choices(alphabet, k=rng.randint(1, 12))) for _ in range(2000)]
+    for text in texts:
+        assert normalizer.normalize(text) == preprocess_chain(text), repr(text)
+
+        pieces = []
+        while len("".join(pieces)) < len(text):
+            start = len("".join(pieces))
+            pieces.append(text[start : start + rng.randint(1, 3)])
+        assert "".join(normalizer.normalize_stream(pieces)) == preprocess_chain(text), pieces
+
+
+def test_rules():
+    assert Normalizer().normalize("a  1️⃣\n") == "a  \n"
+    assert Normalizer(remove_emojis=False, fold_newlines=True).normalize("a\r\nb\n\nc") == "a b  c"
+    """without fold_newlines the line breaks are kept, runs around them are collapsed"""
+    assert Normalizer(collapse_whitespace=True).normalize("a\nb\n\tc") == "a\nb\n c"
+    assert Normalizer(collapse_whitespace=True).normalize("a \t\n\n  b\r\n") == "a \n\n b\r\n"
+
+    nfc = Normalizer(unicode_form="NFC")
+    assert nfc.normalize("café") == "café"
+    assert "".join(nfc.normalize_stream(["cafe", "́ ", "e", "́"])) == "café é"
+
+
+def test_versions():
+    versions = {
+        Normalizer().version,
+        Normalizer(collapse_whitespace=True).version,
+        Normalizer(collapse_whitespace=True, fold_newlines=True).version,
+        Normalizer(unicode_form="NFC").version,
+        Normalizer(remove_emojis=False).version,
+    }
+    assert len(versions) == 5
+    assert Normalizer().version == Normalizer().version
+
+
+def test_normalize_bytes():
+    assert Normalizer().normalize_bytes("a1️⃣b".encode()) == b"ab"
+    with pytest.raises(ValueError):
+        Normalizer(collapse_whitespace=True).normalize_bytes(b"a  b")
+
+
+def test_stream_flushes_without_safe_boundary():
+    nfc = Normalizer(unicode_form="NFC")
+    chunks = list(nfc.normalize_stream(["x" * 10] * 10, max_pending=25))
+    assert "".join(chunks) == "x" * 100
+    assert max(len(chunk) for chunk in chunks) <= 30
@@ -0,0 +1,97 @@
+import pytest
+
+from mt_aligner_prep_tool import pipeline
+from mt_aligner_prep_tool.pipeline import (
+    AlignmentTask,
+    claim_tasks,
+    create_tasks,
+    schedule_tasks,
+)
+from mt_aligner_prep_tool.workqueue import SqliteQueueStore
+
+
+def make_task(tmp_path, id_, size=None):
+    task = AlignmentTask(
+        id_=id_,
+        alignment_version=None,
+        tokenize=True,
+        tokenized_bo_file_path=tmp_path / f"tokenized_BO{id_}.txt",
+        tokenized_en_file_path=tmp_path / f"tokenized_EN{id_}.txt",
+    )
+    if size is not None:
+        task.tokenized_bo_file_path.write_text("b" * size)
+        task.tokenized_en_file_path.write_text("e" * size)
+    return task
+
+
+def test_schedule_tasks_largest_first(tmp_path):
+    tasks = [
+        make_task(tmp_path, "test-unknown-1"),
+        make_task(tmp_path, "test-small", 10),
+        make_task(tmp_path, "test-large", 1000),
+        make_task(tmp_path, "test-unknown-2"),
+        make_task(tmp_path, "test-medium", 100),
+    ]
+    scheduled = schedule_tasks(tasks)
+    assert [task.id_ for task in scheduled] == [
+        "test-large",
+        "test-medium",
+        "test-small",
+        "test-unknown-1",
+        "test-unknown-2",
+    ]
+    """ids with nothing on disk get the average size"""
+    assert [task.size for task in scheduled] == [2000, 200, 20, 740, 740]
+
+
+def test_claim_tasks_fails_ids_whose_task_errored(tmp_path, monkeypatch):
+    def is_id_already_aligned(id_, id_checkpoints):
+        if id_ == "0002":
+            raise ValueError("corrupted checkpoint")
+        return id_ == "0003"
+
+    monkeypatch.setattr(pipeline, "load_checkpoint", lambda ids: {})
+    monkeypatch.setattr(pipeline, "is_id_already_aligned", is_id_already_aligned)
+    monkeypatch.setattr(pipeline, "log_error_with_id", lambda id_: None)
+    queue = SqliteQueueStore(tmp_path / "queue.sqlite")
+    queue.add(["0001", "0002", "0003"])
+
+    tasks = claim_tasks(queue, "worker", 10, False, None, True, None, {"tasks": 0})
+    assert next(tasks).id_ == "0001"
+    """the already aligned id is done, the one which errored is queued again"""
+    assert queue.status()["ids"] == {"pending": 1, "leased": 1, "done": 1, "failed": 0}
+
+
+def test_tokenized_ids_skip_tokenization(tmp_path, monkeypatch):
+    checkpoints = {
+        id_: {"Tokenization": True, "Alignment": False, "re_alignment_versions": []}
+        for id_ in ("0001", "0002")
+    }
+    checkpoints["0004"] = checkpoints["0001"]
+    tokenizer_versions = {"0001": "current", "0002": "current", "0004": "older"}
+    monkeypatch.setattr(pipeline, "load_checkpoint", lambda ids: checkpoints)
+    monkeypatch.setattr(pipeline, "load_tokenizer_versions", lambda ids: tokenizer_versions)
+    monkeypatch.setattr(pipeline, "get_tokenizers_version", lambda: "current")
+    monkeypatch.setattr(pipeline, "TOKENIZED_FILES_PATH", tmp_path)
+    for name in ("tokenized_BO0001.txt", "tokenized_EN0001.txt", "tokenized_BO0002.txt"):
+        (tmp_path / name).write_text("text")
+    for name in ("tokenized_BO0004.txt", "tokenized_EN0004.txt"):
+        (tmp_path / name).write_text("text")
+
+    tasks, errors = create_tasks(["0001", "0002", "0003", "0004"], False, None)
+    """0002 lost its english file, 0003 was never tokenized, 0004 by an older tokenizer"""
+    assert {task.id_: task.tokenize for task in tasks} == {
+        "0001": False,
+        "0002": True,
+        "0003": True,
+        "0004": True,
+    }
+    assert errors == {}
+
+    tasks, _ = create_tasks(["0001"], False, None, refresh_tokenized=True)
+    assert tasks[0].tokenize
+
+
+def test_pipeline_needs_a_file_or_a_queue():
+    with pytest.raises(ValueError):
+        pipeline.pipeline(None)
@@ -0,0 +1,51 @@
+import time
+
+from mt_aligner_prep_tool import config, upload
+from mt_aligner_prep_tool.presigned_url_cache import PresignedUrlCache
+from mt_aligner_prep_tool.standins import FilesystemS3Client
+from mt_aligner_prep_tool.upload import (
+    S3TransferManager,
+    create_s3_file_url,
+    set_transfer_manager,
+    upload_file_to_s3,
+)
+
+
+def test_cache_hit_miss_and_expiry(tmp_path):
+    cache = PresignedUrlCache(tmp_path / "urls.sqlite", min_lifetime=60)
+    assert cache.get("bucket", "key", "etag") is None
+    cache.put("bucket", "key", "etag", "https://url", time.time() + 3600)
+    assert cache.get("bucket", "key", "etag") == "https://url"
+
+    """another ETag is another object"""
+    assert cache.get("bucket", "key", "other-etag") is None
+    """a url about to expire is not handed back"""
+    cache.put("bucket", "soon", "etag", "https://soon", time.time() + 30)
+    assert cache.get("bucket", "soon", "etag") is None
+
+    cache.invalidate("bucket", "key")
+    assert cache.get("bucket", "key", "etag") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 4, 1)
+
+
+def test_urls_reused_until_reupload(tmp_path, monkeypatch):
+    cache = PresignedUrlCache(tmp_path / "urls.sqlite", min_lifetime=60)
+    monkeypatch.setattr(config, "_presigned_url_cache", cache)
+    monkeypatch.setattr(upload, "_transfer_manager", None)
+    set_transfer_manager(S3TransferManager(client=FilesystemS3Client(tmp_path / "s3")))
+    local_file = tmp_path / "tokenized_EN0001.txt"
+    local_file.write_text("I am a student.\n")
+
+    def upload_and_sign():
+        stats = {}
+        upload_file_to_s3(local_file, "bucket", "tokenized_en/file.txt", stats=stats)
+        """the stand-in urls carry their expiry, a new url differs from the last one"""
+        time.sleep(1.1)
+        return create_s3_file_url("bucket", "tokenized_en/file.txt", etag=stats["etag"])
+
+    url = upload_and_sign()
+    assert upload_and_sign() == url
+    local_file.write_text("I am a teacher.\n")
+    assert upload_and_sign() != url
+    assert cache.stats()["hits"] == 1
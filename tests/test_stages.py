@@ -0,0 +1,131 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from mt_aligner_prep_tool.stages import Stage, StagedPipeline
+
+
+def test_items_go_through_all_stages():
+    results, errors, done = [], [], []
+    lock = threading.Lock()
+
+    def fail_on_three(item):
+        if item == 3:
+            raise ValueError("three")
+        return item
+
+    def collect(item):
+        with lock:
+            results.append(item)
+        return item
+
+    stages = [
+        Stage("double", lambda item: item * 2 if item != 5 else None, concurrency=3),
+        Stage("fail", fail_on_three, concurrency=2),
+        Stage("slow", lambda item: time.sleep(0.001) or item, concurrency=4),
+        Stage("collect", collect),
+    ]
+    pipeline = StagedPipeline(
+        stages,
+        on_error=lambda stage, item, e: errors.append((stage, item)),
+        on_done=done.append,
+    )
+    items = [1, 2, 3, 4, 5] + list(range(6, 50))
+    completed = pipeline.run(iter(n if n != 3 else 1.5 for n in items), total=len(items))
+
+    """5 is dropped by the first stage and 1.5 * 2 fails in the second one"""
+    assert sorted(results) == sorted(n * 2 for n in items if n not in (3, 5))
+    assert completed == len(items) - 2
+    assert errors == [("fail", 3)]
+    """the dropped item is done too, the failed one isn't"""
+    assert sorted(done) == sorted(results + [5])
+
+
+def test_backpressure_bounds_queued_items():
+    fed = []
+    max_ahead = []
+
+    def feed():
+        for n in range(100):
+            fed.append(n)
+            yield n
+
+    def slow(item):
+        max_ahead.append(len(fed) - item)
+        time.sleep(0.001)
+        return item
+
+    stages = [Stage("slow", slow, concurrency=1, queue_size=5)]
+    assert StagedPipeline(stages).run(feed()) == 100
+    assert max(max_ahead) <= 5 + 2
+
+
+def test_progress_in_bytes():
+    sizes = {"small": 10, "large": 1000}
+    pipeline = StagedPipeline(
+        [Stage("first", lambda item: item), Stage("second", lambda item: item)],
+        item_size=sizes.get,
+    )
+    assert pipeline.run(["large", "small"], total=1010) == 2
+    assert [bar.n for bar in pipeline._bars] == [1010, 1010]
+
+
+def test_failing_items_iterator_is_raised():
+    done = []
+
+    def feed():
+        yield from range(5)
+        raise RuntimeError("queue unavailable")
+
+    pipeline = StagedPipeline(
+        [Stage("first", lambda item: item, concurrency=2), Stage("second", lambda item: item)],
+        on_done=done.append,
+    )
+    with pytest.raises(RuntimeError, match="queue unavailable"):
+        pipeline.run(feed())
+    """the items taken before the error went through"""
+    assert sorted(done) == list(range(5))
+
+
+def test_failing_callbacks_dont_stop_the_workers():
+    def odd_only(item):
+        if item % 2 == 0:
+            raise ValueError(item)
+        return item
+
+    def fail(*args):
+        raise RuntimeError("store unavailable")
+
+    pipeline = StagedPipeline(
+        [Stage("first", odd_only, concurrency=2), Stage("second", lambda item: item)],
+        on_error=fail,
+        on_done=fail,
+    )
+    assert pipeline.run(range(10)) == 5
+
+
+def test_coroutine_stage_runs_items_on_one_thread():
+    threads, in_progress, max_in_progress = set(), [0], [0]
+
+    async def align(item):
+        threads.add(threading.get_ident())
+        in_progress[0] += 1
+        max_in_progress[0] = max(max_in_progress[0], in_progress[0])
+        await asyncio.sleep(0.01)
+        in_progress[0] -= 1
+        if item == 3:
+            raise ValueError("three")
+        return item
+
+    errors, done = [], []
+    pipeline = StagedPipeline(
+        [Stage("first", lambda item: item, concurrency=2), Stage("align", align, concurrency=4)],
+        on_error=lambda stage, item, e: errors.append(item),
+        on_done=done.append,
+    )
+    assert pipeline.run(range(20)) == 19
+    assert len(threads) == 1
+    assert max_in_progress[0] == 4
+    assert errors == [3] and sorted(done) == [n for n in range(20) if n != 3]
@@ -0,0 +1,24 @@
+import requests
+
+from mt_aligner_prep_tool.standins import AlignerStubServer, FilesystemS3Client
+from mt_aligner_prep_tool.upload import S3TransferManager
+
+
+def test_filesystem_s3_client_with_transfer_manager(tmp_path):
+    local_file = tmp_path / "tokenized_BO0001.txt"
+    local_file.write_text("ཀ་ཁ་ག།\n")
+    client = FilesystemS3Client(tmp_path / "s3")
+    manager = S3TransferManager(client=client)
+
+    assert manager.upload_file(local_file, "bucket", "tokenized/BO0001.txt") is True
+    assert client.get_object_path("bucket", "tokenized/BO0001.txt").read_text() == "ཀ་ཁ་ག།\n"
+    """the stand-in keeps the checksum metadata, so unchanged files are skipped"""
+    assert manager.upload_file(local_file, "bucket", "tokenized/BO0001.txt") is False
+    assert manager.create_file_url("bucket", "tokenized/BO0001.txt", 60).startswith("file://")
+
+
+def test_aligner_stub_server():
+    with AlignerStubServer() as server:
+        response = requests.post(server.url, json={"inputs": {"text_id": "0001"}})
+    assert response.json() == {"text_id": "0001"}
+    assert server.requests_count == 1
@@ -0,0 +1,80 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from mt_aligner_prep_tool.tm_checker import check_repos_exist, list_org_repos
+
+
+class ListingStubHandler(BaseHTTPRequestHandler):
+    """Lists `repos` of any organization two per page, answering If-None-Match with 304."""
+
+    repos = [f"TM{i:04}" for i in range(5)]
+    requests_log = []
+
+    def do_GET(self):
+        page = int(parse_qs(urlparse(self.path).query).get("page", ["1"])[0])
+        etag = f'"page-{page}"'
+        self.requests_log.append((page, self.headers.get("If-None-Match")))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = json.dumps(
+            [{"name": name} for name in self.repos[(page - 1) * 2 : page * 2]]
+        ).encode()
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        if page * 2 < len(self.repos):
+            next_url = f"http://{self.headers['Host']}{urlparse(self.path).path}?per_page=2&page={page + 1}"  # noqa
+            self.send_header("Link", f'<{next_url}>; rel="next"')
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def listing_stub():
+    ListingStubHandler.requests_log = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ListingStubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_list_org_repos_is_cached_and_revalidated(listing_stub, tmp_path):
+    repos = list_org_repos("MonlamAI", listing_stub, cache_path=tmp_path)
+    assert repos == {f"tm{i:04}" for i in range(5)}
+    assert [page for page, _ in ListingStubHandler.requests_log] == [1, 2, 3]
+
+    """within the ttl the listing comes from disk"""
+    ListingStubHandler.requests_log = []
+    assert list_org_repos("MonlamAI", listing_stub, cache_path=tmp_path) == repos
+    assert ListingStubHandler.requests_log == []
+
+    """after the ttl every page is revalidated with its ETag"""
+    assert list_org_repos("MonlamAI", listing_stub, cache_path=tmp_path, ttl=-1) == repos
+    assert ListingStubHandler.requests_log == [
+        (1, '"page-1"'),
+        (2, '"page-2"'),
+        (3, '"page-3"'),
+    ]
+
+
+def test_check_repos_exist_without_ssh_fallback(listing_stub, tmp_path):
+    existing_repos = check_repos_exist(
+        "MonlamAI",
+        ["TM0001", "TM0004", "TM9999"],
+        api_url=listing_stub,
+        ssh_fallback=False,
+        cache_path=tmp_path,
+    )
+    assert existing_repos == ["TM0001", "TM0004"]
@@ -0,0 +1,38 @@
+from mt_aligner_prep_tool.tokenization_cache import TokenizationCache
+
+
+def test_cache_hit_and_miss(tmp_path):
+    cache = TokenizationCache(tmp_path / "cache", max_size_bytes=1024)
+    source_file = tmp_path / "source.txt"
+    source_file.write_text("source text")
+    tokenized_file = tmp_path / "tokenized.txt"
+    tokenized_file.write_text("tokenized text")
+
+    key = cache.get_key(source_file, "en", "en-1")
+    assert not cache.get(key, tmp_path / "output.txt")
+    cache.put(key, tokenized_file)
+    assert cache.get(key, tmp_path / "output.txt")
+    assert (tmp_path / "output.txt").read_text() == "tokenized text"
+
+    """a changed source or tokenizer version is a different key"""
+    assert cache.get_key(source_file, "en", "en-2") != key
+    source_file.write_text("changed source text")
+    assert cache.get_key(source_file, "en", "en-1") != key
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = TokenizationCache(tmp_path / "cache", max_size_bytes=25)
+    tokenized_file = tmp_path / "tokenized.txt"
+    tokenized_file.write_text("x" * 10)
+
+    cache.put("a", tokenized_file)
+    cache.put("b", tokenized_file)
+    assert cache.get("a", tmp_path / "output.txt")
+    cache.put("c", tokenized_file)
+
+    assert cache.get("a", tmp_path / "output.txt")
+    assert not cache.get("b", tmp_path / "output.txt")
+    assert cache.stats()["size"] == 20
@@ -1,4 +1,17 @@
-from mt_aligner_prep_tool.tokenizers import sent_tokenize
+import subprocess
+import sys
+
+import pytest
+
+from mt_aligner_prep_tool.tokenizers import (
+    bo_sent_tokenize_file,
+    bo_tokenize_chunks,
+    en_sent_tokenize_file,
+    read_bo_chunks,
+    sent_tokenize,
+    split_text_into_mb_chunks,
+)
+from mt_aligner_prep_tool.utility import atomic_write
 
 
 def test_tibetan_tokenizer():
@@ -16,3 +29,81 @@ def test_english_tokenizer():
     english_text = "I am a student. I am a student. I am a student."
     tokenized_text = sent_tokenize(english_text, lang="en")
     assert tokenized_text == "I am a student.\nI am a student.\nI am a student."
+
+
+def test_streaming_english_tokenizer(tmp_path):
+    english_text = (
+        "“Where are you going?” he asked.  She said\tnothing...\r\n"
+        "Dr. Smith arrived at 3.30 p.m. 1️⃣ It was late!\n\n"
+        "The end.Then   more text follows here, and the final sentence has no period"
+    ) * 20
+    input_file = tmp_path / "en.txt"
+    input_file.write_text(english_text)
+    expected = sent_tokenize(input_file.read_text(), lang="en")
+
+    for window_size in (1, 7, 64, 1000):
+        output_file = tmp_path / f"tokenized_{window_size}.txt"
+        en_sent_tokenize_file(input_file, output_file, window_size=window_size)
+        assert output_file.read_text() == expected
+
+
+def test_tibetan_chunks_end_at_sentence_boundaries():
+    tibetan_text = "ཁྱོད་འཆི་དུས་སུ་ངུ་སྲིད། །རོ་བྷེན་ཤར་མས་བརྩམས།།\nཁྱེད་ཀྱི་འཇོན་ནུས་རྟོགས་པར་གྱིས། " * 50
+    chunk_size_mb = 500 / 1024 / 1024
+
+    chunks = list(split_text_into_mb_chunks(tibetan_text, chunk_size_mb))
+    assert len(chunks) > 1
+    assert "".join(chunks) == tibetan_text
+    for chunk in chunks:
+        assert len(chunk.encode("utf-8")) <= 500
+        assert chunk.rstrip()[-1] == "།"
+        assert not chunk.lstrip().startswith("།")
+
+    tokenized_chunks = "\n".join(bo_tokenize_chunks(chunks, num_processes=2)) + "\n"
+    assert tokenized_chunks == sent_tokenize(tibetan_text, lang="bo")
+
+
+def test_streaming_tibetan_tokenizer(tmp_path):
+    tibetan_text = "ཁྱོད་འཆི་དུས་སུ་ངུ་སྲིད། །རོ་བྷེན་ཤར་མས་1️⃣བརྩམས།།\nཁྱེད་ཀྱི་འཇོན་ནུས་2️⃣རྟོགས་པར་གྱིས། " * 50
+    input_file = tmp_path / "bo.txt"
+    input_file.write_text(tibetan_text)
+    expected = sent_tokenize(tibetan_text, lang="bo")
+    text_without_emojis = tibetan_text.replace("1️⃣", "").replace("2️⃣", "")
+
+    """chunk sizes cutting emojis and characters at the block boundaries"""
+    for chunk_size in (100, 333, 500, 100000):
+        chunk_size_mb = chunk_size / 1024 / 1024
+        chunks = list(read_bo_chunks(input_file, chunk_size_mb))
+        assert chunks == list(split_text_into_mb_chunks(text_without_emojis, chunk_size_mb))
+
+        output_file = tmp_path / f"tokenized_{chunk_size}.txt"
+        sentences_count = bo_sent_tokenize_file(
+            input_file, output_file, chunk_size_mb=chunk_size_mb
+        )
+        assert output_file.read_text() == expected
+        assert sentences_count == expected.count("\n")
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_atomic_write_keeps_old_file_on_error(tmp_path):
+    output_file = tmp_path / "tokenized.txt"
+    output_file.write_text("old")
+    with pytest.raises(ValueError):
+        with atomic_write(output_file) as file:
+            file.write("partial")
+            raise ValueError
+    assert output_file.read_text() == "old"
+    assert [file.name for file in tmp_path.iterdir()] == ["tokenized.txt"]
+
+
+def test_clis_import_without_tokenizers():
+    """merge_branch and tm_checker never tokenize, they must not load spacy or bo_sent_tokenizer"""
+    code = (
+        "import sys\n"
+        "import mt_aligner_prep_tool.merge_branch, mt_aligner_prep_tool.tm_checker\n"
+        "print([m for m in ('spacy', 'bo_sent_tokenizer', 'botok') if m in sys.modules])\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True, text=True
+    )
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,120 @@
+import gzip
+import threading
+import time
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+from mt_aligner_prep_tool.standins import FilesystemS3Client
+from mt_aligner_prep_tool.upload import S3TransferManager, get_compressed_key
+from mt_aligner_prep_tool.utility import get_file_hash
+
+
+def get_stubbed_manager():
+    client = boto3.client(
+        "s3",
+        region_name="us-east-1",
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+    )
+    return S3TransferManager(client=client), Stubber(client)
+
+
+def test_upload_skipped_when_checksum_matches(tmp_path):
+    local_file = tmp_path / "tokenized_BO0001.txt"
+    local_file.write_text("ཁྱོད་འཆི་དུས་སུ་ངུ་སྲིད།\n")
+    manager, stubber = get_stubbed_manager()
+    stubber.add_response(
+        "head_object",
+        {"Metadata": {"sha256": get_file_hash(local_file)}, "ETag": '"etag"'},
+        {"Bucket": "bucket", "Key": "tokenized_bo/tokenized_BO0001.txt"},
+    )
+    with stubber:
+        assert not manager.upload_file(
+            local_file, "bucket", "tokenized_bo/tokenized_BO0001.txt"
+        )
+    stubber.assert_no_pending_responses()
+
+
+def test_upload_skipped_when_etag_matches_md5(tmp_path):
+    local_file = tmp_path / "tokenized_EN0001.txt"
+    local_file.write_text("I am a student.\n")
+    manager, stubber = get_stubbed_manager()
+    stubber.add_response(
+        "head_object", {"ETag": f'"{get_file_hash(local_file, "md5")}"'}
+    )
+    with stubber:
+        assert not manager.upload_file(local_file, "bucket", "tokenized_en/file.txt")
+
+
+def test_upload_when_object_is_missing(tmp_path):
+    local_file = tmp_path / "tokenized_EN0001.txt"
+    local_file.write_text("I am a student.\n")
+    manager, stubber = get_stubbed_manager()
+    stubber.add_client_error("head_object", service_error_code="404", http_status_code=404)
+    stubber.add_response("put_object", {"ETag": '"etag"'})
+    with stubber:
+        assert manager.upload_file(local_file, "bucket", "tokenized_en/file.txt")
+    stubber.assert_no_pending_responses()
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressed_upload(tmp_path, compression):
+    if compression == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+    local_file = tmp_path / "tokenized_BO0001.txt"
+    local_file.write_text("ཁྱོད་འཆི་དུས་སུ་ངུ་སྲིད།\n" * 1000)
+    client = FilesystemS3Client(tmp_path / "s3")
+    manager = S3TransferManager(client=client)
+    s3_file = get_compressed_key("tokenized_bo/tokenized_BO0001.txt", compression)
+    stats = {}
+
+    assert manager.upload_file(local_file, "bucket", s3_file, compression, stats)
+    assert stats["raw_bytes"] == local_file.stat().st_size
+    assert 0 < stats["sent_bytes"] < stats["raw_bytes"] / 10
+    head = client.head_object(Bucket="bucket", Key=s3_file)
+    assert head["ContentEncoding"] == compression
+    data = client.get_object_path("bucket", s3_file).read_bytes()
+    if compression == "gzip":
+        data = gzip.decompress(data)
+    else:
+        data = zstandard.ZstdDecompressor().decompress(data)
+    assert data == local_file.read_bytes()
+    """the compressed temporary file is removed"""
+    assert set(tmp_path.iterdir()) == {local_file, tmp_path / "s3"}
+
+    """unchanged files are skipped without being compressed again"""
+    assert not manager.upload_file(local_file, "bucket", s3_file, compression, stats)
+    assert stats["sent_bytes"] == 0
+
+
+def test_compressed_key():
+    assert get_compressed_key("tokenized_en/file.txt", None) == "tokenized_en/file.txt"
+    assert get_compressed_key("tokenized_en/file.txt", "gzip") == "tokenized_en/file.txt.gz"
+    with pytest.raises(ValueError):
+        get_compressed_key("tokenized_en/file.txt", "brotli")
+
+
+def test_one_client_per_region_across_threads():
+    manager = S3TransferManager()
+    created = []
+
+    class SlowSession:
+        def client(self, service_name, region_name=None, endpoint_url=None):
+            time.sleep(0.01)
+            created.append(region_name)
+            return object()
+
+    manager.session = SlowSession()
+    clients = []
+    threads = [
+        threading.Thread(target=lambda: clients.append(manager.get_client("eu-west-1")))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert created == ["eu-west-1"]
+    assert len({id(client) for client in clients}) == 1
@@ -0,0 +1,120 @@
+import time
+from contextlib import contextmanager
+from multiprocessing import Pool
+
+import pytest
+
+from mt_aligner_prep_tool.workqueue import (
+    HttpQueueStore,
+    LeaseKeeper,
+    QueueServer,
+    QueueStoreError,
+    SqliteQueueStore,
+    format_status,
+    open_queue_store,
+)
+
+
+@contextmanager
+def open_queue(kind, db_path, **kwargs):
+    """the same queue, used from this process or through a queue server"""
+    store = SqliteQueueStore(db_path, **kwargs)
+    if kind == "sqlite":
+        yield store
+    else:
+        with QueueServer(store, token="secret") as server:
+            yield HttpQueueStore(server.url, token="secret")
+
+
+@pytest.mark.parametrize("kind", ["sqlite", "http"])
+def test_claim_complete_and_fail(tmp_path, kind):
+    with open_queue(kind, tmp_path / "queue.sqlite", max_attempts=2) as queue:
+        check_claim_complete_and_fail(queue)
+
+
+def check_claim_complete_and_fail(queue):
+    assert queue.add(["0001", "0002", "0003"]) == 3
+    assert queue.add(["0003", "0004"]) == 1
+
+    assert queue.claim("a", 2) == ["0001", "0002"]
+    assert queue.claim("b", 1) == ["0003"]
+    queue.complete("0001", "a")
+    queue.fail("0002", "a", "download failed")
+    queue.release("0003", "b")
+
+    """the failed id is retried once more, the released one didn't count as an attempt"""
+    assert queue.claim("b", 10) == ["0002", "0003", "0004"]
+    queue.fail("0002", "b", "download failed again")
+    status = queue.status()
+    assert status["ids"] == {"pending": 0, "leased": 2, "done": 1, "failed": 1}
+    assert status["workers"]["a"]["done"] == 1
+    assert status["workers"]["b"]["failed"] == 1
+    assert "4 ids: 0 pending, 2 leased" in format_status(status)
+
+    assert queue.requeue_failed() == 1
+    assert queue.claim("a", 10) == ["0002"]
+
+
+@pytest.mark.parametrize("kind", ["sqlite", "http"])
+def test_expired_leases_are_claimed_again(tmp_path, kind):
+    with open_queue(kind, tmp_path / "queue.sqlite", lease_seconds=0.2, max_attempts=2) as queue:
+        check_expired_leases_are_claimed_again(queue)
+
+
+def check_expired_leases_are_claimed_again(queue):
+    queue.add(["0001", "0002"])
+    assert queue.claim("crashed", 2) == ["0001", "0002"]
+    assert queue.claim("b", 2) == []
+
+    with LeaseKeeper(queue, "crashed", interval=0.05):
+        time.sleep(0.3)
+        """the heartbeats keep the leases"""
+        assert queue.claim("b", 2) == []
+    time.sleep(0.3)
+    assert queue.status()["expired_leases"] == 2
+    assert queue.claim("b", 2) == ["0001", "0002"]
+    assert queue.heartbeat("crashed") == 0
+
+    """after max_attempts expired leases the id is failed"""
+    time.sleep(0.3)
+    assert queue.claim("c", 2) == []
+    assert queue.status()["ids"]["failed"] == 2
+    assert not queue.has_work()
+
+
+def claim_all(location):
+    queue = open_queue_store(location, token="secret")
+    claimed = []
+    while True:
+        ids = queue.claim(f"worker-{id(claimed)}", 3)
+        if not ids:
+            return claimed
+        claimed.extend(ids)
+        for id_ in ids:
+            queue.complete(id_, "worker")
+
+
+def test_concurrent_workers_never_share_an_id(tmp_path):
+    db_path = tmp_path / "queue.sqlite"
+    ids = [f"{i:04}" for i in range(200)]
+    SqliteQueueStore(db_path).add(ids)
+    with Pool(4) as pool:
+        claimed = [id_ for ids_ in pool.map(claim_all, [str(db_path)] * 4) for id_ in ids_]
+    assert sorted(claimed) == ids
+
+
+def test_workers_of_many_hosts_share_a_served_queue(tmp_path):
+    """the workers of other hosts only see the url, here processes of this one"""
+    ids = [f"{i:04}" for i in range(200)]
+    store = SqliteQueueStore(tmp_path / "queue.sqlite", lease_seconds=30)
+    with QueueServer(store, token="secret") as server:
+        client = open_queue_store(server.url, token="secret")
+        assert isinstance(client, HttpQueueStore) and client.lease_seconds == 30
+        client.add(ids)
+        with Pool(4) as pool:
+            claimed = [id_ for ids_ in pool.map(claim_all, [server.url] * 4) for id_ in ids_]
+        assert sorted(claimed) == ids
+        assert not client.has_work()
+
+        with pytest.raises(QueueStoreError):
+            HttpQueueStore(server.url, token="wrong")
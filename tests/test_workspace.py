@@ -0,0 +1,127 @@
+import os
+import subprocess
+import sys
+
+from mt_aligner_prep_tool.tokenization_cache import TokenizationCache
+from mt_aligner_prep_tool.workspace import CLONE, TOKENIZED, Workspace, format_report
+
+
+def make_clone(folder, name, size):
+    (folder / name).mkdir(parents=True)
+    (folder / name / f"{name}.txt").write_bytes(b"x" * size)
+    return folder / name
+
+
+def make_workspace(tmp_path, **kwargs):
+    return Workspace(
+        tmp_path / "workspace.sqlite",
+        [tmp_path / "tibetan_files", tmp_path / "english_files", tmp_path / "tm_files"],
+        tmp_path / "tokenized_files",
+        **kwargs,
+    )
+
+
+def test_evicts_least_recently_used_unpinned_clones(tmp_path):
+    workspace = make_workspace(tmp_path, max_size=2500)
+    bo_files = tmp_path / "tibetan_files"
+    for id_ in ("0001", "0002", "0003"):
+        workspace.record(id_, CLONE, [make_clone(bo_files, f"BO{id_}", 1000)])
+    assert workspace.total_size() == 3000
+
+    """0001 is the oldest but in use, 0002 goes instead"""
+    with workspace.pinned([bo_files / "BO0001"]):
+        evicted = workspace.evict()
+    assert [entry["id"] for entry in evicted] == ["0002"]
+    assert not (bo_files / "BO0002").exists()
+    assert (bo_files / "BO0001").exists() and (bo_files / "BO0003").exists()
+
+    """once unpinned, the oldest goes first"""
+    workspace.touch([bo_files / "BO0003"])
+    assert [entry["id"] for entry in workspace.evict(max_size=1000)] == ["0001"]
+
+    """pins of a process which is gone don't count"""
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    workspace.connection.execute(
+        "INSERT INTO path_pins (path, pid) VALUES (?, ?)", (str(bo_files / "BO0003"), process.pid)
+    )
+    assert workspace.get_pinned_paths() == set()
+    workspace.pin([bo_files / "BO0003"])
+    assert workspace.get_pinned_paths() == {str(bo_files / "BO0003")}
+    assert workspace.evict(max_size=0) == []
+
+
+def test_pins_are_per_path(tmp_path):
+    workspace = make_workspace(tmp_path, max_size=1000)
+    bo_clone = make_clone(tmp_path / "tibetan_files", "BO0001", 1000)
+    tm_clone = make_clone(tmp_path / "tm_files", "TM0001", 1000)
+    workspace.record("0001", CLONE, [bo_clone, tm_clone])
+
+    """a merge pins the TM clone of 0001, its BO clone can still go"""
+    with workspace.pinned([tm_clone]):
+        workspace.pin([bo_clone])
+        workspace.unpin([bo_clone])
+        assert [entry["path"] for entry in workspace.evict()] == [str(bo_clone)]
+    assert tm_clone.exists()
+
+
+def test_tokenization_cache_counts_against_the_cap(tmp_path):
+    cache = TokenizationCache(tmp_path / "tokenized_files" / "cache", max_size_bytes=10000)
+    tokenized_file = tmp_path / "tokenized.txt"
+    tokenized_file.write_bytes(b"x" * 1500)
+    cache.put("key", tokenized_file)
+
+    workspace = make_workspace(tmp_path, max_size=2500, tokenization_cache=cache)
+    for id_ in ("0001", "0002"):
+        workspace.record(id_, CLONE, [make_clone(tmp_path / "tibetan_files", f"BO{id_}", 1000)])
+    assert workspace.total_size() == 3500
+    assert [entry["id"] for entry in workspace.evict()] == ["0001"]
+    assert "1.5KB  tokenization cache" in format_report(workspace.report(), 2500, cache_size=1500)
+
+
+def test_tokenized_files_evicted_only_when_uploaded(tmp_path):
+    tokenized_files = tmp_path / "tokenized_files"
+    tokenized_files.mkdir()
+    paths = []
+    for name in ("tokenized_BO0001.txt", "tokenized_EN0001.txt"):
+        (tokenized_files / name).write_bytes(b"x" * 100)
+        paths.append(tokenized_files / name)
+
+    workspace = make_workspace(tmp_path, max_size=0)
+    workspace.record("0001", TOKENIZED, paths)
+    assert workspace.evict() == []
+
+    workspace.mark_uploaded("0001")
+    assert workspace.evict() == []
+
+    workspace.evict_tokenized = True
+    assert len(workspace.evict()) == 2
+    assert not any(path.exists() for path in paths)
+
+
+def test_scan_and_report(tmp_path):
+    make_clone(tmp_path / "tibetan_files", "BO0001", 2000)
+    make_clone(tmp_path / "english_files", "EN0001", 500)
+    (tmp_path / "tokenized_files" / "cache").mkdir(parents=True)
+    (tmp_path / "tokenized_files" / "tokenized_BO0001.txt").write_bytes(b"x" * 100)
+    (tmp_path / "tokenized_files" / "cache" / "entry").write_bytes(b"x" * 100)
+
+    workspace = make_workspace(tmp_path)
+    assert workspace.scan() == 3
+    assert workspace.scan() == 0
+    entries = workspace.report()
+    assert [(entry["id"], entry["kind"]) for entry in entries] == [
+        ("0001", CLONE),
+        ("0001", CLONE),
+        ("0001", TOKENIZED),
+    ]
+    assert entries[0]["size"] >= 2000
+
+    """removed outside of the workspace, forgotten on the next scan"""
+    os.remove(tmp_path / "tokenized_files" / "tokenized_BO0001.txt")
+    workspace.scan()
+    assert len(workspace.report()) == 2
+
+    report = format_report(workspace.report(), max_size=None, top=1)
+    assert "BO0001" in report and "EN0001" not in report
+    assert "total of 2 clone entries" in report